@@ -2,6 +2,8 @@
 ASGI config for Agrisens project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with ``uvicorn Agrisens.asgi:application`` so the async tile and
+time-series views share the server's event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
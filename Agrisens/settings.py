@@ -159,6 +159,41 @@ USE_TZ = True
 STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Content-addressed tile cache (see api/tile_cache.py)
+TILE_CACHE_DIR = MEDIA_ROOT / 'tiles'
+TILE_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Browser/proxy max-age for XYZ tiles; shorter while the date window is still open
+TILE_CACHE_MAX_AGE = 7 * 24 * 3600
+TILE_OPEN_WINDOW_MAX_AGE = 3600
+# Also coalesce identical tile renders across worker processes with flock()
+TILE_SINGLE_FLIGHT_FILE_LOCK = False
+# STAC search used to find the scenes behind each tile (see api/stac.py)
+STAC_API_URL = "https://earth-search.aws.element84.com/v1/search"
+STAC_COLLECTION = "sentinel-2-l2a"
+# Scene searches are cached on disk and shared by tiles and time series
+STAC_CACHE_DIR = MEDIA_ROOT / 'stac_cache'
+STAC_CACHE_TTL = 24 * 3600
+# GDAL options for remote COG reads, merged over api/raster_env.py's defaults
+RASTER_GDAL_OPTIONS = {}
+RASTER_DATASET_POOL_SIZE = 64
+# MBTiles archives written when a request asks for archive=true
+TILE_ARCHIVE_DIR = MEDIA_ROOT / 'tiles' / 'archives'
+# Retention of generated artifacts, enforced by manage.py sweep_storage.
+# Per category overrides of api/retention.py's defaults, e.g.
+# {'maps': {'max_bytes': 100 * 1024 ** 2, 'max_age': 3 * 24 * 3600}}
+STORAGE_RETENTION = {}
+ARTIFACT_MANIFEST = MEDIA_ROOT / 'artifacts.sqlite3'
+# Drop cached tiles unused for this many seconds (None: quota only)
+TILE_CACHE_MAX_IDLE = 30 * 24 * 3600
+# Reuse a time-series result whose date window was still open for this long
+TIME_SERIES_OPEN_WINDOW_TTL = 6 * 3600
+# Worker threads shared by all time-series jobs on this host (None: one per
+# CPU) and the most a single request may ask for (None: the whole budget).
+# See api/cpu_budget.py
+CPU_BUDGET = None
+TIME_SERIES_MAX_WORKERS = None
+CPU_BUDGET_DB = MEDIA_ROOT / 'cpu_budget.sqlite3'
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -4,5 +4,6 @@ from .models import *
 
 admin.site.register(Land)
 admin.site.register(FarmArea)
+admin.site.register(Job)
 
 
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .raster_env import configure_gdal
+        from .stac import install_vcube_search_cache
+        # Before any thread opens a COG, so GDAL picks the options up everywhere
+        configure_gdal()
+        # Time series share scene searches with the tile endpoints
+        install_vcube_search_cache()
@@ -0,0 +1,224 @@
+import contextlib
+import os
+import socket
+import sqlite3
+import time
+
+from django.conf import settings
+
+# Seconds between two checks for a free slot while over the fair share,
+# doubling up to SLOT_POLL_MAX_INTERVAL while the job keeps waiting
+SLOT_POLL_INTERVAL = 0.05
+SLOT_POLL_MAX_INTERVAL = 1.0
+
+
+def budget_size():
+    """Worker threads all time-series jobs on this host may run at once."""
+    return max(1, int(getattr(settings, 'CPU_BUDGET', None) or os.cpu_count() or 1))
+
+
+def max_workers():
+    """Upper bound on the ``workers`` a single request may ask for."""
+    return max(1, int(getattr(settings, 'TIME_SERIES_MAX_WORKERS', None) or budget_size()))
+
+
+def fair_shares(leases, budget):
+    """
+    Split ``budget`` worker slots between ``leases`` ({id: (weight, demand)},
+    oldest first) in proportion to their weights, never giving a lease more
+    than its demand; what capped leases leave is shared by the rest
+    (water-filling). While there are no more leases than slots every lease
+    gets at least one so none starves; past that the newest get none and
+    queue behind the older ones, so the shares never exceed ``budget``.
+    """
+    if len(leases) > budget:
+        return {lease_id: 1 if index < budget else 0 for index, lease_id in enumerate(leases)}
+    shares = _water_fill(leases, budget)
+    for lease_id in leases:
+        if shares[lease_id] == 0:
+            # Rounded down to nothing: take the slot from the largest share
+            donor = max(shares, key=shares.get)
+            shares[donor] -= 1
+            shares[lease_id] = 1
+    return shares
+
+
+def _water_fill(leases, budget):
+    shares = {}
+    remaining = dict(leases)
+    left = budget
+    while remaining:
+        total_weight = sum(weight for weight, _ in remaining.values())
+        capped = {
+            lease_id: demand for lease_id, (weight, demand) in remaining.items()
+            if demand <= left * weight / total_weight
+        }
+        if not capped:
+            break
+        for lease_id, demand in capped.items():
+            shares[lease_id] = demand
+            left -= demand
+            del remaining[lease_id]
+    if remaining:
+        total_weight = sum(weight for weight, _ in remaining.values())
+        exact = {lease_id: left * weight / total_weight for lease_id, (weight, _) in remaining.items()}
+        for lease_id, value in exact.items():
+            shares[lease_id] = int(value)
+        # Hand out the slots lost to rounding, largest remainder first
+        spare = left - sum(shares[lease_id] for lease_id in remaining)
+        for lease_id in sorted(exact, key=lambda lease_id: exact[lease_id] - int(exact[lease_id]), reverse=True):
+            if spare <= 0:
+                break
+            shares[lease_id] += 1
+            spare -= 1
+    return shares
+
+
+class CPUBudget:
+    """
+    A host-wide budget of worker slots shared by time-series jobs in every
+    process, kept in a small SQLite database.
+
+    A job takes a lease with its weight and demand (the workers it asked
+    for). Each unit of work then holds one slot; a job may only hold as many
+    slots as its current fair share (see fair_shares), so shares shrink as
+    jobs arrive and grow again as they finish, while the total stays within
+    the budget: with more jobs than slots the newest wait for a slot of
+    their own. Leases of processes that died on this host are dropped, both
+    when a job opens a lease and while jobs poll for a slot, so a crashed
+    worker never holds on to its share.
+    """
+
+    def __init__(self, path=None, budget=None):
+        self.path = str(path or getattr(settings, 'CPU_BUDGET_DB', os.path.join(settings.MEDIA_ROOT, 'cpu_budget.sqlite3')))
+        self.budget = budget or budget_size()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = self._connect()
+        try:
+            # Waiting jobs read the table without blocking the ones taking slots
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS leases ('
+                ' lease_id TEXT PRIMARY KEY,'
+                ' host TEXT NOT NULL,'
+                ' pid INTEGER NOT NULL,'
+                ' weight REAL NOT NULL,'
+                ' demand INTEGER NOT NULL,'
+                ' in_use INTEGER NOT NULL DEFAULT 0,'
+                ' acquired_at REAL NOT NULL)'
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        try:
+            # Take the write lock up front so shares are computed on a consistent view
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _is_dead(host, pid):
+        if host != socket.gethostname():
+            # Processes on other hosts can't be checked from here
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def _drop_dead_leases(self, conn):
+        for lease_id, host, pid in conn.execute('SELECT lease_id, host, pid FROM leases').fetchall():
+            if self._is_dead(host, pid):
+                conn.execute('DELETE FROM leases WHERE lease_id = ?', (lease_id,))
+
+    def shares(self, conn):
+        """Fair shares of the live leases; leases of dead processes count for nothing even before they are dropped."""
+        rows = conn.execute(
+            'SELECT lease_id, host, pid, weight, demand FROM leases ORDER BY acquired_at, lease_id'
+        ).fetchall()
+        return fair_shares(
+            {lease_id: (weight, demand) for lease_id, host, pid, weight, demand in rows if not self._is_dead(host, pid)},
+            self.budget,
+        )
+
+    def open(self, lease_id, weight=1.0, demand=1):
+        with self._transaction() as conn:
+            self._drop_dead_leases(conn)
+            conn.execute(
+                'INSERT OR REPLACE INTO leases (lease_id, host, pid, weight, demand, in_use, acquired_at)'
+                ' VALUES (?, ?, ?, ?, ?, 0, ?)',
+                (str(lease_id), socket.gethostname(), os.getpid(), float(weight), int(demand), time.time()),
+            )
+
+    def close(self, lease_id):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM leases WHERE lease_id = ?', (str(lease_id),))
+
+    def may_acquire(self, lease_id):
+        """Whether ``lease_id`` looks below its fair share, checked without taking the write lock."""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT in_use FROM leases WHERE lease_id = ?', (str(lease_id),)).fetchone()
+            return row is None or row[0] < self.shares(conn).get(str(lease_id), 1)
+        finally:
+            conn.close()
+
+    def try_acquire(self, lease_id):
+        """Take one slot for ``lease_id`` if it is below its fair share; returns whether it did."""
+        with self._transaction() as conn:
+            self._drop_dead_leases(conn)
+            row = conn.execute('SELECT in_use FROM leases WHERE lease_id = ?', (str(lease_id),)).fetchone()
+            if row is None:
+                raise ValueError(f"No CPU budget lease {lease_id}")
+            if row[0] >= self.shares(conn).get(str(lease_id), 1):
+                return False
+            conn.execute('UPDATE leases SET in_use = in_use + 1 WHERE lease_id = ?', (str(lease_id),))
+            return True
+
+    def release(self, lease_id):
+        with self._transaction() as conn:
+            conn.execute('UPDATE leases SET in_use = MAX(in_use - 1, 0) WHERE lease_id = ?', (str(lease_id),))
+
+    @contextlib.contextmanager
+    def lease(self, lease_id, weight=1.0, demand=1):
+        """Hold a lease for the enclosed job and yield a Lease to take slots from."""
+        self.open(lease_id, weight, demand)
+        try:
+            yield Lease(self, str(lease_id))
+        finally:
+            self.close(lease_id)
+
+
+class Lease:
+    def __init__(self, budget, lease_id):
+        self.budget = budget
+        self.lease_id = lease_id
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Block until the job is within its fair share, then hold one slot."""
+        delay = SLOT_POLL_INTERVAL
+        # Only take the write lock once a plain read says a slot is free
+        while not (self.budget.may_acquire(self.lease_id) and self.budget.try_acquire(self.lease_id)):
+            time.sleep(delay)
+            delay = min(delay * 2, SLOT_POLL_MAX_INTERVAL)
+        try:
+            yield
+        finally:
+            self.budget.release(self.lease_id)
@@ -0,0 +1,80 @@
+import mercantile
+from django.core import signing
+from PIL import Image, ImageDraw
+from shapely.geometry import Polygon, box
+from shapely.prepared import prep
+
+
+def farm_area_polygon(area_coordinates):
+    """
+    Build a shapely polygon from ``FarmArea.area_coordinates``.
+
+    The model stores ``[latitude, longitude]`` pairs; shapely (like the rest
+    of the tile code) works in ``(longitude, latitude)`` order.
+    """
+    if not area_coordinates or len(area_coordinates) < 3:
+        raise ValueError("Farm area needs at least 3 boundary points")
+    polygon = Polygon([(float(lng), float(lat)) for lat, lng in area_coordinates])
+    if not polygon.is_valid:
+        # Self-intersecting outlines drawn by hand are common; repair them
+        polygon = polygon.buffer(0)
+    if polygon.is_empty:
+        raise ValueError("Farm area boundary is empty")
+    return polygon
+
+
+# Namespaces clip tokens so no other signed value can be passed off as one
+CLIP_TOKEN_SALT = 'api.farm-area-clip'
+
+
+def farm_area_clip_token(farm_area_id):
+    """
+    Sign ``farm_area_id`` for the tile URLs of a generated map, so the page
+    can load tiles clipped to a farm its viewer could not name directly.
+    """
+    return signing.dumps(farm_area_id, salt=CLIP_TOKEN_SALT, compress=True)
+
+
+def farm_area_id_from_clip_token(token):
+    """Return the farm area id of a clip token; raises ValueError when it was tampered with."""
+    try:
+        return int(signing.loads(token, salt=CLIP_TOKEN_SALT))
+    except (signing.BadSignature, TypeError, ValueError):
+        raise ValueError("Invalid clip token")
+
+
+def tiles_in_polygon(polygon, zoom):
+    """Return the zoom-level tiles whose bounds intersect ``polygon``."""
+    prepared = prep(polygon)
+    return [
+        tile for tile in mercantile.tiles(*polygon.bounds, zooms=zoom)
+        if prepared.intersects(box(*mercantile.bounds(tile)))
+    ]
+
+
+def _polygon_parts(geometry):
+    return list(geometry.geoms) if hasattr(geometry, 'geoms') else [geometry]
+
+
+def polygon_mask(polygon, x, y, z, size):
+    """Rasterize ``polygon`` into an ``L`` mask (255 inside) for tile x/y/z."""
+    left, bottom, right, top = mercantile.xy_bounds(x, y, z)
+    width, height = size
+
+    def to_pixels(coords):
+        points = []
+        for lng, lat in coords:
+            mx, my = mercantile.xy(lng, lat)
+            points.append(((mx - left) / (right - left) * width, (top - my) / (top - bottom) * height))
+        return points
+
+    mask = Image.new('L', size, 0)
+    draw = ImageDraw.Draw(mask)
+    for part in _polygon_parts(polygon):
+        if part.geom_type != 'Polygon':
+            continue
+        draw.polygon(to_pixels(part.exterior.coords), fill=255)
+        for interior in part.interiors:
+            draw.polygon(to_pixels(interior.coords), fill=0)
+    return mask
+
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import traceback
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .time_series import run_time_series
+from .utils import generate_tiles_and_map, tile_generation_kwargs
+
+# Minimum seconds between two progress writes for the same job
+PROGRESS_WRITE_INTERVAL = 1.0
+# Claims of a job whose worker keeps dying before it is marked failed; JOB_MAX_ATTEMPTS overrides
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(kind, params, **fields):
+    """Queue a job of ``kind`` with a JSON-serialisable ``params`` dict."""
+    return Job.objects.create(kind=kind, params=params, **fields)
+
+
+def claim_next_job(worker):
+    """
+    Atomically move the oldest queued job to running and return it, or
+    return None when the queue is empty. Safe to call from several
+    processes at once: the conditional UPDATE only succeeds for one of them.
+    """
+    while True:
+        with transaction.atomic():
+            job_id = (
+                Job.objects.filter(status=Job.STATUS_QUEUED)
+                .order_by('created_at')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if job_id is None:
+                return None
+            claimed = Job.objects.filter(pk=job_id, status=Job.STATUS_QUEUED).update(
+                status=Job.STATUS_RUNNING,
+                worker=worker,
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1,
+            )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+
+
+def requeue_orphaned_jobs():
+    """
+    Put running jobs back in the queue when their worker process on this
+    host is gone. A job that has already been claimed JOB_MAX_ATTEMPTS times
+    is marked failed instead, so one that kills its worker doesn't do so
+    forever. Returns the number of jobs re-queued.
+    """
+    host = socket.gethostname()
+    max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    requeued = 0
+    for job in Job.objects.filter(status=Job.STATUS_RUNNING, worker__startswith=f"{host}:"):
+        pid = int(job.worker.rsplit(':', 1)[1])
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            running = Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING)
+            if job.attempts >= max_attempts:
+                print(f"Giving up on {job.kind} job {job.id}: its worker died {job.attempts} times")
+                running.update(
+                    status=Job.STATUS_FAILED,
+                    error=f"Worker died while running the job ({job.attempts} attempts)",
+                    finished_at=timezone.now(),
+                )
+            else:
+                requeued += running.update(
+                    status=Job.STATUS_QUEUED, worker=None, started_at=None, progress_done=0, phase=None
+                )
+        except PermissionError:
+            pass
+    return requeued
+
+
+def _progress_reporter(job):
+    last_write = 0.0
+
+    def write(done, total):
+        Job.objects.filter(pk=job.pk).update(progress_done=done, progress_total=total)
+
+    async def on_progress(done, total):
+        nonlocal last_write
+        now = time.monotonic()
+        if done < total and now - last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        last_write = now
+        await sync_to_async(write)(done, total)
+
+    return on_progress
+
+
+def run_tiles_job(job):
+    kwargs = tile_generation_kwargs(job.params)
+    # The page is linked through map_url; no need to keep its HTML in the job row
+    kwargs['include_map_html'] = False
+    results, failures, map_path, _ = asyncio.run(
+        generate_tiles_and_map(**kwargs, on_progress=_progress_reporter(job))
+    )
+    return {
+        "archive_id": kwargs.get("archive_id"),
+        "tiles_generated": len(results),
+        "tiles_failed": len(failures),
+        "results": results,
+        "failures": failures,
+        "map_url": f"/api/tile-map/?path={os.path.basename(map_path)}" if map_path else None,
+    }
+
+
+def _phase_reporter(job):
+    last_write = 0.0
+    last_phase = None
+    lock = threading.Lock()
+
+    def on_progress(phase, done, total):
+        nonlocal last_write, last_phase
+        with lock:
+            now = time.monotonic()
+            # Always record a phase change; within a phase, at most one write per interval
+            if phase == last_phase and done < total and now - last_write < PROGRESS_WRITE_INTERVAL:
+                return
+            last_write, last_phase = now, phase
+            Job.objects.filter(pk=job.pk).update(phase=phase, progress_done=done, progress_total=total)
+        if threading.current_thread() is not threading.main_thread():
+            # VCubeProcessor's pool threads come and go; don't leave their connections behind
+            connection.close()
+
+    return on_progress
+
+
+def run_time_series_job(job):
+    # The job id doubles as the request id and names the output directory
+    return run_time_series(job.params, job.id, on_progress=_phase_reporter(job))
+
+
+JOB_HANDLERS = {
+    Job.KIND_TILES: run_tiles_job,
+    Job.KIND_TIME_SERIES: run_time_series_job,
+}
+
+
+def run_job(job):
+    print(f"Running {job.kind} job {job.id}")
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+    except Exception as e:
+        traceback.print_exc()
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.STATUS_FAILED,
+            error=str(e) or e.__class__.__name__,
+            finished_at=timezone.now(),
+        )
+        return
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.STATUS_SUCCEEDED,
+        result=result,
+        finished_at=timezone.now(),
+    )
+    print(f"Finished {job.kind} job {job.id}")
+
+
+def worker_loop(poll_interval=2.0, max_jobs=None):
+    """Drain the queue forever (or until ``max_jobs`` jobs have run)."""
+    worker = worker_name()
+    processed = 0
+    print(f"Job worker {worker} started")
+    while max_jobs is None or processed < max_jobs:
+        close_old_connections()
+        job = claim_next_job(worker)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
@@ -0,0 +1,227 @@
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import mercantile
+import numpy as np
+import rasterio
+import rasterio.shutil
+from django.core.management.base import BaseCommand
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+from rio_tiler.io import Reader
+
+from api.raster_env import DEFAULT_GDAL_OPTIONS, DatasetPool, gdal_options
+
+_RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with single HTTP Range support, like an object store."""
+
+    protocol_version = "HTTP/1.1"
+    # Shared multiprocessing.Values, set by serve_directory
+    requests = None
+    bytes_sent = None
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _record(self, sent):
+        with self.requests.get_lock():
+            self.requests.value += 1
+        with self.bytes_sent.get_lock():
+            self.bytes_sent.value += sent
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def _serve(self, head):
+        if self.latency:
+            time.sleep(self.latency)
+        path = self.translate_path(self.path.split("?", 1)[0])
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = _RANGE_RE.match(self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "image/tiff")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if head:
+            self._record(0)
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        self.wfile.write(data)
+        self._record(len(data))
+
+
+def serve_directory(root, port, requests, bytes_sent, latency):
+    handler = type("Handler", (RangeRequestHandler,), {
+        "requests": requests,
+        "bytes_sent": bytes_sent,
+        "latency": latency,
+        "__init__": lambda self, *args, **kwargs: RangeRequestHandler.__init__(self, *args, directory=root, **kwargs),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    port.value = server.server_address[1]
+    server.serve_forever()
+
+
+def read_tiles(read, tiles, passes, workers):
+    work = [tile for _ in range(passes) for tile in tiles]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(read, work))
+
+
+def run_baseline(url, tiles, passes, workers, option_names):
+    """
+    Read every tile with a fresh Reader and GDAL's defaults; returns the
+    seconds taken. Runs in a spawned process: configure_gdal has exported
+    the tuned options into this process's environment, and GDAL only sizes
+    its block cache once, so neither can be undone in the parent.
+    """
+    for name in option_names:
+        os.environ.pop(name, None)
+
+    def read(tile):
+        with Reader(url) as src:
+            src.tile(tile.x, tile.y, tile.z)
+
+    started = time.perf_counter()
+    read_tiles(read, tiles, passes, workers)
+    return time.perf_counter() - started
+
+
+def write_sample_cog(path, bounds, size):
+    """Write a deflate-compressed, tiled COG with overviews covering ``bounds`` (EPSG:4326)."""
+    west, south = mercantile.xy(bounds[0], bounds[1])
+    east, north = mercantile.xy(bounds[2], bounds[3])
+    yy, xx = np.mgrid[0:size, 0:size]
+    data = (1000 + 500 * np.sin(xx / 37.0) * np.cos(yy / 53.0)
+            + np.random.default_rng(0).normal(0, 20, (size, size))).astype(np.uint16)
+    profile = {
+        "driver": "GTiff",
+        "width": size,
+        "height": size,
+        "count": 1,
+        "dtype": "uint16",
+        "crs": "EPSG:3857",
+        "transform": from_bounds(west, south, east, north, size, size),
+        "nodata": 0,
+    }
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(data, 1)
+        with memfile.open() as src:
+            rasterio.shutil.copy(src, path, driver="COG", compress="DEFLATE", blocksize=512)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark COG tile reads against a local HTTP Range server: a fresh "
+        "reader per tile with GDAL defaults (in a separate process that never "
+        "saw configure_gdal) versus raster_env's tuned options and pooled "
+        "readers. Prints a JSON report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--zoom", type=int, default=14, help="Zoom level of the tiles read")
+        parser.add_argument("--size", type=int, default=4096, help="Width/height of the sample COG in pixels")
+        parser.add_argument("--passes", type=int, default=3, help="Times every tile is read, as for several bands or dates")
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent reader threads")
+        parser.add_argument("--latency", type=float, default=0.0, help="Extra seconds of latency added to every HTTP request")
+
+    def handle(self, *args, **options):
+        bounds = (30.304434642130218, 30.174682637534644, 30.42143846734797, 30.283438554006977)
+        tiles = list(mercantile.tiles(*bounds, zooms=options["zoom"]))
+        with tempfile.TemporaryDirectory() as root:
+            write_sample_cog(os.path.join(root, "band.tif"), bounds, options["size"])
+            requests = multiprocessing.Value("q", 0)
+            bytes_sent = multiprocessing.Value("q", 0)
+            port = multiprocessing.Value("i", 0)
+            # The server gets its own process: rasterio holds the GIL while
+            # GDAL waits on HTTP, which would starve an in-process server
+            server = multiprocessing.Process(
+                target=serve_directory,
+                args=(root, port, requests, bytes_sent, options["latency"]),
+                daemon=True,
+            )
+            server.start()
+            try:
+                while not port.value:
+                    time.sleep(0.01)
+                base_url = f"http://127.0.0.1:{port.value}/band.tif"
+                report = {
+                    "tiles": len(tiles),
+                    "passes": options["passes"],
+                    "workers": options["workers"],
+                    "latency": options["latency"],
+                }
+                for name in ("baseline", "tuned"):
+                    requests.value = bytes_sent.value = 0
+                    # A distinct URL per run so GDAL's process-wide curl cache starts cold
+                    url = f"{base_url}?run={name}"
+                    if name == "baseline":
+                        elapsed = self._run_baseline(url, tiles, options)
+                    else:
+                        elapsed = self._run_tuned(url, tiles, options)
+                    reads = len(tiles) * options["passes"]
+                    report[name] = {
+                        "seconds": round(elapsed, 3),
+                        "tiles_per_second": round(reads / elapsed, 1),
+                        "http_requests": requests.value,
+                        "bytes_served": bytes_sent.value,
+                    }
+                report["speedup"] = round(report["baseline"]["seconds"] / report["tuned"]["seconds"], 2)
+            finally:
+                server.terminate()
+                server.join()
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def _run_baseline(url, tiles, options):
+        # Every option raster_env may set goes, including RASTER_GDAL_OPTIONS extras
+        option_names = set(DEFAULT_GDAL_OPTIONS) | set(gdal_options())
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return executor.submit(
+                run_baseline, url, tiles, options["passes"], options["workers"], option_names
+            ).result()
+
+    @staticmethod
+    def _run_tuned(url, tiles, options):
+        pool = DatasetPool()
+        tuned = gdal_options()
+
+        def read(tile):
+            with rasterio.Env(**tuned):
+                with pool.reader(url) as src:
+                    src.tile(tile.x, tile.y, tile.z)
+
+        started = time.perf_counter()
+        try:
+            read_tiles(read, tiles, options["passes"], options["workers"])
+        finally:
+            pool.close()
+        return time.perf_counter() - started
@@ -0,0 +1,216 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import statistics
+import tempfile
+import threading
+import time
+
+import mercantile
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api import metrics
+from api import utils
+
+# Centre of the default generate-tiles bbox
+CENTER = (30.362936554739094, 30.22906059577081)
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def _float_list(value):
+    return [float(item) for item in value.split(",") if item]
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux; it only ever grows
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakRSS:
+    """Sample the resident set size in a background thread and keep the peak."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def stub_compute_tile_values(latency, size):
+    """
+    Return a stand-in for compute_tile_values that waits ``latency`` seconds,
+    like the scene search and COG reads would, and returns a ``size`` x
+    ``size`` float32 tile that only depends on the tile address.
+    """
+    async def compute_tile_values(x, y, z, start_date, end_date, cloud_cover, band1, band2, formula, find_scenes=None):
+        await asyncio.sleep(latency)
+        rng = np.random.default_rng((x * 73856093) ^ (y * 19349663) ^ (z * 83492791))
+        yy, xx = np.mgrid[0:size, 0:size]
+        values = (np.sin((xx + x * size) / 41.0) * np.cos((yy + y * size) / 57.0)
+                  + rng.normal(0, 0.05, (size, size))).astype(np.float32)
+        return values, {"date": "2025-02-01T08:35:00Z", "cloud_cover": 4.2, "scene": f"bench_{z}_{x}_{y}"}
+
+    return compute_tile_values
+
+
+def _disk_usage(root):
+    total = 0
+    for path, _, files in os.walk(root):
+        for name in files:
+            if name.endswith((".sqlite3", "-wal", "-shm", "-journal")):
+                # Manifests, not output
+                continue
+            total += os.path.getsize(os.path.join(path, name))
+    return total
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark generate_tiles_and_map with a deterministic stand-in for the "
+        "scene search and COG reads, across bbox sizes, zoom levels and "
+        "concurrency settings. Every run starts from an empty tile cache. "
+        "Prints a JSON report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bbox-sizes", type=_float_list, default=[0.05, 0.1, 0.2],
+                            help="Comma-separated bbox widths/heights in degrees")
+        parser.add_argument("--zooms", type=_int_list, default=[12, 13, 14], help="Comma-separated zoom levels")
+        parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 8, 16],
+                            help="Comma-separated tile concurrency settings")
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds the stand-in waits per tile")
+        parser.add_argument("--tile-size", type=int, default=256, help="Width/height of the stand-in tiles in pixels")
+        parser.add_argument("--map-mode", choices=["embedded", "tile_layer", "none"], default="tile_layer",
+                            help="Map built after the tiles, or none")
+        parser.add_argument("--image-format", choices=["png", "palette", "webp", "webp_lossy"], default="png")
+        parser.add_argument("--max-tiles", type=int, default=2000, help="Skip configurations with more tiles than this")
+        parser.add_argument("--output", help="Also write the report to this file")
+
+    def handle(self, *args, **options):
+        if options["tile_size"] < 1:
+            raise CommandError("--tile-size must be positive")
+        stub = stub_compute_tile_values(options["latency"], options["tile_size"])
+        report = {
+            "latency": options["latency"],
+            "tile_size": options["tile_size"],
+            "map_mode": options["map_mode"],
+            "image_format": options["image_format"],
+            "runs": [],
+        }
+        original_compute = utils.compute_tile_values
+        original_process = utils._process_tile
+        original_maps_dir = utils.MAPS_DIR
+        utils.compute_tile_values = stub
+        try:
+            for size in options["bbox_sizes"]:
+                bbox = (CENTER[0] - size / 2, CENTER[1] - size / 2, CENTER[0] + size / 2, CENTER[1] + size / 2)
+                for zoom in options["zooms"]:
+                    tiles = len(list(mercantile.tiles(*bbox, zooms=zoom)))
+                    if tiles > options["max_tiles"]:
+                        self.stderr.write(f"Skipping bbox {size} at zoom {zoom}: {tiles} tiles")
+                        continue
+                    for concurrency in options["concurrency"]:
+                        run = self._run(bbox, zoom, concurrency, options)
+                        run.update(bbox_size=size, zoom=zoom, concurrency=concurrency)
+                        report["runs"].append(run)
+                        self.stderr.write(
+                            f"bbox {size} z{zoom} c{concurrency}: {run['tiles']} tiles, "
+                            f"{run['tiles_per_second']} tiles/s"
+                        )
+        finally:
+            utils.compute_tile_values = original_compute
+            utils._process_tile = original_process
+            utils.MAPS_DIR = original_maps_dir
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    @staticmethod
+    def _run(bbox, zoom, concurrency, options):
+        latencies = []
+
+        async def timed_process_tile(*args, **kwargs):
+            # Time spent on the tile itself, not waiting for a concurrency slot
+            started = time.perf_counter()
+            try:
+                return await original_process(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+        original_process = utils._process_tile
+        utils._process_tile = timed_process_tile
+        try:
+            with tempfile.TemporaryDirectory() as root:
+                utils.MAPS_DIR = os.path.join(root, "maps")
+                with override_settings(
+                    TILE_CACHE_DIR=os.path.join(root, "tiles"),
+                    TILE_ARCHIVE_DIR=os.path.join(root, "archives"),
+                    ARTIFACT_MANIFEST=os.path.join(root, "artifacts.sqlite3"),
+                ):
+                    # The pipeline prints a line per tile; keep it out of the report.
+                    # self.stdout still writes to the real stdout.
+                    with contextlib.redirect_stdout(io.StringIO()), PeakRSS() as rss, \
+                            metrics.collect() as collected:
+                        started = time.perf_counter()
+                        results, failures, map_path, _ = asyncio.run(utils.generate_tiles_and_map(
+                            min_lon=bbox[0], min_lat=bbox[1], max_lon=bbox[2], max_lat=bbox[3],
+                            zoom_level=zoom,
+                            concurrency=concurrency,
+                            map_mode="tile_layer" if options["map_mode"] == "none" else options["map_mode"],
+                            make_map=options["map_mode"] != "none",
+                            image_format=options["image_format"],
+                            include_map_html=False,
+                        ))
+                        elapsed = time.perf_counter() - started
+                output_bytes = _disk_usage(root)
+        finally:
+            utils._process_tile = original_process
+        return {
+            "tiles": len(results),
+            "failures": len(failures),
+            "seconds": round(elapsed, 3),
+            "tiles_per_second": round(len(results) / elapsed, 1) if elapsed else None,
+            "latency_p50": round(_percentile(latencies, 0.5) or 0, 4),
+            "latency_p99": round(_percentile(latencies, 0.99) or 0, 4),
+            "latency_mean": round(statistics.fmean(latencies), 4) if latencies else None,
+            "peak_rss_bytes": rss.peak,
+            "output_bytes": output_bytes,
+            "map_built": map_path is not None,
+            "stages": collected.as_dict()["stages"],
+        }
@@ -0,0 +1,146 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import FarmArea
+from api.schemas import TileGenerationSerializer
+from api.utils import iter_tiles_and_map
+
+
+def _write_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the tiles of every farm area for the latest imagery window into the "
+        "tile cache, so user requests hit the cache. The cache is keyed on the exact "
+        "dates, so only requests for the same window (today minus --days up to today, "
+        "as of the run) are served from it, for TILE_OPEN_WINDOW_MAX_AGE seconds since "
+        "the window is still open. Progress is saved after each farm; running "
+        "again with the same window and parameters resumes where it stopped, retrying "
+        "farms that had failed tiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zoom', type=int, default=14, help='Highest zoom level to render')
+        parser.add_argument('--min-zoom', type=int, default=None, help='Also build overview tiles down to this zoom')
+        parser.add_argument('--days', type=int, default=30, help='Length of the imagery window ending today')
+        parser.add_argument('--active-days', type=int, default=None,
+                            help='Only farms updated, or whose owner logged in, within this many days')
+        parser.add_argument('--concurrency', type=int, default=2, help='Tiles rendered at the same time')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between farms')
+        parser.add_argument('--state-file', default=os.path.join(settings.MEDIA_ROOT, 'prewarm_state.json'),
+                            help='Where progress is kept between runs')
+        parser.add_argument('--restart', action='store_true', help='Ignore saved progress and start over')
+        parser.add_argument('--params', default='{}',
+                            help='JSON object of tile parameters (band1, formula, colormap_str, ...) to render with')
+
+    def handle(self, *args, **options):
+        end_date = datetime.date.today()
+        start_date = end_date - datetime.timedelta(days=options['days'])
+        try:
+            extra = json.loads(options['params'])
+        except json.JSONDecodeError as e:
+            raise CommandError(f"--params is not valid JSON: {e}")
+        request = {
+            **extra,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'zoom_level': options['zoom'],
+            'concurrency': options['concurrency'],
+        }
+        if options['min_zoom'] is not None:
+            request['min_zoom'] = options['min_zoom']
+        # Same defaults as the API, so prewarmed tiles share its cache keys
+        serializer = TileGenerationSerializer(data=request)
+        if not serializer.is_valid():
+            raise CommandError(json.dumps(serializer.errors))
+        data = serializer.validated_data
+        tile_params = {
+            name: data.get(name) for name in (
+                'start_date', 'end_date', 'cloud_cover', 'band1', 'band2', 'formula',
+                'colormap_str', 'vmin', 'vmax', 'image_format', 'compress_level', 'quality', 'tile_format',
+            )
+        }
+        run_key = hashlib.sha256(
+            json.dumps({**tile_params, 'zoom': options['zoom'], 'min_zoom': options['min_zoom']},
+                       sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+
+        state_file = options['state_file']
+        state = {'run_key': run_key, 'done': [], 'failed': {}}
+        if not options['restart'] and os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('run_key') == run_key:
+                state = saved
+        done = set(state['done'])
+
+        farms = FarmArea.objects.order_by('pk')
+        if options['active_days'] is not None:
+            since = timezone.now() - datetime.timedelta(days=options['active_days'])
+            farms = farms.filter(Q(updated_at__gte=since) | Q(user__user__last_login__gte=since))
+        farm_ids = [pk for pk in farms.values_list('pk', flat=True) if pk not in done]
+        self.stdout.write(
+            f"Prewarming {len(farm_ids)} farm area(s) for {start_date} - {end_date} "
+            f"({len(done)} already done)"
+        )
+
+        warmed = 0
+        for index, farm_id in enumerate(farm_ids, start=1):
+            started = time.perf_counter()
+            try:
+                summary = asyncio.run(self._prewarm_farm(farm_id, data, tile_params))
+            except Exception as e:
+                # Bad boundaries or no imagery: note it, retry on the next run
+                state['failed'][str(farm_id)] = str(e)
+                self.stderr.write(f"Farm area {farm_id}: {e}")
+            else:
+                self.stdout.write(
+                    f"[{index}/{len(farm_ids)}] Farm area {farm_id}: {summary.get('tiles_generated', 0)} tiles, "
+                    f"{summary.get('tiles_failed', 0)} failed in {time.perf_counter() - started:.1f}s"
+                )
+                if summary.get('tiles_failed'):
+                    # Rendered tiles are cached, so the retry only redoes the failed ones
+                    state['failed'][str(farm_id)] = f"{summary['tiles_failed']} tile(s) failed"
+                else:
+                    state['failed'].pop(str(farm_id), None)
+                    state['done'].append(farm_id)
+                    warmed += 1
+            _write_state(state_file, state)
+            if options['pause'] and index < len(farm_ids):
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Prewarmed {warmed} farm area(s), {len(farm_ids) - warmed} failed"
+        ))
+
+    @staticmethod
+    async def _prewarm_farm(farm_id, data, tile_params):
+        summary = {}
+        async for event in iter_tiles_and_map(
+            **tile_params,
+            zoom_level=data['zoom_level'],
+            min_zoom=data.get('min_zoom'),
+            concurrency=data['concurrency'],
+            tile_timeout=data['tile_timeout'],
+            farm_area_id=farm_id,
+            make_map=False,
+        ):
+            if event['event'] == 'done':
+                summary = event
+        return summary
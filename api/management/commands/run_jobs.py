@@ -0,0 +1,76 @@
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.jobs import requeue_orphaned_jobs, worker_loop
+
+# Seconds to wait before replacing a worker that exited, so a crashing one can't fork in a tight loop
+RESTART_DELAY = 1.0
+
+
+def _worker_main(poll_interval):
+    # Let the parent decide when to stop; a Ctrl+C should not kill a job halfway
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_loop(poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = (
+        "Start a pool of local worker processes that drain the background job queue. "
+        "Workers that exit are restarted, and running jobs whose worker died are re-queued."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--requeue-interval', type=float, default=30.0,
+                            help='Seconds between two checks for jobs orphaned by a dead worker')
+
+    def requeue(self):
+        requeued = requeue_orphaned_jobs()
+        if requeued:
+            self.stdout.write(f"Re-queued {requeued} orphaned job(s)")
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+
+    @staticmethod
+    def start_worker(poll_interval):
+        process = multiprocessing.Process(target=_worker_main, args=(poll_interval,), daemon=True)
+        process.start()
+        return process
+
+    def handle(self, *args, **options):
+        self.requeue()
+        processes = [self.start_worker(options['poll_interval']) for _ in range(max(1, options['workers']))]
+        self.stdout.write(self.style.SUCCESS(f"Started {len(processes)} job worker(s)"))
+
+        try:
+            next_requeue = time.monotonic() + options['requeue_interval']
+            while True:
+                # Wakes up as soon as a worker exits
+                multiprocessing.connection.wait(
+                    [process.sentinel for process in processes],
+                    timeout=max(0.0, next_requeue - time.monotonic()),
+                )
+                dead = [index for index, process in enumerate(processes) if not process.is_alive()]
+                if dead or time.monotonic() >= next_requeue:
+                    # A dead worker's job is put back before its replacement starts looking for one
+                    self.requeue()
+                    next_requeue = time.monotonic() + options['requeue_interval']
+                for index in dead:
+                    self.stderr.write(
+                        f"Job worker {processes[index].pid} exited with code {processes[index].exitcode}, restarting"
+                    )
+                    processes[index].join()
+                    time.sleep(RESTART_DELAY)
+                    processes[index] = self.start_worker(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping job workers")
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.retention import sweep_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Enforce the storage retention policies (STORAGE_RETENTION) on generated maps, "
+        "time series outputs, tile archives, STAC search results and the tile cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, sweeping every this many seconds')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting it')
+
+    def handle(self, *args, **options):
+        while True:
+            for summary in sweep_storage(dry_run=options['dry_run']):
+                line = (
+                    f"{summary['category']}: removed {summary['removed']} ({summary['freed']} bytes), "
+                    f"{summary['bytes']} bytes kept"
+                )
+                if 'artifacts' in summary:
+                    line += f" in {summary['artifacts']} artifact(s)"
+                self.stdout.write(line)
+            if options['interval'] is None:
+                break
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                break
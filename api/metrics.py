@@ -0,0 +1,134 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+# Stages of the tile pipeline, in the order a tile goes through them
+STAGES = ('search', 'read', 'band_math', 'encode', 'write', 'map')
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Timings:
+    """Stage durations and event counts collected for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+
+    def count(self, event, amount=1):
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + amount
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'total_seconds': round(time.perf_counter() - self.started, 4),
+                # Summed over every tile, so parallel work can exceed total_seconds
+                'stages': {
+                    stage: {'count': entry['count'], 'seconds': round(entry['seconds'], 4)}
+                    for stage, entry in self.stages.items()
+                },
+                'counters': dict(self.counters),
+            }
+
+
+class Registry:
+    """Process-wide stage histograms and event counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.setdefault(
+                stage, {'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0}
+            )
+            index = bisect.bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                histogram['buckets'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+
+    def count(self, event, amount=1):
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + amount
+
+    def render_prometheus(self):
+        """Return the registry in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                '# HELP agrisens_tile_stage_seconds Time spent in each tile pipeline stage.',
+                '# TYPE agrisens_tile_stage_seconds histogram',
+            ]
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, observed in zip(BUCKETS, histogram['buckets']):
+                    cumulative += observed
+                    lines.append(f'agrisens_tile_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'agrisens_tile_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'agrisens_tile_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+                lines.append(f'agrisens_tile_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+            lines += [
+                '# HELP agrisens_tile_events_total Tile cache hits, misses and failures.',
+                '# TYPE agrisens_tile_events_total counter',
+            ]
+            for event, value in sorted(self.counters.items()):
+                lines.append(f'agrisens_tile_events_total{{event="{event}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# The Timings of the request being served, if it asked for them. Context
+# variables follow asyncio tasks and asyncio.to_thread, so stages timed deep
+# in worker threads still land in the right request.
+_current = contextvars.ContextVar('tile_timings', default=None)
+
+
+@contextlib.contextmanager
+def collect():
+    """Collect the stages and events of the enclosed work into a Timings."""
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # An async generator finalized outside the context it started in
+            _current.set(None)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the enclosed block as pipeline stage ``name``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe(name, elapsed)
+        timings = _current.get()
+        if timings is not None:
+            timings.observe(name, elapsed)
+
+
+def count(event, amount=1):
+    registry.count(event, amount)
+    timings = _current.get()
+    if timings is not None:
+        timings.count(event, amount)
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='phase',
+            field=models.CharField(blank=True, help_text='Step the job is currently in, for jobs reporting phases', max_length=32, null=True),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('tiles', 'Tile generation'), ('time_series', 'Time series')], max_length=32),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_job_time_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='cache_key',
+            field=models.CharField(blank=True, db_index=True, help_text='Normalized request hash, for jobs whose results are reused', max_length=64, null=True),
+        ),
+    ]
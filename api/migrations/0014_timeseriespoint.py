@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_job_cache_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeSeriesPoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series_key', models.CharField(db_index=True, help_text='Hash of the bbox, cloud cover, bands, formula and operation', max_length=64)),
+                ('scene', models.CharField(help_text='STAC item id of the scene', max_length=128)),
+                ('date', models.DateField()),
+                ('value', models.FloatField(blank=True, help_text='Operation applied to the scene, null when it has no valid pixels', null=True)),
+                ('frame', models.CharField(blank=True, help_text='GIF frame of the scene, relative to MEDIA_ROOT', max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'time_series_points',
+                'ordering': ['date', 'scene'],
+                'unique_together': {('series_key', 'scene')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_job_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='attempts',
+            field=models.IntegerField(default=0, help_text='Times a worker has claimed the job'),
+        ),
+    ]
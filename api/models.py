@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.db.models import JSONField
 
@@ -64,3 +65,73 @@ class FarmArea(models.Model):
 
     def __str__(self):
         return f"{self.name} - {self.user.user.username}"
+
+
+class Job(models.Model):
+    """
+    A unit of background work, stored in the database and drained by the
+    worker processes started with ``manage.py run_jobs``.
+    """
+    KIND_TILES = 'tiles'
+    KIND_TIME_SERIES = 'time_series'
+    KIND_CHOICES = [
+        (KIND_TILES, 'Tile generation'),
+        (KIND_TIME_SERIES, 'Time series'),
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    user = models.ForeignKey("account.Account", on_delete=models.CASCADE, null=True, blank=True, related_name='jobs', help_text='Owner of the job; only they can see it. Empty for jobs queued by management commands')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    params = JSONField(default=dict, help_text='Validated request payload the job runs with')
+    progress_done = models.IntegerField(default=0)
+    progress_total = models.IntegerField(default=0)
+    phase = models.CharField(max_length=32, blank=True, null=True, help_text='Step the job is currently in, for jobs reporting phases')
+    cache_key = models.CharField(max_length=64, blank=True, null=True, db_index=True, help_text='Normalized request hash, for jobs whose results are reused')
+    result = JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, null=True)
+    worker = models.CharField(max_length=128, blank=True, null=True, help_text='host:pid of the worker running the job')
+    attempts = models.IntegerField(default=0, help_text='Times a worker has claimed the job')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'jobs'
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.kind} {self.id} ({self.status})"
+
+
+class TimeSeriesPoint(models.Model):
+    """
+    The index value of one scene in a time series, kept so later runs of the
+    same series (see api/time_series.py) only compute newer scenes.
+    """
+    series_key = models.CharField(max_length=64, db_index=True, help_text='Hash of the bbox, cloud cover, bands, formula and operation')
+    scene = models.CharField(max_length=128, help_text='STAC item id of the scene')
+    date = models.DateField()
+    value = models.FloatField(null=True, blank=True, help_text='Operation applied to the scene, null when it has no valid pixels')
+    frame = models.CharField(max_length=255, blank=True, null=True, help_text='GIF frame of the scene, relative to MEDIA_ROOT')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'time_series_points'
+        ordering = ['date', 'scene']
+        unique_together = [('series_key', 'scene')]
+
+    def __str__(self):
+        return f"{self.scene}: {self.value}"
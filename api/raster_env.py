@@ -0,0 +1,126 @@
+import contextlib
+import os
+import threading
+from collections import OrderedDict
+
+import rasterio
+from django.conf import settings
+from rio_tiler.io import Reader
+
+# GDAL tuning for reading Cloud-Optimized GeoTIFFs over HTTP. Overridable
+# (or extendable) with the RASTER_GDAL_OPTIONS setting.
+DEFAULT_GDAL_OPTIONS = {
+    # Raster block cache. rasterio hands an int straight to GDALSetCacheMax,
+    # which counts bytes, not the megabytes the string option uses
+    "GDAL_CACHEMAX": 512 * 1024 ** 2,
+    # Keep recently fetched byte ranges of remote files in memory
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": str(64 * 1024 ** 2),
+    "CPL_VSIL_CURL_CACHE_SIZE": str(256 * 1024 ** 2),
+    # Reuse one HTTP/2 connection per host and coalesce adjacent range reads
+    "GDAL_HTTP_VERSION": "2",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_HTTP_MAX_RETRY": "3",
+    "GDAL_HTTP_RETRY_DELAY": "1",
+    # Don't list the bucket or probe for sidecar files on every open
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.TIF,.tiff,.TIFF",
+    "GDAL_INGESTED_BYTES_AT_OPEN": "32768",
+}
+
+# Open datasets kept warm between tiles
+DEFAULT_DATASET_POOL_SIZE = 64
+
+
+def gdal_options():
+    options = dict(DEFAULT_GDAL_OPTIONS)
+    options.update(getattr(settings, "RASTER_GDAL_OPTIONS", {}))
+    return options
+
+
+def configure_gdal():
+    """
+    Export gdal_options() as environment variables. GDAL falls back to the
+    environment for any config option, so this reaches every thread,
+    including the ones VCubeProcessor and rio-tiler open datasets from.
+    Options already set in the environment win.
+    """
+    for name, value in gdal_options().items():
+        os.environ.setdefault(name, str(value))
+
+
+@contextlib.contextmanager
+def raster_env():
+    """Run the enclosed reads inside a rasterio Env configured with gdal_options()."""
+    configure_gdal()
+    with rasterio.Env(**gdal_options()):
+        yield
+
+
+class DatasetPool:
+    """
+    A thread-safe pool of open rio-tiler Readers keyed by URL.
+
+    A Reader (and the GDAL dataset behind it) is used by one thread at a
+    time: ``reader(url)`` checks out an idle one, or opens a new one, and
+    returns it afterwards. Keeping datasets open skips the header requests
+    and TLS handshakes of re-opening the same COG for every tile. At most
+    ``max_size`` idle readers are kept; the least recently used are closed.
+    """
+
+    def __init__(self, max_size=DEFAULT_DATASET_POOL_SIZE):
+        self.max_size = max_size
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _checkout(self, url):
+        with self._lock:
+            readers = self._idle.get(url)
+            if readers:
+                reader = readers.pop()
+                if not readers:
+                    del self._idle[url]
+                return reader
+        return None
+
+    def _checkin(self, url, reader):
+        evicted = []
+        with self._lock:
+            self._idle.setdefault(url, []).append(reader)
+            self._idle.move_to_end(url)
+            while sum(len(readers) for readers in self._idle.values()) > self.max_size:
+                _, readers = next(iter(self._idle.items()))
+                evicted.append(readers.pop(0))
+                if not readers:
+                    self._idle.popitem(last=False)
+        for old in evicted:
+            old.close()
+
+    @contextlib.contextmanager
+    def reader(self, url):
+        reader = self._checkout(url)
+        if reader is None:
+            reader = Reader(url)
+        try:
+            yield reader
+        except Exception:
+            # The dataset may be in a bad state (e.g. a dropped connection)
+            reader.close()
+            raise
+        else:
+            self._checkin(url, reader)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, OrderedDict()
+        for readers in idle.values():
+            for reader in readers:
+                reader.close()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(readers) for readers in self._idle.values())
+
+
+dataset_pool = DatasetPool(getattr(settings, "RASTER_DATASET_POOL_SIZE", DEFAULT_DATASET_POOL_SIZE))
@@ -0,0 +1,293 @@
+import asyncio
+import functools
+import re
+import struct
+import warnings
+from io import BytesIO
+
+import matplotlib
+import mercantile
+import numexpr
+import numpy as np
+from PIL import Image
+from vcube.utils import filter_intersected_features, filter_latest_image_per_grid
+from .metrics import stage
+from .raster_env import dataset_pool
+from .stac import cached_search_scenes
+
+# Index values are cached at the precision of the band math. The API takes
+# any formula, so half precision would overflow (above 65504) or keep only
+# ~3 significant digits, and f32 data tiles are served from these values.
+VALUES_DTYPE = np.float32
+
+# Image encodings of colored tiles: format -> (content type, file extension).
+# "palette" is an 8-bit indexed PNG, "webp" is lossless and "webp_lossy"
+# trades exactness for size according to ``quality``.
+IMAGE_FORMATS = {
+    "png": ("image/png", "png"),
+    "palette": ("image/png", "png"),
+    "webp": ("image/webp", "webp"),
+    "webp_lossy": ("image/webp", "webp"),
+}
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+DEFAULT_WEBP_QUALITY = 80
+
+# Raw data tiles for client-side rendering. Layout (little-endian):
+#   24-byte header: magic b"AGRT", version (u8), dtype code (u8), width (u16),
+#   height (u16), scale (f32), offset (f32), nodata (u16), 4 padding bytes;
+#   then width*height samples in row-major order.
+# Values are ``sample * scale + offset``. uint16 tiles use ``nodata`` for
+# missing pixels; float32 tiles use NaN and scale=1, offset=0.
+DATA_TILE_HEADER = struct.Struct("<4sBBHHffH4x")
+DATA_TILE_MAGIC = b"AGRT"
+DATA_TILE_VERSION = 1
+DATA_TILE_FORMATS = {"u16": (1, np.dtype("<u2")), "f32": (2, np.dtype("<f4"))}
+DATA_TILE_NODATA = 65535
+
+
+@stage("read")
+def read_band_tile(url, x, y, z):
+    """
+    Read tile x/y/z of a single-band COG as float64. Like TileProcessor,
+    nodata pixels keep their raw value and go through the formula as is.
+    """
+    # Pooled readers keep the dataset (and its HTTP connection) open between tiles
+    with dataset_pool.reader(url) as src:
+        image = src.tile(x, y, z)
+    return image.data[0].astype(float)
+
+
+@stage("read")
+def read_band_part(url, bounds, crs, width, height):
+    """
+    Read ``bounds`` (in ``crs``) of a single-band COG warped onto a
+    ``width`` x ``height`` grid as float32, with NaN where there is no data.
+    Every scene read with the same arguments lands on the same pixels.
+    """
+    with dataset_pool.reader(url) as src:
+        image = src.part(bounds, dst_crs=crs, bounds_crs=crs, width=width, height=height)
+    data = image.data[0].astype(np.float32)
+    data[image.mask == 0] = np.nan
+    return data
+
+
+# TileProcessor evaluates formulas with numpy in scope, so they may spell
+# functions as np.sqrt(...); numexpr knows the same functions unprefixed
+_NUMPY_PREFIX_RE = re.compile(r"\b(?:np|numpy)\.")
+
+
+@stage("band_math")
+def evaluate_formula(formula, band1, band2=None):
+    """
+    Evaluate the band math ``formula`` (e.g. ``(band2-band1)/(band2+band1)``)
+    with numexpr, which gives the same values as TileProcessor's eval for
+    arithmetic and numpy functions without running arbitrary code.
+    Undefined results (0/0 over nodata) come out as NaN.
+    """
+    local_dict = {"band1": band1}
+    if band2 is not None:
+        local_dict["band2"] = band2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = numexpr.evaluate(_NUMPY_PREFIX_RE.sub("", formula), local_dict=local_dict).astype(np.float32)
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def tile_scene(features, bounds):
+    """
+    Pick the scene TileProcessor.cached_generate_tile renders for a tile
+    with ``bounds``: the latest one that contains the whole tile, chosen
+    with vcube's own filters. Returns None when no scene contains it.
+    """
+    features = filter_intersected_features(features, list(bounds))
+    if not features:
+        return None
+    return filter_latest_image_per_grid(features)[0]
+
+
+async def compute_tile_values(x, y, z, start_date, end_date, cloud_cover, band1, band2, formula, find_scenes=None):
+    """
+    Compute the index values TileProcessor.cached_generate_tile colors for
+    tile x/y/z: same scene, same raw band reads, same formula. Returns
+    ``(values, meta)`` where ``values`` is a float32 array.
+
+    ``find_scenes`` is an optional coroutine function returning candidate
+    features for a larger area (e.g. the whole request bbox); without it
+    the tile's own bounds are searched.
+    """
+    bounds = mercantile.bounds(mercantile.Tile(x, y, z))
+    if find_scenes is not None:
+        features = await find_scenes()
+    else:
+        features = await asyncio.to_thread(cached_search_scenes, bounds, start_date, end_date, cloud_cover)
+    feature = tile_scene(features, bounds)
+    if feature is None:
+        raise ValueError("No images found for the given parameters")
+    reads = [asyncio.to_thread(read_band_tile, feature["assets"][band1]["href"], x, y, z)]
+    if band2:
+        reads.append(asyncio.to_thread(read_band_tile, feature["assets"][band2]["href"], x, y, z))
+    bands = await asyncio.gather(*reads)
+    values = await asyncio.to_thread(evaluate_formula, formula, *bands)
+    meta = {
+        "date": feature["properties"]["datetime"],
+        "cloud_cover": feature["properties"].get("eo:cloud_cover"),
+        "scene": feature.get("id"),
+    }
+    return values, meta
+
+
+@stage("encode")
+def encode_values(values):
+    buffer = BytesIO()
+    np.save(buffer, values.astype(VALUES_DTYPE), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_values(data):
+    return np.load(BytesIO(data), allow_pickle=False).astype(np.float32)
+
+
+def downsample_values(children):
+    """
+    Build parent tile values from ``children`` (``mercantile.Tile`` -> array)
+    by averaging each 2x2 block of the mosaicked children, ignoring NaNs.
+    """
+    size = next(iter(children.values())).shape[0]
+    mosaic = np.full((size * 2, size * 2), np.nan, dtype=np.float32)
+    min_x = min(child.x for child in children)
+    min_y = min(child.y for child in children)
+    for child, values in children.items():
+        row, col = (child.y - min_y) * size, (child.x - min_x) * size
+        mosaic[row:row + size, col:col + size] = values
+    with warnings.catch_warnings():
+        # All-NaN blocks legitimately average to NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(mosaic.reshape(size, 2, size, 2), axis=(1, 3))
+
+
+@functools.lru_cache(maxsize=64)
+def colormap_lut(colormap_str):
+    """Return a (256, 3) uint8 lookup table for a matplotlib colormap name."""
+    try:
+        colormap = matplotlib.colormaps[colormap_str]
+    except KeyError:
+        raise ValueError(f"Unknown colormap: {colormap_str}")
+    return (colormap(np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+
+
+def stretch_to_indices(values, vmin=None, vmax=None):
+    """
+    Scale ``values`` to 0-255 LUT indices. Without explicit bounds the tile
+    is stretched between its own min and max, and indices are binned like
+    matplotlib's colormaps, so the LUT gives TileProcessor's colors.
+    Returns ``(indices, valid)`` where ``valid`` masks out NaN pixels (which
+    TileProcessor's stretch cannot handle: it renders such tiles black).
+    """
+    valid = np.isfinite(values)
+    if not valid.any():
+        return np.zeros(values.shape, dtype=np.uint8), valid
+    low = np.nanmin(values) if vmin is None else vmin
+    high = np.nanmax(values) if vmax is None else vmax
+    if not high > low:
+        return np.zeros(values.shape, dtype=np.uint8), valid
+    with np.errstate(invalid="ignore"):
+        normalized = (values - low) / (high - low)
+    indices = np.floor(np.nan_to_num(normalized, nan=0.0) * 256)
+    return np.clip(indices, 0, 255).astype(np.uint8), valid
+
+
+def colorize_values(values, colormap_str="RdYlGn", vmin=None, vmax=None):
+    """Apply a colormap to tile values and return a PIL image (RGBA if any pixel is NaN)."""
+    indices, valid = stretch_to_indices(values, vmin, vmax)
+    rgb = colormap_lut(colormap_str)[indices]
+    if valid.all():
+        return Image.fromarray(rgb, "RGB")
+    alpha = np.where(valid, 255, 0).astype(np.uint8)
+    return Image.fromarray(np.dstack([rgb, alpha]), "RGBA")
+
+
+def palette_image(values, colormap_str="RdYlGn", vmin=None, vmax=None):
+    """
+    Return an 8-bit ``P`` image whose pixels are the LUT indices themselves,
+    skipping the RGB expansion entirely. NaN pixels use index 255, made
+    transparent on save, so valid pixels give up the colormap's last step.
+    """
+    indices, valid = stretch_to_indices(values, vmin, vmax)
+    lut = colormap_lut(colormap_str)
+    if not valid.all():
+        indices = np.where(valid, np.minimum(indices, 254), 255).astype(np.uint8)
+        lut = lut.copy()
+        lut[255] = 0
+    image = Image.fromarray(indices, "P")
+    image.putpalette(lut.tobytes())
+    if not valid.all():
+        image.info["transparency"] = 255
+    return image
+
+
+def encode_png(image, compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=compress_level)
+    return buffer.getvalue()
+
+
+@stage("encode")
+def encode_tile_image(values, colormap_str="RdYlGn", vmin=None, vmax=None, image_format="png",
+                      compress_level=DEFAULT_PNG_COMPRESS_LEVEL, quality=DEFAULT_WEBP_QUALITY):
+    """Color tile values and encode them as one of IMAGE_FORMATS."""
+    if image_format == "palette":
+        return encode_png(palette_image(values, colormap_str, vmin, vmax), compress_level)
+    image = colorize_values(values, colormap_str, vmin, vmax)
+    if image_format == "png":
+        return encode_png(image, compress_level)
+    buffer = BytesIO()
+    if image_format == "webp":
+        image.save(buffer, format="WEBP", lossless=True)
+    else:
+        image.save(buffer, format="WEBP", quality=quality)
+    return buffer.getvalue()
+
+
+@stage("encode")
+def encode_data_tile(values, tile_format, vmin=None, vmax=None):
+    """
+    Encode tile values as a raw ``u16`` (quantized between vmin/vmax, or the
+    tile's own range) or ``f32`` data tile, see DATA_TILE_HEADER. ``f32``
+    samples are the float32 values themselves, unquantized.
+    """
+    code, dtype = DATA_TILE_FORMATS[tile_format]
+    height, width = values.shape
+    valid = np.isfinite(values)
+    if tile_format == "f32":
+        scale, offset, samples = 1.0, 0.0, values.astype(dtype)
+    else:
+        if vmin is not None:
+            low = vmin
+        else:
+            low = float(np.nanmin(values)) if valid.any() else 0.0
+        if vmax is not None:
+            high = vmax
+        else:
+            high = float(np.nanmax(values)) if valid.any() else low
+        # 65535 is reserved for nodata
+        scale = (high - low) / (DATA_TILE_NODATA - 1) if high > low else 1.0
+        offset = low
+        quantized = np.clip(np.rint((np.nan_to_num(values, nan=low) - low) / scale), 0, DATA_TILE_NODATA - 1)
+        samples = np.where(valid, quantized, DATA_TILE_NODATA).astype(dtype)
+    header = DATA_TILE_HEADER.pack(
+        DATA_TILE_MAGIC, DATA_TILE_VERSION, code, width, height, scale, offset, DATA_TILE_NODATA
+    )
+    return header + samples.tobytes()
+
+
+def decode_data_tile(data):
+    """Decode a raw data tile back to float32 values with NaN for nodata."""
+    magic, version, code, width, height, scale, offset, nodata = DATA_TILE_HEADER.unpack_from(data)
+    if magic != DATA_TILE_MAGIC or version != DATA_TILE_VERSION:
+        raise ValueError("Not a data tile")
+    dtype = next(dtype for fmt_code, dtype in DATA_TILE_FORMATS.values() if fmt_code == code)
+    samples = np.frombuffer(data, dtype=dtype, offset=DATA_TILE_HEADER.size).reshape(height, width)
+    values = samples.astype(np.float32) * scale + offset
+    if dtype.kind == "u":
+        values[samples == nodata] = np.nan
+    return values
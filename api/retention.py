@@ -0,0 +1,250 @@
+import contextlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from .tile_cache import TileCache
+
+# Don't write a last-access update for the same artifact more than once a minute
+TOUCH_INTERVAL = 60
+
+_last_touch = {}
+_touch_lock = threading.Lock()
+
+
+def default_policies():
+    """
+    Retention policy per artifact category: the directory whose top-level
+    entries are the artifacts, a byte quota and a maximum idle age in
+    seconds (None disables either limit), and whether files the manifest
+    doesn't know yet are adopted into it. Overridden per category by the
+    STORAGE_RETENTION setting.
+    """
+    media_root = str(settings.MEDIA_ROOT)
+    maps_dir = os.path.join(str(settings.BASE_DIR), 'static', 'maps')
+    stac_ttl = getattr(settings, 'STAC_CACHE_TTL', 24 * 3600)
+    return {
+        'maps': {
+            'path': maps_dir,
+            'max_bytes': 200 * 1024 ** 2,
+            'max_age': 7 * 24 * 3600,
+            # static/maps also holds maps committed to the repository: only sweep recorded ones
+            'adopt': False,
+        },
+        'time_series': {
+            'path': os.path.join(media_root, 'virtughan_output'),
+            'max_bytes': 2 * 1024 ** 3,
+            'max_age': 30 * 24 * 3600,
+        },
+        # Frames of incremental series; a swept frame is recomputed on the next run
+        'time_series_frames': {
+            'path': os.path.join(media_root, 'virtughan_series'),
+            'max_bytes': 1024 ** 3,
+            'max_age': 90 * 24 * 3600,
+        },
+        'tile_archives': {
+            'path': str(getattr(settings, 'TILE_ARCHIVE_DIR', os.path.join(media_root, 'tiles', 'archives'))),
+            'max_bytes': 5 * 1024 ** 3,
+            'max_age': 30 * 24 * 3600,
+        },
+        'stac_cache': {
+            'path': str(getattr(settings, 'STAC_CACHE_DIR', os.path.join(media_root, 'stac_cache'))),
+            'max_bytes': None,
+            # Entries older than the TTL are never read again
+            'max_age': 2 * stac_ttl,
+        },
+    }
+
+
+def retention_policies():
+    policies = default_policies()
+    for category, overrides in getattr(settings, 'STORAGE_RETENTION', {}).items():
+        policies.setdefault(category, {}).update(overrides)
+    return policies
+
+
+def _manifest_path():
+    return str(getattr(settings, 'ARTIFACT_MANIFEST', os.path.join(settings.MEDIA_ROOT, 'artifacts.sqlite3')))
+
+
+def _connect():
+    path = _manifest_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS artifacts ('
+        ' path TEXT PRIMARY KEY,'
+        ' category TEXT NOT NULL,'
+        ' size INTEGER NOT NULL,'
+        ' created_at REAL NOT NULL,'
+        ' last_access REAL NOT NULL)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS artifacts_category_access ON artifacts (category, last_access)')
+    return conn
+
+
+@contextlib.contextmanager
+def _transaction():
+    # sqlite3's own context manager commits but never closes
+    with contextlib.closing(_connect()) as conn:
+        with conn:
+            yield conn
+
+
+def _disk_usage(path):
+    if os.path.isdir(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def record_artifact(category, path):
+    """Add (or refresh) a generated file or directory in the artifact manifest."""
+    path = os.path.realpath(path)
+    now = time.time()
+    with _transaction() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO artifacts (path, category, size, created_at, last_access)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (path, category, _disk_usage(path), now, now),
+        )
+    with _touch_lock:
+        _last_touch[path] = now
+
+
+def touch_artifact(path):
+    """Mark an artifact as used, at most once per TOUCH_INTERVAL per process."""
+    path = os.path.realpath(path)
+    now = time.time()
+    with _touch_lock:
+        if now - _last_touch.get(path, 0) < TOUCH_INTERVAL:
+            return
+        _last_touch[path] = now
+    with _transaction() as conn:
+        conn.execute('UPDATE artifacts SET last_access = ? WHERE path = ?', (now, path))
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _scan(root):
+    on_disk = set()
+    if os.path.isdir(root):
+        with os.scandir(root) as entries:
+            for entry in entries:
+                # Skip in-flight temp files and SQLite journals of open archives
+                if entry.name.endswith(('.tmp', '-journal', '-wal', '-shm')) or entry.name.startswith('.'):
+                    continue
+                on_disk.add(os.path.realpath(entry.path))
+    return on_disk
+
+
+def sweep_category(category, policy, dry_run=False, now=None):
+    """
+    Apply ``policy`` to one category: adopt files the manifest does not know
+    about yet (unless ``adopt`` is off), forget vanished ones, delete artifacts idle for longer than
+    ``max_age`` and then the least recently used ones until the category
+    fits 90% of ``max_bytes``. Returns a summary dict.
+
+    The disk is scanned before and the doomed files removed after the
+    manifest transaction, so recording and touching artifacts never wait
+    on filesystem work.
+    """
+    now = time.time() if now is None else now
+    summary = {'category': category, 'removed': 0, 'freed': 0, 'bytes': 0, 'artifacts': 0}
+    with _transaction() as conn:
+        recorded = {
+            path for (path,) in conn.execute('SELECT path FROM artifacts WHERE category = ?', (category,))
+        }
+    on_disk = _scan(policy['path'])
+    adopted = []
+    if policy.get('adopt', True):
+        for path in on_disk - recorded:
+            # Written before the manifest existed, or by something that doesn't record: use its mtime
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            adopted.append((path, category, _disk_usage(path), mtime, mtime))
+
+    with _transaction() as conn:
+        conn.executemany('DELETE FROM artifacts WHERE path = ?', [(path,) for path in recorded - on_disk])
+        # Ignore paths recorded since the scan, their entry is newer than the mtime
+        conn.executemany(
+            'INSERT OR IGNORE INTO artifacts (path, category, size, created_at, last_access)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            adopted,
+        )
+        known = {
+            path: [size, last_access]
+            for path, size, last_access in conn.execute(
+                'SELECT path, size, last_access FROM artifacts WHERE category = ?', (category,)
+            )
+        }
+
+        doomed = []
+        max_age = policy.get('max_age')
+        if max_age:
+            doomed = [path for path, (_, last_access) in known.items() if now - last_access > max_age]
+        remaining = {path: entry for path, entry in known.items() if path not in doomed}
+        max_bytes = policy.get('max_bytes')
+        total = sum(size for size, _ in remaining.values())
+        if max_bytes and total > max_bytes:
+            target = int(max_bytes * 0.9)
+            for path, (size, _) in sorted(remaining.items(), key=lambda item: item[1][1]):
+                if total <= target:
+                    break
+                doomed.append(path)
+                total -= size
+
+        if not dry_run:
+            conn.executemany('DELETE FROM artifacts WHERE path = ?', [(path,) for path in doomed])
+    for path in doomed:
+        summary['removed'] += 1
+        summary['freed'] += known[path][0]
+        if not dry_run:
+            _remove(path)
+    kept = [entry for path, entry in known.items() if path not in doomed]
+    summary['artifacts'] = len(kept)
+    summary['bytes'] = sum(size for size, _ in kept)
+    return summary
+
+
+def sweep_storage(dry_run=False):
+    """Run every retention policy plus the tile cache's own quota; returns one summary per category."""
+    summaries = [
+        sweep_category(category, policy, dry_run=dry_run)
+        for category, policy in retention_policies().items()
+    ]
+    tile_cache = TileCache()
+    tile_summary = {'category': 'tiles', 'removed': 0, 'freed': 0}
+    if not dry_run:
+        before = tile_cache.total_size()
+        max_idle = getattr(settings, 'TILE_CACHE_MAX_IDLE', None)
+        if max_idle:
+            tile_summary['removed'] += tile_cache.expire(max_idle)
+        tile_summary['removed'] += tile_cache.evict()
+        tile_summary['freed'] = before - tile_cache.total_size()
+    tile_summary['bytes'] = tile_cache.total_size()
+    summaries.append(tile_summary)
+    return summaries
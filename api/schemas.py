@@ -20,12 +20,7 @@ land_schema = extend_schema(
         description="Add a new land for the user",
     )
 
-class TileGenerationSerializer(serializers.Serializer):
-    min_lon = serializers.FloatField(default=30.304434642130218)
-    min_lat = serializers.FloatField(default=30.174682637534644)
-    max_lon = serializers.FloatField(default=30.42143846734797)
-    max_lat = serializers.FloatField(default=30.283438554006977)
-    zoom_level = serializers.IntegerField(default=12)
+class TileParamsSerializer(serializers.Serializer):
     start_date = serializers.CharField(default="2025-01-01")
     end_date = serializers.CharField(default="2025-03-01")
     cloud_cover = serializers.IntegerField(default=30)
@@ -33,13 +28,90 @@ class TileGenerationSerializer(serializers.Serializer):
     band2 = serializers.CharField(default="nir")
     formula = serializers.CharField(default="(band2-band1)/(band2+band1)")
     colormap_str = serializers.CharField(default="RdYlGn")
+    vmin = serializers.FloatField(required=False, allow_null=True, help_text="Index value mapped to the start of the colormap (default: tile minimum)")
+    vmax = serializers.FloatField(required=False, allow_null=True, help_text="Index value mapped to the end of the colormap (default: tile maximum)")
+    image_format = serializers.ChoiceField(choices=["png", "palette", "webp", "webp_lossy"], default="png", help_text="Tile encoding: png, 8-bit palette png, lossless webp or lossy webp")
+    compress_level = serializers.IntegerField(required=False, allow_null=True, min_value=0, max_value=9, help_text="zlib level for png/palette tiles (default 6)")
+    quality = serializers.IntegerField(required=False, allow_null=True, min_value=1, max_value=100, help_text="Quality of webp_lossy tiles (default 80)")
+
+    def validate(self, attrs):
+        if attrs.get("vmin") is not None and attrs.get("vmax") is not None and attrs["vmin"] >= attrs["vmax"]:
+            raise serializers.ValidationError({"vmax": "vmax must be greater than vmin"})
+        return attrs
+
+class FarmAreaClipSerializer(serializers.Serializer):
+    farm_area_id = serializers.IntegerField(required=False, help_text="Only render tiles that intersect this farm area's boundary; needs an authenticated owner")
+    mask_outside = serializers.BooleanField(default=False, help_text="Make pixels outside the farm area boundary transparent")
+
+class TileClipSerializer(FarmAreaClipSerializer):
+    clip_token = serializers.CharField(required=False, help_text="Signed farm area reference from a generated map's tile URLs, in place of farm_area_id")
+
+class TileGenerationSerializer(TileParamsSerializer, FarmAreaClipSerializer):
+    min_lon = serializers.FloatField(default=30.304434642130218)
+    min_lat = serializers.FloatField(default=30.174682637534644)
+    max_lon = serializers.FloatField(default=30.42143846734797)
+    max_lat = serializers.FloatField(default=30.283438554006977)
+    zoom_level = serializers.IntegerField(default=12)
+    concurrency = serializers.IntegerField(default=8, min_value=1, max_value=64)
+    tile_timeout = serializers.FloatField(default=60, min_value=1)
+    map_mode = serializers.ChoiceField(choices=["embedded", "tile_layer"], default="embedded")
+    include_map_html = serializers.BooleanField(default=True)
+    archive = serializers.BooleanField(default=False, help_text="Pack the tiles into a single MBTiles archive instead of loose PNGs")
+    min_zoom = serializers.IntegerField(required=False, min_value=0, help_text="Also build overview tiles down to this zoom from the zoom_level tiles")
+    stream = serializers.ChoiceField(choices=["ndjson", "sse"], required=False, help_text="Stream one record per tile as it completes, as newline-delimited JSON or Server-Sent Events")
+    tile_format = serializers.ChoiceField(choices=["png", "u16", "f32"], default="png", help_text="png, or raw index values as quantized uint16 / float32 data tiles for client-side rendering")
+    timings = serializers.BooleanField(default=False, help_text="Add a timings block with the seconds spent per stage (search, read, band_math, encode, write, map) and cache hit/miss counters")
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if attrs.get("archive") and attrs.get("tile_format", "png") != "png":
+            raise serializers.ValidationError({"tile_format": "Only png tiles can be archived"})
+        if attrs.get("min_zoom") is not None and attrs["min_zoom"] > attrs["zoom_level"]:
+            raise serializers.ValidationError({"min_zoom": "min_zoom must not be greater than zoom_level"})
+        return attrs
 
 tile_generation_schema = extend_schema(
     request=TileGenerationSerializer,
     responses={
-        200: OpenApiResponse(description="Tile generation started successfully"),
+        200: OpenApiResponse(description="Tiles generated; with stream set, one NDJSON line or SSE message per tile instead"),
+        400: OpenApiResponse(description="Invalid tile generation parameters or generation failed"),
+        401: OpenApiResponse(description="farm_area_id given without an authenticated user"),
+        404: OpenApiResponse(description="Farm area not found"),
     },
-    description="Generate satellite image tiles for a specified bounding box",
+    description="Generate satellite image tiles for a specified bounding box or farm area",
+)
+
+tile_schema = extend_schema(
+    parameters=[TileParamsSerializer, TileClipSerializer],
+    responses={
+        (200, "image/png"): OpenApiResponse(description="PNG or WebP tile, as the URL extension and image_format say"),
+        304: OpenApiResponse(description="Tile unchanged since the ETag sent in If-None-Match"),
+        400: OpenApiResponse(description="Invalid tile coordinates or index parameters"),
+        404: OpenApiResponse(description="Farm area not found"),
+    },
+    description="Render a single XYZ map tile on demand. Index parameters are passed in the query string.",
+)
+
+data_tile_schema = extend_schema(
+    parameters=[TileParamsSerializer, TileClipSerializer],
+    responses={
+        (200, "application/octet-stream"): OpenApiResponse(description="Raw u16 or f32 data tile, see api/rendering.py"),
+        304: OpenApiResponse(description="Tile unchanged since the ETag sent in If-None-Match"),
+        400: OpenApiResponse(description="Invalid tile coordinates or index parameters"),
+        404: OpenApiResponse(description="Farm area not found"),
+    },
+    description="Serve a single XYZ tile as raw index values for client-side rendering.",
+)
+
+tile_job_schema = extend_schema(
+    request=TileGenerationSerializer,
+    responses={
+        202: OpenApiResponse(description="Tile generation job queued"),
+        400: OpenApiResponse(description="Invalid tile generation parameters"),
+        401: OpenApiResponse(description="Authentication required"),
+        404: OpenApiResponse(description="farm_area_id is not one of the user's farm areas"),
+    },
+    description="Queue tile generation for a bounding box and return a job id to poll; only the requesting user can see the job",
 )
 
 class TimeSeriesSerializer(serializers.Serializer):
@@ -55,13 +127,36 @@ class TimeSeriesSerializer(serializers.Serializer):
     formula = serializers.CharField(default="(band2-band1)/(band2+band1)", help_text="Formula for band calculation")
     operation = serializers.CharField(default="median", help_text="Statistical operation to apply")
     timeseries = serializers.BooleanField(default=True, help_text="Whether to compute time series")
-    workers = serializers.IntegerField(default=16, help_text="Number of workers for processing")
+    workers = serializers.IntegerField(default=16, min_value=1, help_text="Number of workers for processing, capped by the server's CPU budget")
+    incremental = serializers.BooleanField(default=False, help_text="Keep per-scene values of this bbox/formula and only compute scenes not seen by earlier runs")
+    priority = serializers.IntegerField(default=1, min_value=1, max_value=10, help_text="Relative share of the CPU budget while other time series run at the same time")
 
 time_series_schema = extend_schema(
     request=TimeSeriesSerializer,
     responses={
-        200: OpenApiResponse(description="Time series computation completed successfully and files returned"),
-        400: OpenApiResponse(description="VirtuGhan package not installed or computation failed"),
+        200: OpenApiResponse(description="Result of an identical earlier request that is still fresh"),
+        202: OpenApiResponse(description="Time series computation queued; poll status_url"),
+        400: OpenApiResponse(description="Invalid time series parameters"),
+        401: OpenApiResponse(description="Authentication required"),
     },
-    description="Compute time series using VirtuGhan Python package directly and return GIF and values file.",
+    description="Queue a time series computation with VirtuGhan and return a request id to poll for the GIF and values file; only the requesting user can see the request.",
 )
+
+class ZonalStatsSerializer(serializers.Serializer):
+    start_date = serializers.CharField(default="2025-01-01", help_text="Start date in YYYY-MM-DD format")
+    end_date = serializers.CharField(default="2025-03-01", help_text="End date in YYYY-MM-DD format")
+    cloud_cover = serializers.IntegerField(default=30, help_text="Maximum cloud cover percentage")
+    band1 = serializers.CharField(default="red", help_text="First band for calculation")
+    band2 = serializers.CharField(default="nir", allow_blank=True, help_text="Second band for calculation")
+    formula = serializers.CharField(default="(band2-band1)/(band2+band1)", help_text="Formula for band calculation")
+    percentiles = serializers.CharField(default="10,25,75,90", help_text="Comma-separated percentiles to report besides the median")
+    concurrency = serializers.IntegerField(default=8, min_value=1, max_value=32, help_text="Scenes read at the same time")
+
+    def validate_percentiles(self, value):
+        try:
+            percentiles = [float(item) for item in value.split(",") if item.strip()]
+        except ValueError:
+            raise serializers.ValidationError("Percentiles must be numbers")
+        if any(not 0 <= percentile <= 100 for percentile in percentiles):
+            raise serializers.ValidationError("Percentiles must be between 0 and 100")
+        return percentiles
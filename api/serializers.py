@@ -1,5 +1,6 @@
+from django.utils import timezone
 from rest_framework import serializers
-from .models import FarmArea
+from .models import FarmArea, Job
 from account.models import Profile
 
 class FarmAreaSerializer(serializers.ModelSerializer):
@@ -46,3 +47,24 @@ class FarmAreaSerializer(serializers.ModelSerializer):
             'otherDocuments', 'created_at', 'updated_at', 'user'
         ]
         read_only_fields = ['created_at', 'updated_at']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    eta_seconds = serializers.SerializerMethodField()
+
+    def get_eta_seconds(self, obj):
+        # Linear extrapolation from the tiles finished so far
+        if obj.status != Job.STATUS_RUNNING or not obj.started_at or not obj.progress_done:
+            return None
+        elapsed = (timezone.now() - obj.started_at).total_seconds()
+        remaining = max(obj.progress_total - obj.progress_done, 0)
+        return round(elapsed / obj.progress_done * remaining, 1)
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'status', 'phase', 'progress_done', 'progress_total',
+            'eta_seconds', 'result', 'error', 'attempts', 'created_at',
+            'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: cross-process locking is simply unavailable
+    fcntl = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one computation.
+
+    The first caller starts ``func()`` as a task of its own; callers that
+    arrive while it is running await the same task. The task is shielded,
+    so one caller timing out or being cancelled does not cancel the work
+    the others are waiting for.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, func):
+        loop = asyncio.get_running_loop()
+        # asyncio tasks are bound to their loop, so flights never cross loops
+        flight_key = (loop, key)
+        task = self._tasks.get(flight_key)
+        if task is None:
+            task = loop.create_task(func())
+            self._tasks[flight_key] = task
+            task.add_done_callback(lambda t: self._finish(flight_key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, flight_key, task):
+        self._tasks.pop(flight_key, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            task.exception()
+
+    def in_flight(self):
+        return len(self._tasks)
+
+
+@contextlib.asynccontextmanager
+async def file_lock(path, poll_interval=0.05, max_poll_interval=0.5):
+    """
+    Hold an exclusive ``flock`` on ``path`` without blocking the event loop.
+    Does nothing where fcntl is not available.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        delay = poll_interval
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
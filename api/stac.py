@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import requests
+from django.conf import settings
+
+from .metrics import count, stage
+
+DEFAULT_STAC_API_URL = "https://earth-search.aws.element84.com/v1/search"
+DEFAULT_STAC_COLLECTION = "sentinel-2-l2a"
+DEFAULT_STAC_CACHE_TTL = 24 * 3600
+
+
+def search_scenes(bbox, start_date, end_date, cloud_cover, limit=100):
+    """
+    Return every STAC feature intersecting ``bbox`` (west, south, east, north)
+    acquired between ``start_date`` and ``end_date`` with cloud cover below
+    ``cloud_cover``, following the API's pagination links.
+    """
+    url = getattr(settings, 'STAC_API_URL', DEFAULT_STAC_API_URL)
+    body = {
+        "collections": [getattr(settings, 'STAC_COLLECTION', DEFAULT_STAC_COLLECTION)],
+        "bbox": [float(value) for value in bbox],
+        "datetime": f"{start_date}T00:00:00Z/{end_date}T23:59:59Z",
+        "query": {"eo:cloud_cover": {"lt": cloud_cover}},
+        "limit": limit,
+        "sortby": [{"field": "properties.datetime", "direction": "desc"}],
+    }
+    method = "POST"
+    features = []
+    while url:
+        if method == "POST":
+            response = requests.post(url, json=body, timeout=30)
+        else:
+            response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        features.extend(data.get("features", []))
+        next_link = next((link for link in data.get("links", []) if link.get("rel") == "next"), None)
+        if next_link is None:
+            break
+        url = next_link["href"]
+        method = next_link.get("method", "GET").upper()
+        body = next_link.get("body", body)
+    return features
+
+
+def _stac_cache_dir():
+    return str(getattr(settings, 'STAC_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'stac_cache')))
+
+
+def search_cache_key(bbox, start_date, end_date, cloud_cover):
+    """
+    Return the cache key of a scene search. The bbox is rounded to 1e-6
+    degrees (about 10 cm) so float noise from serializers and clients does
+    not split the cache.
+    """
+    payload = {
+        "url": getattr(settings, 'STAC_API_URL', DEFAULT_STAC_API_URL),
+        "collection": getattr(settings, 'STAC_COLLECTION', DEFAULT_STAC_COLLECTION),
+        "bbox": [round(float(value), 6) for value in bbox],
+        "start_date": str(start_date),
+        "end_date": str(end_date),
+        "cloud_cover": float(cloud_cover),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def cached_search_scenes(bbox, start_date, end_date, cloud_cover, ttl=None):
+    """
+    search_scenes with a disk cache shared by every process: results are
+    kept as JSON under STAC_CACHE_DIR and reused for STAC_CACHE_TTL seconds.
+    """
+    ttl = getattr(settings, 'STAC_CACHE_TTL', DEFAULT_STAC_CACHE_TTL) if ttl is None else ttl
+    path = os.path.join(_stac_cache_dir(), f'{search_cache_key(bbox, start_date, end_date, cloud_cover)}.json')
+    try:
+        if time.time() - os.path.getmtime(path) < ttl:
+            with open(path, 'r', encoding='utf-8') as f:
+                features = json.load(f)
+            count('stac_cache_hit')
+            return features
+    except (OSError, ValueError):
+        # Missing, unreadable or half-written: search again
+        pass
+    count('stac_cache_miss')
+    with stage('search'):
+        features = search_scenes(bbox, start_date, end_date, cloud_cover)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(features, f)
+    os.replace(tmp_path, path)
+    print(f"Cached {len(features)} STAC scenes for bbox {list(bbox)}")
+    return features
+
+
+def install_vcube_search_cache():
+    """
+    Make VCubeProcessor's scene discovery go through cached_search_scenes.
+    Called once from ApiConfig.ready; a no-op without VirtuGhan.
+    """
+    try:
+        import vcube.engine
+    except ImportError:
+        return
+
+    def search_stac_api(bbox, start_date, end_date, cloud_cover):
+        return cached_search_scenes(bbox, start_date, end_date, cloud_cover)
+
+    vcube.engine.search_stac_api = search_stac_api
@@ -1,3 +1,1748 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from PIL import Image
+from asgiref.sync import async_to_sync
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import NotAuthenticated, NotFound
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.tokens import AccessToken
+
+from account.models import Account, Profile
+
+from .cpu_budget import CPUBudget, fair_shares
+from .geometry import farm_area_polygon, tiles_in_polygon
+from .jobs import claim_next_job, enqueue, requeue_orphaned_jobs
+from .models import FarmArea, Job, TimeSeriesPoint
+from .rendering import (
+    DATA_TILE_NODATA, decode_data_tile, decode_values, downsample_values, encode_data_tile, encode_tile_image,
+    encode_values,
+)
+from .raster_env import DatasetPool, configure_gdal
+from .retention import default_policies, record_artifact, sweep_category
+from .singleflight import SingleFlight
+from .tile_archive import MBTilesArchive
+from .tile_cache import TileCache, tile_cache_key, values_cache_key, variant_cache_key, window_max_age
+from .views import TileView, owned_farm_area
+from .zonal import polygon_grid, zonal_statistics
+from . import metrics, stac, time_series
+
+
+TILE_PARAMS = dict(
+    start_date="2025-01-01",
+    end_date="2025-03-01",
+    cloud_cover=30,
+    band1="red",
+    band2="nir",
+    formula="(band2-band1)/(band2+band1)",
+    colormap_str="RdYlGn",
+    vmin=None,
+    vmax=None,
+)
+
+FARM_COORDINATES = [[30.2, 30.35], [30.2, 30.37], [30.22, 30.37], [30.22, 30.35]]
+
+
+def make_user(username):
+    user = Account.objects.create_user(username=username, email=f"{username}@example.com")
+    return user, Profile.objects.create(user=user)
+
+
+def auth_header(user):
+    return {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+
+
+def age_cache_entries(tile_cache, seconds):
+    # Move every entry back in time instead of sleeping in tests
+    with tile_cache._transaction() as conn:
+        conn.execute(
+            "UPDATE tiles SET created_at = created_at - ?, last_access = last_access - ?", (seconds, seconds)
+        )
+
+
+class TileCacheKeyTests(TestCase):
+    def test_tile_key_is_stable(self):
+        # Keys address tiles on disk across releases; changing them orphans every cached tile
+        self.assertEqual(
+            tile_cache_key(4785, 3372, 13, **TILE_PARAMS),
+            "6e3005383569a7c4c93d4250264fe64b8fcf6da95e2aab07d5266f8e7f5e27e0",
+        )
+
+    def test_tile_key_ignores_scheduling_options(self):
+        self.assertEqual(
+            tile_cache_key(1, 2, 3, **TILE_PARAMS),
+            tile_cache_key(1, 2, 3, concurrency=4, zoom_level=3, **TILE_PARAMS),
+        )
+
+    def test_tile_key_depends_on_tile_and_params(self):
+        key = tile_cache_key(1, 2, 3, **TILE_PARAMS)
+        self.assertNotEqual(key, tile_cache_key(2, 2, 3, **TILE_PARAMS))
+        self.assertNotEqual(key, tile_cache_key(1, 2, 3, **dict(TILE_PARAMS, colormap_str="viridis")))
+
+    def test_default_encoding_keeps_plain_key(self):
+        key = tile_cache_key(1, 2, 3, **TILE_PARAMS)
+        self.assertEqual(key, tile_cache_key(1, 2, 3, image_format="png", compress_level=6, **TILE_PARAMS))
+
+    def test_other_encodings_are_variants(self):
+        key = tile_cache_key(1, 2, 3, **TILE_PARAMS)
+        webp_key = tile_cache_key(1, 2, 3, image_format="webp_lossy", **TILE_PARAMS)
+        self.assertEqual(webp_key, variant_cache_key(key, image_format="webp_lossy", quality=80))
+        # Options of other formats do not split the key
+        self.assertEqual(webp_key, tile_cache_key(1, 2, 3, image_format="webp_lossy", compress_level=1, **TILE_PARAMS))
+        self.assertNotEqual(webp_key, tile_cache_key(1, 2, 3, image_format="webp_lossy", quality=50, **TILE_PARAMS))
+
+    def test_values_key_is_shared_by_colormaps(self):
+        self.assertEqual(
+            values_cache_key(1, 2, 3, **TILE_PARAMS),
+            values_cache_key(1, 2, 3, **dict(TILE_PARAMS, colormap_str="viridis", vmin=0, vmax=1)),
+        )
+        self.assertNotEqual(
+            values_cache_key(1, 2, 3, **TILE_PARAMS),
+            values_cache_key(1, 2, 3, **dict(TILE_PARAMS, formula="band1")),
+        )
+
+
+class ValuesEncodingTests(TestCase):
+    def test_values_keep_full_precision(self):
+        values = np.array([[0.123456789, 123456.789], [np.nan, -70000.5]], dtype=np.float32)
+        np.testing.assert_array_equal(decode_values(encode_values(values)), values)
+
+
+class ImageEncodingTests(TestCase):
+    def setUp(self):
+        # Stays below 0.9 so the palette never needs the index it gives up to NaN
+        self.values = np.linspace(0, 0.89, 256 * 256, dtype=np.float32).reshape(256, 256)
+        self.values[0, :10] = np.nan
+
+    def decode(self, data):
+        with Image.open(BytesIO(data)) as image:
+            return image.format, np.asarray(image.convert("RGBA"))
+
+    def encode(self, image_format, values=None, **options):
+        values = self.values if values is None else values
+        return encode_tile_image(values, "RdYlGn", 0, 1, image_format=image_format, **options)
+
+    def test_lossless_encodings_match_png(self):
+        _, png = self.decode(self.encode("png"))
+        self.assertTrue((png[0, :10, 3] == 0).all())
+        for image_format, container in (("palette", "PNG"), ("webp", "WEBP")):
+            with self.subTest(image_format=image_format):
+                decoded_format, pixels = self.decode(self.encode(image_format))
+                self.assertEqual(decoded_format, container)
+                np.testing.assert_array_equal(pixels[:, :, 3], png[:, :, 3])
+                # Transparent pixels may keep any color
+                opaque = png[:, :, 3] == 255
+                np.testing.assert_array_equal(pixels[opaque], png[opaque])
+
+    def test_palette_png_is_smaller_than_rgb_png(self):
+        noisy = np.random.default_rng(0).random((256, 256), dtype=np.float32)
+        self.assertLess(len(self.encode("palette", noisy)), len(self.encode("png", noisy)))
+
+    def test_lossy_webp_trades_quality_for_size(self):
+        noisy = np.random.default_rng(0).random((256, 256), dtype=np.float32)
+        png = self.encode("png", noisy)
+        lossy = self.encode("webp_lossy", noisy, quality=50)
+        self.assertEqual(self.decode(lossy)[0], "WEBP")
+        self.assertLess(len(lossy), len(png))
+        self.assertLess(len(lossy), len(self.encode("webp_lossy", noisy, quality=95)))
+
+    def test_compress_level_changes_png_size_not_pixels(self):
+        fast, small = self.encode("png", compress_level=1), self.encode("png", compress_level=9)
+        self.assertLessEqual(len(small), len(fast))
+        np.testing.assert_array_equal(self.decode(fast)[1], self.decode(small)[1])
+
+
+class DataTileTests(TestCase):
+    def setUp(self):
+        self.values = np.linspace(-0.9, 0.9, 256 * 256, dtype=np.float32).reshape(256, 256)
+        self.values[0, :10] = np.nan
+
+    def test_f32_round_trip_is_exact(self):
+        np.testing.assert_array_equal(decode_data_tile(encode_data_tile(self.values, "f32")), self.values)
+
+    def test_u16_round_trip_within_one_step(self):
+        decoded = decode_data_tile(encode_data_tile(self.values, "u16"))
+        self.assertTrue(np.isnan(decoded[0, :10]).all())
+        step = 1.8 / (DATA_TILE_NODATA - 1)
+        np.testing.assert_allclose(decoded[1:], self.values[1:], atol=step)
+
+    def test_u16_clamps_to_requested_range(self):
+        decoded = decode_data_tile(encode_data_tile(self.values, "u16", vmin=0, vmax=0.5))
+        self.assertAlmostEqual(float(np.nanmin(decoded)), 0.0, places=5)
+        self.assertAlmostEqual(float(np.nanmax(decoded)), 0.5, places=5)
+
+    def test_rejects_other_payloads(self):
+        with self.assertRaises(ValueError):
+            decode_data_tile(b"\x89PNG" + bytes(40))
+
+    def test_f32_tiles_keep_computed_values(self):
+        from . import utils
+
+        async def compute_tile_values(x, y, z, *args, **kwargs):
+            return self.values, {"date": "2025-02-01"}
+
+        with tempfile.TemporaryDirectory() as root, \
+                mock.patch.object(utils, "compute_tile_values", compute_tile_values):
+            tile_cache = TileCache(root=root)
+            # The first request fills the values cache, the f32 tile is then built from it
+            async_to_sync(utils.render_data_tile)(tile_cache, 4785, 3372, 13, "u16", **TILE_PARAMS)
+            entry, cached = async_to_sync(utils.render_data_tile)(tile_cache, 4785, 3372, 13, "f32", **TILE_PARAMS)
+            with open(entry["path"], "rb") as f:
+                data = f.read()
+        self.assertFalse(cached)
+        np.testing.assert_array_equal(decode_data_tile(data), self.values)
+
+
+class TileProcessorParityTests(TestCase):
+    """compute_tile_values and the LUT recoloring against vcube's TileProcessor on local rasters."""
+    tile = (4785, 3372, 13)
+
+    def setUp(self):
+        import mercantile
+        import rasterio
+        from rasterio.transform import from_bounds
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        x, y, z = self.tile
+        bounds = mercantile.xy_bounds(x, y, z)
+        rng = np.random.default_rng(0)
+        self.urls = {}
+        for band in ("red", "nir"):
+            data = rng.integers(1, 10000, (256, 256), dtype=np.uint16)
+            data[:8, :8] = 0
+            path = os.path.join(self.tmp.name, f"{band}.tif")
+            with rasterio.open(
+                path, "w", driver="GTiff", width=256, height=256, count=1, dtype="uint16", nodata=0,
+                crs="EPSG:3857", transform=from_bounds(*bounds, 256, 256),
+            ) as dst:
+                dst.write(data, 1)
+            self.urls[band] = path
+        west, south, east, north = mercantile.bounds(x, y, z)
+        self.features = [
+            # Newest, but only clips the tile
+            self.feature("S2B_36RUU_20250220_0_L2A", "2025-02-20T08:00:00Z", west + (east - west) / 2, south, east + 1, north + 1),
+            self.feature("S2A_36RUU_20250210_0_L2A", "2025-02-10T08:00:00Z", west - 1, south - 1, east + 1, north + 1),
+            self.feature("S2A_36RUU_20250130_0_L2A", "2025-01-30T08:00:00Z", west - 1, south - 1, east + 1, north + 1),
+        ]
+
+    def feature(self, scene_id, date, west, south, east, north):
+        return {
+            "id": scene_id,
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+            },
+            "properties": {"datetime": date, "eo:cloud_cover": 5},
+            "assets": {band: {"href": url} for band, url in self.urls.items()},
+        }
+
+    def compute(self, formula):
+        from . import rendering
+
+        params = dict(TILE_PARAMS, formula=formula)
+        with mock.patch.object(rendering, "cached_search_scenes", return_value=self.features):
+            return async_to_sync(rendering.compute_tile_values)(
+                *self.tile, **{name: params[name] for name in ("start_date", "end_date", "cloud_cover", "band1", "band2", "formula")}
+            )
+
+    def tile_processor_pixels(self, formula, colormap_str="RdYlGn"):
+        import vcube.tile
+
+        async def search(*args):
+            return self.features
+
+        x, y, z = self.tile
+        with mock.patch.object(vcube.tile, "search_stac_api_async", search):
+            image_bytes, feature = async_to_sync(vcube.tile.TileProcessor().cached_generate_tile)(
+                x, y, z, "2025-01-01", "2025-03-01", 30, "red", "nir", formula, colormap_str,
+            )
+        return np.asarray(Image.open(BytesIO(image_bytes)).convert("RGB")), feature
+
+    def pixels(self, values, colormap_str="RdYlGn"):
+        return np.asarray(Image.open(BytesIO(encode_tile_image(values, colormap_str))).convert("RGB"))
+
+    def test_same_scene_and_colors(self):
+        # Nodata pixels stay in the stretch, as raw zeros
+        for formula in ("band2 / 10000", "np.sqrt(band1) + band2 * 2"):
+            values, meta = self.compute(formula)
+            expected, feature = self.tile_processor_pixels(formula, colormap_str="viridis")
+            self.assertEqual(meta["scene"], feature["id"])
+            self.assertEqual(meta["scene"], "S2A_36RUU_20250210_0_L2A")
+            self.assertFalse(np.isnan(values).any())
+            np.testing.assert_array_equal(self.pixels(values, "viridis"), expected)
+
+    def test_undefined_values_are_transparent(self):
+        # TileProcessor renders the whole tile black once 0/0 yields NaN; only those pixels are dropped here
+        values, _ = self.compute("(band2-band1)/(band2+band1)")
+        self.assertTrue(np.isnan(values[:8, :8]).all())
+        self.assertFalse(np.isnan(values[8:]).any())
+        image = Image.open(BytesIO(encode_tile_image(values)))
+        self.assertEqual(image.mode, "RGBA")
+
+    def test_no_scene_contains_the_tile(self):
+        self.features = self.features[:1]
+        with self.assertRaises(ValueError):
+            self.compute("band1")
+
+
+class RasterEnvTests(TestCase):
+    def setUp(self):
+        import mercantile
+        import rasterio
+        from rasterio.transform import from_bounds
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.paths = []
+        for name in ("a", "b", "c"):
+            path = os.path.join(self.tmp.name, f"{name}.tif")
+            with rasterio.open(
+                path, "w", driver="GTiff", width=64, height=64, count=1, dtype="uint16",
+                crs="EPSG:3857", transform=from_bounds(*mercantile.xy_bounds(4785, 3372, 13), 64, 64),
+            ) as dst:
+                dst.write(np.ones((64, 64), dtype=np.uint16), 1)
+            self.paths.append(path)
+        self.pool = DatasetPool(max_size=2)
+        self.addCleanup(self.pool.close)
+
+    def test_idle_readers_are_reused(self):
+        with self.pool.reader(self.paths[0]) as first:
+            first.tile(4785, 3372, 13)
+        with self.pool.reader(self.paths[0]) as again:
+            self.assertIs(again, first)
+            # A concurrent checkout of the same file gets a reader of its own
+            with self.pool.reader(self.paths[0]) as concurrent:
+                self.assertIsNot(concurrent, first)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_least_recently_used_readers_are_closed(self):
+        readers = []
+        for path in self.paths:
+            with self.pool.reader(path) as reader:
+                readers.append(reader)
+        self.assertEqual(len(self.pool), 2)
+        self.assertTrue(readers[0].dataset.closed)
+        self.assertFalse(readers[2].dataset.closed)
+
+    def test_a_failed_read_discards_its_reader(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.reader(self.paths[0]) as reader:
+                raise RuntimeError("connection reset")
+        self.assertTrue(reader.dataset.closed)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_gdal_options_leave_the_environment_in_charge(self):
+        with mock.patch.dict(os.environ, {"GDAL_HTTP_VERSION": "1.1"}), \
+                override_settings(RASTER_GDAL_OPTIONS={"GDAL_HTTP_TIMEOUT": "10"}):
+            configure_gdal()
+            self.assertEqual(os.environ["GDAL_HTTP_VERSION"], "1.1")
+            self.assertEqual(os.environ["VSI_CACHE"], "TRUE")
+            self.assertEqual(os.environ["GDAL_HTTP_TIMEOUT"], "10")
+
+    def test_benchmark_reports_both_runs(self):
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("bench_raster_io", zoom=14, size=1024, passes=2, workers=2, stdout=out)
+        report = json.loads(out.getvalue())
+        for name in ("baseline", "tuned"):
+            self.assertGreater(report[name]["http_requests"], 0)
+        # Pooled readers skip re-reading the header of every tile
+        self.assertLess(report["tuned"]["http_requests"], report["baseline"]["http_requests"])
+        self.assertGreater(report["speedup"], 0)
+
+
+class TileCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = TileCache(root=self.tmp.name, max_bytes=1000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_put_and_get(self):
+        entry = self.cache.put("ab" * 32, b"tile", meta={"date": "2025-02-01"})
+        self.assertEqual(self.cache.get("ab" * 32)["etag"], entry["etag"])
+        self.assertEqual(self.cache.read("ab" * 32), (b"tile", self.cache.get("ab" * 32)))
+        self.assertEqual(entry["meta"], {"date": "2025-02-01"})
+        self.assertIsNone(self.cache.get("cd" * 32))
+
+    def test_replacing_a_tile_keeps_the_total(self):
+        self.cache.put("ab" * 32, b"x" * 100)
+        self.cache.put("ab" * 32, b"x" * 40)
+        self.assertEqual(self.cache.total_size(), 40)
+
+    def test_get_forgets_deleted_files(self):
+        entry = self.cache.put("ab" * 32, b"x" * 100)
+        os.remove(entry["path"])
+        self.assertIsNone(self.cache.get("ab" * 32))
+        self.assertEqual(self.cache.total_size(), 0)
+
+    def test_put_evicts_least_recently_used(self):
+        for index in range(4):
+            self.cache.put(f"{index:02d}" * 32, b"x" * 250)
+            # Distinct access times so the LRU order is well defined
+            time.sleep(0.01)
+        self.cache.get("00" * 32)
+        self.assertEqual(self.cache.total_size(), 1000)
+        self.cache.put("04" * 32, b"x" * 250)
+        # Over quota: down to 90% of it, oldest access first
+        self.assertEqual(self.cache.total_size(), 750)
+        self.assertIsNone(self.cache.get("01" * 32))
+        self.assertIsNone(self.cache.get("02" * 32))
+        for key in ("00", "03", "04"):
+            self.assertIsNotNone(self.cache.get(key * 32))
+
+    def test_expire_drops_idle_tiles(self):
+        old = self.cache.put("ab" * 32, b"x" * 10)
+        age_cache_entries(self.cache, 120)
+        self.cache.put("cd" * 32, b"x" * 10)
+        self.assertEqual(self.cache.expire(60), 1)
+        self.assertFalse(os.path.exists(old["path"]))
+        self.assertIsNotNone(self.cache.get("cd" * 32))
+        self.assertEqual(self.cache.total_size(), 10)
+
+    def test_max_age_misses_older_entries(self):
+        self.cache.put("ab" * 32, b"tile")
+        age_cache_entries(self.cache, 120)
+        self.assertIsNone(self.cache.get("ab" * 32, max_age=60))
+        self.assertIsNone(self.cache.read("ab" * 32, max_age=60))
+        self.assertIsNotNone(self.cache.get("ab" * 32, max_age=300))
+        self.assertIsNotNone(self.cache.get("ab" * 32))
+
+    def test_total_is_computed_for_existing_manifests(self):
+        self.cache.put("ab" * 32, b"x" * 10)
+        with self.cache._transaction() as conn:
+            conn.execute("DELETE FROM stats")
+        self.assertEqual(TileCache(root=self.tmp.name).total_size(), 10)
+
+
+@override_settings(TILE_OPEN_WINDOW_MAX_AGE=3600)
+class OpenWindowTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tile_cache = TileCache(root=self.tmp.name)
+        self.scenes = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def render(self, **params):
+        from . import utils
+
+        async def compute_tile_values(x, y, z, *args, **kwargs):
+            # Each computation sees one more scene, like a window still being acquired
+            self.scenes.append(f"2025-02-{len(self.scenes) + 1:02d}")
+            return np.full((256, 256), len(self.scenes) / 10, dtype=np.float32), {"date": self.scenes[-1]}
+
+        with mock.patch.object(utils, "compute_tile_values", compute_tile_values):
+            entry, _ = async_to_sync(utils.render_tile)(
+                self.tile_cache, 4785, 3372, 13, **dict(TILE_PARAMS, vmin=0, vmax=1, **params)
+            )
+        return entry
+
+    def test_window_max_age(self):
+        self.assertIsNone(window_max_age(TILE_PARAMS))
+        self.assertEqual(window_max_age(dict(TILE_PARAMS, end_date=datetime.date.today().isoformat())), 3600)
+        self.assertEqual(window_max_age(dict(TILE_PARAMS, end_date=None)), 3600)
+
+    def test_open_window_is_computed_again_once_stale(self):
+        end_date = datetime.date.today().isoformat()
+        first = self.render(end_date=end_date)
+        self.assertEqual(self.render(end_date=end_date)["etag"], first["etag"])
+        age_cache_entries(self.tile_cache, 3601)
+        second = self.render(end_date=end_date)
+        self.assertEqual(len(self.scenes), 2)
+        self.assertEqual(second["meta"]["date"], "2025-02-02")
+        self.assertNotEqual(second["etag"], first["etag"])
+
+    def test_closed_window_is_kept(self):
+        first = self.render()
+        age_cache_entries(self.tile_cache, 30 * 24 * 3600)
+        self.assertEqual(self.render()["etag"], first["etag"])
+        self.assertEqual(len(self.scenes), 1)
+
+
+@override_settings(TILE_OPEN_WINDOW_MAX_AGE=3600, TILE_CACHE_MAX_AGE=604800)
+class TileViewCacheControlTests(TestCase):
+    url = "/api/tiles/13/4785/3372.png"
+
+    def setUp(self):
+        from . import utils
+
+        self.tmp = tempfile.TemporaryDirectory()
+        settings_override = override_settings(TILE_CACHE_DIR=self.tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.scenes = []
+
+        async def compute_tile_values(x, y, z, *args, **kwargs):
+            self.scenes.append(f"2025-02-{len(self.scenes) + 1:02d}")
+            return np.full((256, 256), len(self.scenes) / 10, dtype=np.float32), {"date": self.scenes[-1]}
+
+        patcher = mock.patch.object(utils, "compute_tile_values", compute_tile_values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def get(self, end_date, **headers):
+        return self.client.get(self.url, {"end_date": end_date, "vmin": 0, "vmax": 1}, **headers)
+
+    def test_closed_window_is_immutable(self):
+        response = self.get("2025-03-01")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=604800, immutable")
+        revalidated = self.get("2025-03-01", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_open_window_revalidates_to_newer_scenes(self):
+        end_date = datetime.date.today().isoformat()
+        response = self.get(end_date)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+        # Within the max age the tile is unchanged
+        self.assertEqual(self.get(end_date, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        age_cache_entries(TileCache(), 3601)
+        # Once stale it is rendered again with the newer scene
+        revalidated = self.get(end_date, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 200)
+        self.assertNotEqual(revalidated["ETag"], response["ETag"])
+        self.assertEqual(len(self.scenes), 2)
+
+
+class TileArchiveTests(TestCase):
+    archive_id = "ab" * 16
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        settings_override = override_settings(
+            TILE_ARCHIVE_DIR=self.tmp.name, ARTIFACT_MANIFEST=os.path.join(self.tmp.name, "artifacts.sqlite3")
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.path = os.path.join(self.tmp.name, f"{self.archive_id}.mbtiles")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, tile_format="png"):
+        with MBTilesArchive(self.path, batch_size=2) as archive:
+            archive.set_metadata(format=tile_format)
+            for y in range(4):
+                archive.put(2, 1, y, f"tile-{y}".encode())
+
+    def test_round_trip_flips_rows_to_tms(self):
+        self.write()
+        with MBTilesArchive(self.path, readonly=True) as archive:
+            self.assertEqual(archive.get(2, 1, 0), b"tile-0")
+            self.assertEqual(archive.get(2, 1, 3), b"tile-3")
+            self.assertIsNone(archive.get(2, 0, 0))
+            self.assertEqual(archive.get_metadata("format"), "png")
+            # XYZ row 0 is stored as TMS row 2**z - 1
+            row = archive.conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = 2 AND tile_column = 1 AND tile_row = 3"
+            ).fetchone()
+        self.assertEqual(bytes(row[0]), b"tile-0")
+
+    def test_view_serves_tiles_in_the_archive_format(self):
+        self.write()
+        url = f"/api/tiles/archives/{self.archive_id}/2/1/3"
+        response = self.client.get(f"{url}.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"tile-3")
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(self.client.get(f"{url}.webp").status_code, 404)
+
+
+class TilePipelineMixin:
+    """Runs the tile pipeline on temporary storage, with compute_tile_values faked by ``compute``."""
+    bbox = dict(min_lon=30.30, min_lat=30.17, max_lon=30.34, max_lat=30.20)
+
+    def setUp(self):
+        from . import utils
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        settings_override = override_settings(
+            TILE_CACHE_DIR=os.path.join(self.tmp.name, "tiles"),
+            TILE_ARCHIVE_DIR=os.path.join(self.tmp.name, "archives"),
+            ARTIFACT_MANIFEST=os.path.join(self.tmp.name, "artifacts.sqlite3"),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for name, value in (("compute_tile_values", self.compute_tile_values), ("MAPS_DIR", os.path.join(self.tmp.name, "maps"))):
+            patcher = mock.patch.object(utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.computed = []
+
+    async def compute(self, x, y, z):
+        return np.full((256, 256), (x + y) % 10 / 10, dtype=np.float32)
+
+    async def compute_tile_values(self, x, y, z, *args, **kwargs):
+        self.computed.append((x, y, z))
+        return await self.compute(x, y, z), {"date": "2025-02-01T08:00:00Z", "cloud_cover": 5, "scene": "S2A"}
+
+    def generate(self, **kwargs):
+        from . import utils
+
+        options = dict(self.bbox, zoom_level=13, make_map=False)
+        options.update(kwargs)
+        return async_to_sync(utils.generate_tiles_and_map)(**options)
+
+
+class TilePipelineTestCase(TilePipelineMixin, TestCase):
+    pass
+
+
+class TileGenerationTests(TilePipelineTestCase):
+    def test_slow_tiles_time_out_into_failures(self):
+        async def compute(x, y, z):
+            if (x, y) == (4786, 3375):
+                await asyncio.sleep(5)
+            return np.zeros((256, 256), dtype=np.float32)
+
+        self.compute = compute
+        results, failures, _, _ = self.generate(tile_timeout=0.2)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(
+            [(failure["tile"], failure["error"]) for failure in failures],
+            [("4786_3375_13", "Timed out after 0.2 seconds")],
+        )
+
+    def test_concurrency_is_bounded(self):
+        running = []
+        peak = []
+
+        async def compute(x, y, z):
+            running.append((x, y))
+            peak.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove((x, y))
+            return np.zeros((256, 256), dtype=np.float32)
+
+        self.compute = compute
+        results, failures, _, _ = self.generate(concurrency=2)
+        self.assertEqual((len(results), failures), (4, []))
+        self.assertEqual(max(peak), 2)
+
+    def test_results_are_in_tile_order(self):
+        results, _, _, _ = self.generate()
+        self.assertEqual(
+            [result["tile"] for result in results],
+            ["4785_3374_13", "4785_3375_13", "4786_3374_13", "4786_3375_13"],
+        )
+        self.assertEqual(sorted(self.computed), [(4785, 3374, 13), (4785, 3375, 13), (4786, 3374, 13), (4786, 3375, 13)])
+
+
+class MapModeTests(TilePipelineTestCase):
+    def test_tile_layer_map_references_tile_urls(self):
+        results, _, map_path, map_html = self.generate(make_map=True, map_mode="tile_layer", tile_url_base="https://example.com/")
+        self.assertEqual(len(results), 4)
+        self.assertIn("https://example.com/api/tiles/{z}/{x}/{y}.png?", map_html)
+        self.assertNotIn("data:image/png;base64", map_html)
+        embedded_html = self.generate(make_map=True)[3]
+        self.assertIn("data:image/png;base64", embedded_html)
+        self.assertLess(len(map_html), len(embedded_html))
+        self.assertTrue(os.path.exists(map_path))
+
+    def test_map_html_can_be_left_out(self):
+        _, _, map_path, map_html = self.generate(make_map=True, map_mode="tile_layer", include_map_html=False)
+        self.assertIsNone(map_html)
+        self.assertTrue(os.path.exists(map_path))
+
+
+class TileGenerationViewTests(TilePipelineTestCase):
+    payload = dict(TilePipelineTestCase.bbox, zoom_level=13, map_mode="tile_layer", include_map_html=False)
+
+    def post(self, **payload):
+        from django.test import AsyncClient
+
+        async def request():
+            response = await AsyncClient().post(
+                "/api/generate-tiles/", dict(self.payload, **payload), content_type="application/json"
+            )
+            if response.streaming:
+                response.content_bytes = b"".join([chunk async for chunk in response.streaming_content])
+            return response
+
+        return async_to_sync(request)()
+
+    def test_generates_tiles_from_an_async_view(self):
+        response = self.post(timings=True)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["tiles_generated"], body["tiles_failed"]), (4, 0))
+        self.assertIsNone(body["map_html"])
+        self.assertTrue(body["map_url"].endswith(".html"))
+        self.assertEqual(body["timings"]["counters"]["tile_cache_miss"], 4)
+
+    def test_invalid_parameters_are_a_bad_request(self):
+        self.assertEqual(self.post(concurrency=0).status_code, 400)
+
+    def events(self, response):
+        return [json.loads(line) for line in response.content_bytes.decode().splitlines()]
+
+    def test_ndjson_stream_has_one_line_per_tile(self):
+        async def compute(x, y, z):
+            if (x, y) == (4786, 3375):
+                await asyncio.sleep(5)
+            return np.zeros((256, 256), dtype=np.float32)
+
+        self.compute = compute
+        response = self.post(stream="ndjson", tile_timeout=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(response["X-Accel-Buffering"], "no")
+        events = self.events(response)
+        self.assertEqual([event["event"] for event in events], ["start", "tile", "tile", "tile", "failure", "done"])
+        self.assertEqual(events[0]["total"], 4)
+        # The slow tile fails last, after the others have been sent
+        self.assertEqual(events[4]["tile"], "4786_3375_13")
+        self.assertEqual((events[-1]["tiles_generated"], events[-1]["tiles_failed"]), (3, 1))
+        self.assertTrue(events[-1]["map_url"].endswith(".html"))
+        self.assertNotIn("map_path", events[-1])
+
+    def test_sse_stream_names_every_event(self):
+        response = self.post(stream="sse")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        messages = response.content_bytes.decode().split("\n\n")
+        self.assertEqual(messages.pop(), "")
+        names = []
+        for message in messages:
+            event_line, data_line = message.split("\n")
+            names.append(event_line.removeprefix("event: "))
+            data = json.loads(data_line.removeprefix("data: "))
+            self.assertNotIn("event", data)
+        self.assertEqual(names, ["start", "tile", "tile", "tile", "tile", "done"])
+
+    def test_stream_reports_errors_in_band(self):
+        from . import utils
+
+        with mock.patch.object(utils, "build_map", side_effect=OSError("disk full")):
+            response = self.post(stream="ndjson")
+        self.assertEqual(response.status_code, 200)
+        events = self.events(response)
+        self.assertEqual([event["event"] for event in events], ["start", "tile", "tile", "tile", "tile", "error"])
+        self.assertEqual(events[-1]["error"], "Failed to generate tiles and map: disk full")
+
+
+class OverviewTests(TilePipelineTestCase):
+    # Just inside zoom 12 tile 2392/1687, so its four zoom 13 children cover the bbox
+    bbox = dict(min_lon=30.2344, min_lat=30.1452, max_lon=30.3222, max_lat=30.2210)
+
+    def test_downsample_averages_each_block_ignoring_nan(self):
+        import mercantile
+
+        children = {
+            mercantile.Tile(x, y, 1): np.full((4, 4), value, dtype=np.float32)
+            for (x, y), value in {(0, 0): 0.0, (1, 0): 0.2, (0, 1): 0.4, (1, 1): np.nan}.items()
+        }
+        children[mercantile.Tile(0, 0, 1)][0, :2] = [1.0, np.nan]
+        values = downsample_values(children)
+        self.assertEqual(values.shape, (4, 4))
+        # Top-left child lands in the top-left quadrant, bottom-right (all NaN) stays NaN
+        self.assertAlmostEqual(float(values[0, 0]), 1.0 / 3)
+        self.assertAlmostEqual(float(values[1, 1]), 0.0)
+        self.assertAlmostEqual(float(values[0, 3]), 0.2)
+        self.assertAlmostEqual(float(values[3, 0]), 0.4)
+        self.assertTrue(np.isnan(values[3, 3]))
+
+    def test_parents_are_derived_from_cached_children(self):
+        from . import utils
+
+        async def compute(x, y, z):
+            await asyncio.sleep(0.05)
+            return np.full((256, 256), (x % 2) * 0.5 + (y % 2) * 0.25, dtype=np.float32)
+
+        self.compute = compute
+        results, failures, _, _ = self.generate(min_zoom=12)
+        self.assertEqual((len(results), failures), (5, []))
+        # Only the zoom 13 tiles went upstream
+        self.assertEqual(sorted(self.computed), [(4784, 3374, 13), (4784, 3375, 13), (4785, 3374, 13), (4785, 3375, 13)])
+        values, _ = async_to_sync(utils.tile_values)(TileCache(), 2392, 1687, 12, **TILE_PARAMS)
+        self.assertAlmostEqual(float(values[0, 0]), 0.0)
+        self.assertAlmostEqual(float(values[0, 255]), 0.5)
+        self.assertAlmostEqual(float(values[255, 0]), 0.25)
+        self.assertAlmostEqual(float(values[255, 255]), 0.75)
+
+    def test_parents_with_missing_children_go_upstream(self):
+        results, failures, _, _ = self.generate(
+            min_lon=30.30, max_lon=30.34, min_zoom=12,
+        )
+        self.assertEqual(failures, [])
+        # 4786 lies in the next zoom 12 tile, whose other children were never rendered
+        self.assertIn((2393, 1687, 12), self.computed)
+
+
+class FarmAreaClipTests(TilePipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner, profile = make_user("owner")
+        self.other, _ = make_user("other")
+        # A triangle whose bbox spans 8 zoom 14 tiles, one of them wholly outside it
+        self.farm_area = FarmArea.objects.create(
+            name="farm", user=profile, area_coordinates=[[30.35, 30.2], [30.37, 30.2], [30.35, 30.26]]
+        )
+        self.polygon = farm_area_polygon(self.farm_area.area_coordinates)
+
+    def test_only_tiles_intersecting_the_farm_are_rendered(self):
+        import mercantile
+
+        results, failures, _, _ = self.generate(farm_area_id=self.farm_area.pk, user_id=self.owner.pk, zoom_level=14)
+        self.assertEqual((len(results), failures), (7, []))
+        rectangle = set(mercantile.tiles(*self.polygon.bounds, zooms=14))
+        self.assertEqual(len(rectangle), 8)
+        self.assertEqual({(x, y) for x, y, _ in self.computed}, {(tile.x, tile.y) for tile in tiles_in_polygon(self.polygon, 14)})
+
+    def test_pixels_outside_the_farm_are_transparent(self):
+        import mercantile
+        from shapely.geometry import Point
+
+        from .utils import BASE_DIR
+
+        results, _, _, _ = self.generate(
+            farm_area_id=self.farm_area.pk, user_id=self.owner.pk, zoom_level=14, mask_outside=True, vmin=0, vmax=1,
+        )
+        boundary = self.polygon.boundary
+        checked = {True: 0, False: 0}
+        for result in results:
+            with Image.open(os.path.join(BASE_DIR, result["file_path"])) as image:
+                alpha = np.asarray(image.convert("RGBA"))[:, :, 3]
+            left, bottom, right, top = mercantile.xy_bounds(result["x"], result["y"], result["z"])
+            for row in range(8, 256, 16):
+                for col in range(8, 256, 16):
+                    point = Point(mercantile.lnglat(
+                        left + (col + 0.5) / 256 * (right - left), top - (row + 0.5) / 256 * (top - bottom)
+                    ))
+                    if boundary.distance(point) < 1e-4:
+                        continue
+                    inside = self.polygon.contains(point)
+                    self.assertEqual(alpha[row, col], 255 if inside else 0)
+                    checked[inside] += 1
+        self.assertTrue(checked[True] and checked[False])
+
+    def test_another_users_farm_area_is_not_found(self):
+        with self.assertRaisesMessage(ValueError, f"Farm area {self.farm_area.pk} not found"):
+            self.generate(farm_area_id=self.farm_area.pk, user_id=self.other.pk)
+        self.assertEqual(self.computed, [])
+
+
+class SingleFlightTests(TilePipelineTestCase):
+    def test_concurrent_identical_requests_compute_each_tile_once(self):
+        from . import utils
+
+        async def compute(x, y, z):
+            await asyncio.sleep(0.05)
+            return np.zeros((256, 256), dtype=np.float32)
+
+        self.compute = compute
+        options = dict(self.bbox, zoom_level=13, make_map=False, **TILE_PARAMS)
+
+        async def burst():
+            return await asyncio.gather(*[utils.generate_tiles_and_map(**options) for _ in range(3)])
+
+        runs = async_to_sync(burst)()
+        for results, failures, _, _ in runs:
+            self.assertEqual((len(results), failures), (4, []))
+        self.assertEqual(len(self.computed), 4)
+        self.assertEqual(len(set(self.computed)), 4)
+        self.assertEqual(utils.tile_flight.in_flight(), 0)
+
+    def test_a_cancelled_waiter_does_not_cancel_the_others(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def scenario():
+            first = asyncio.ensure_future(flight.do("key", work))
+            second = asyncio.ensure_future(flight.do("key", work))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(async_to_sync(scenario)(), "done")
+        self.assertEqual(len(calls), 1)
+
+    def test_errors_reach_every_waiter_and_free_the_key(self):
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream down")
+
+        async def scenario():
+            return await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+
+        errors = async_to_sync(scenario)()
+        self.assertEqual([str(error) for error in errors], ["upstream down", "upstream down"])
+        self.assertEqual(flight.in_flight(), 0)
+
+
+class TileEncodingPipelineTests(TilePipelineTestCase):
+    def test_tiles_are_encoded_without_decoding_any_image(self):
+        from .utils import BASE_DIR
+
+        with mock.patch.object(Image, "open", side_effect=AssertionError("tile decoded")):
+            results, failures, _, _ = self.generate(image_format="webp")
+        self.assertEqual((len(results), failures), (4, []))
+        for result in results:
+            self.assertTrue(result["file_path"].endswith(".webp"))
+            with open(os.path.join(BASE_DIR, result["file_path"]), "rb") as f:
+                self.assertEqual(f.read(12)[8:], b"WEBP")
+        # Another encoding of the same tiles recolors the cached values
+        results, _, _, _ = self.generate(image_format="palette")
+        self.assertTrue(results[0]["file_path"].endswith(".png"))
+        self.assertEqual(len(self.computed), 4)
+
+
+class StacCacheTests(TilePipelineTestCase):
+    bbox_args = ((30.3, 30.17, 30.34, 30.2), "2025-01-01", "2025-03-01", 30)
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = override_settings(STAC_CACHE_DIR=os.path.join(self.tmp.name, "stac_cache"))
+        cache_dir.enable()
+        self.addCleanup(cache_dir.disable)
+        self.searches = []
+        patcher = mock.patch.object(stac, "search_scenes", self.search_scenes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search_scenes(self, bbox, start_date, end_date, cloud_cover):
+        self.searches.append(tuple(bbox))
+        return [{"id": f"S2A_{len(self.searches)}"}]
+
+    async def compute_tile_values(self, x, y, z, *args, find_scenes=None, **kwargs):
+        features = await find_scenes()
+        values, _ = await super().compute_tile_values(x, y, z, *args, **kwargs)
+        return values, {"scene": features[0]["id"]}
+
+    def test_results_are_reused_within_the_ttl(self):
+        features = stac.cached_search_scenes(*self.bbox_args)
+        self.assertEqual(stac.cached_search_scenes(*self.bbox_args), features)
+        self.assertEqual(len(self.searches), 1)
+        path = os.path.join(self.tmp.name, "stac_cache", f"{stac.search_cache_key(*self.bbox_args)}.json")
+        os.utime(path, (time.time() - 2 * stac.DEFAULT_STAC_CACHE_TTL,) * 2)
+        self.assertEqual(stac.cached_search_scenes(*self.bbox_args), [{"id": "S2A_2"}])
+        self.assertEqual(len(self.searches), 2)
+
+    def test_key_ignores_float_noise_but_not_the_window(self):
+        bbox, start_date, end_date, cloud_cover = self.bbox_args
+        key = stac.search_cache_key(*self.bbox_args)
+        self.assertEqual(key, stac.search_cache_key([value + 1e-9 for value in bbox], start_date, end_date, "30"))
+        self.assertNotEqual(key, stac.search_cache_key(bbox, start_date, "2025-04-01", cloud_cover))
+        self.assertNotEqual(key, stac.search_cache_key(bbox, start_date, end_date, 10))
+
+    def test_a_half_written_entry_is_searched_again(self):
+        path = os.path.join(self.tmp.name, "stac_cache", f"{stac.search_cache_key(*self.bbox_args)}.json")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("[{")
+        self.assertEqual(stac.cached_search_scenes(*self.bbox_args), [{"id": "S2A_1"}])
+
+    def test_every_tile_shares_one_search(self):
+        results, failures, _, _ = self.generate()
+        self.assertEqual((len(results), failures), (4, []))
+        self.assertEqual(self.searches, [(30.30, 30.17, 30.34, 30.20)])
+        # Another index over the same window computes every tile again from the stored search
+        self.generate(formula="band2/band1")
+        self.assertEqual(len(self.computed), 8)
+        self.assertEqual(len(self.searches), 1)
+
+    def test_time_series_discovery_goes_through_the_cache(self):
+        import vcube.engine
+
+        stac.install_vcube_search_cache()
+        self.assertEqual(vcube.engine.search_stac_api(*self.bbox_args), [{"id": "S2A_1"}])
+        self.assertEqual(vcube.engine.search_stac_api(*self.bbox_args), [{"id": "S2A_1"}])
+        self.assertEqual(len(self.searches), 1)
+
+
+class PrewarmCommandTests(TilePipelineMixin, TransactionTestCase):
+    # The command runs each farm in asyncio.run, whose queries use another
+    # connection that would not see a TestCase's uncommitted farm areas
+    def setUp(self):
+        super().setUp()
+        _, profile = make_user("owner")
+        self.farms = [
+            FarmArea.objects.create(name=name, user=profile, area_coordinates=coordinates)
+            for name, coordinates in (
+                ("north", FARM_COORDINATES),
+                ("south", [[30.17, 30.30], [30.20, 30.30], [30.20, 30.34], [30.17, 30.34]]),
+            )
+        ]
+        self.state_file = os.path.join(self.tmp.name, "prewarm_state.json")
+
+    def prewarm(self, *args):
+        from django.core.management import call_command
+
+        out, err = StringIO(), StringIO()
+        call_command("prewarm_tiles", "--zoom", "13", "--state-file", self.state_file, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def farm_tiles(self, farm):
+        return {(tile.x, tile.y, tile.z) for tile in tiles_in_polygon(farm_area_polygon(farm.area_coordinates), 13)}
+
+    def test_every_farm_is_rendered_once(self):
+        out, _ = self.prewarm()
+        self.assertIn("Prewarmed 2 farm area(s), 0 failed", out)
+        self.assertEqual(set(self.computed), self.farm_tiles(self.farms[0]) | self.farm_tiles(self.farms[1]))
+        computed = len(self.computed)
+        out, _ = self.prewarm()
+        self.assertIn("Prewarming 0 farm area(s)", out)
+        self.assertEqual(len(self.computed), computed)
+
+    def test_user_requests_for_the_window_hit_the_cache(self):
+        self.prewarm("--days", "10")
+        computed = len(self.computed)
+        end_date = datetime.date.today()
+        results, _, _, _ = self.generate(
+            farm_area_id=self.farms[1].pk, start_date=(end_date - datetime.timedelta(days=10)).isoformat(),
+            end_date=end_date.isoformat(),
+        )
+        self.assertTrue(all(result["cached"] for result in results))
+        self.assertEqual(len(self.computed), computed)
+
+    def test_failed_farms_are_retried_on_the_next_run(self):
+        # Only the tiles the northern farm does not share
+        south = self.farm_tiles(self.farms[1]) - self.farm_tiles(self.farms[0])
+
+        async def compute(x, y, z):
+            if (x, y, z) in south:
+                raise RuntimeError("upstream down")
+            return np.zeros((256, 256), dtype=np.float32)
+
+        self.compute = compute
+        out, _ = self.prewarm()
+        self.assertIn("Prewarmed 1 farm area(s), 1 failed", out)
+        with open(self.state_file) as f:
+            state = json.load(f)
+        self.assertEqual(state["done"], [self.farms[0].pk])
+        self.assertIn(str(self.farms[1].pk), state["failed"])
+
+        del self.compute
+        self.computed.clear()
+        out, _ = self.prewarm()
+        self.assertIn("Prewarming 1 farm area(s)", out)
+        self.assertEqual(set(self.computed), south)
+
+    def test_other_parameters_start_over(self):
+        self.prewarm()
+        out, _ = self.prewarm("--params", '{"band1": "green"}')
+        self.assertIn("Prewarming 2 farm area(s) for", out)
+        out, _ = self.prewarm("--params", '{"band1": "green"}', "--restart")
+        self.assertIn("(0 already done)", out)
+
+
+class MetricsTests(TilePipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(metrics, "registry", metrics.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stages_reach_the_request_and_the_registry(self):
+        def in_thread():
+            with metrics.stage("read"):
+                metrics.count("tile_cache_miss")
+
+        async def work():
+            await asyncio.to_thread(in_thread)
+
+        with metrics.collect() as collected:
+            async_to_sync(work)()
+        # Outside any request only the registry sees it
+        with metrics.stage("read"):
+            pass
+        timings = collected.as_dict()
+        self.assertEqual(timings["stages"]["read"]["count"], 1)
+        self.assertEqual(timings["counters"], {"tile_cache_miss": 1})
+        self.assertEqual(self.registry.histograms["read"]["count"], 2)
+
+    def test_prometheus_buckets_are_cumulative(self):
+        for seconds in (0.001, 0.02, 0.02, 60):
+            self.registry.observe("encode", seconds)
+        self.registry.count("tile_failure", 3)
+        text = self.registry.render_prometheus()
+        self.assertIn('agrisens_tile_stage_seconds_bucket{stage="encode",le="0.005"} 1', text)
+        self.assertIn('agrisens_tile_stage_seconds_bucket{stage="encode",le="0.025"} 3', text)
+        self.assertIn('agrisens_tile_stage_seconds_bucket{stage="encode",le="30"} 3', text)
+        self.assertIn('agrisens_tile_stage_seconds_bucket{stage="encode",le="+Inf"} 4', text)
+        self.assertIn('agrisens_tile_stage_seconds_count{stage="encode"} 4', text)
+        self.assertIn('agrisens_tile_events_total{event="tile_failure"} 3', text)
+
+    def test_pipeline_stages_and_counters(self):
+        async def compute(x, y, z):
+            if (x, y) == (4786, 3375):
+                raise RuntimeError("upstream down")
+            return np.zeros((256, 256), dtype=np.float32)
+
+        self.compute = compute
+        with metrics.collect() as first:
+            self.generate(make_map=True)
+        with metrics.collect() as second:
+            self.generate()
+        first, second = first.as_dict(), second.as_dict()
+        self.assertEqual(first["counters"], {"tile_cache_miss": 4, "values_cache_miss": 4, "tile_failure": 1})
+        self.assertEqual(second["counters"], {"tile_cache_hit": 3, "tile_cache_miss": 1, "values_cache_miss": 1, "tile_failure": 1})
+        self.assertEqual({stage: entry["count"] for stage, entry in first["stages"].items()}, {"encode": 6, "write": 6, "map": 1})
+        self.assertEqual(self.registry.counters["tile_failure"], 2)
+
+    def test_metrics_endpoint_serves_the_registry(self):
+        self.registry.count("tile_cache_hit")
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('agrisens_tile_events_total{event="tile_cache_hit"} 1', response.content.decode())
+
+
+class ArchiveGenerationTests(TilePipelineTestCase):
+    def test_tiles_are_packed_into_the_archive(self):
+        archive_id = "cd" * 16
+        results, failures, _, _ = self.generate(archive_id=archive_id)
+        self.assertEqual((len(results), failures), (4, []))
+        self.assertEqual(results[0]["url"], f"/api/tiles/archives/{archive_id}/13/4785/3374.png")
+        with MBTilesArchive(os.path.join(self.tmp.name, "archives", f"{archive_id}.mbtiles"), readonly=True) as archive:
+            self.assertEqual(archive.get_metadata("format"), "png")
+            self.assertTrue(archive.get(13, 4786, 3375).startswith(b"\x89PNG"))
+        # Only the index values are cached, no loose PNGs
+        cached = [name for _, _, files in os.walk(os.path.join(self.tmp.name, "tiles")) for name in files]
+        self.assertFalse([name for name in cached if name.endswith(".png")])
+
+
+class BenchTilesCommandTests(TestCase):
+    def bench(self, *args):
+        from django.core.management import call_command
+
+        out, err = StringIO(), StringIO()
+        call_command("bench_tiles", *args, stdout=out, stderr=err)
+        return json.loads(out.getvalue()), err.getvalue()
+
+    def test_report_covers_every_configuration(self):
+        import mercantile
+        from . import utils
+        from .management.commands.bench_tiles import CENTER
+
+        compute_tile_values = utils.compute_tile_values
+        with tempfile.TemporaryDirectory() as root:
+            output = os.path.join(root, "report.json")
+            report, _ = self.bench(
+                "--bbox-sizes", "0.02", "--zooms", "12,13", "--concurrency", "1,4", "--latency", "0.01",
+                "--tile-size", "32", "--output", output,
+            )
+            with open(output) as f:
+                self.assertEqual(f.read(), json.dumps(report, indent=2))
+        self.assertIs(utils.compute_tile_values, compute_tile_values)
+        self.assertEqual([(run["zoom"], run["concurrency"]) for run in report["runs"]], [(12, 1), (12, 4), (13, 1), (13, 4)])
+        bbox = (CENTER[0] - 0.01, CENTER[1] - 0.01, CENTER[0] + 0.01, CENTER[1] + 0.01)
+        for run in report["runs"]:
+            self.assertEqual(run["tiles"], len(list(mercantile.tiles(*bbox, zooms=run["zoom"]))))
+            self.assertEqual(run["failures"], 0)
+            # Every run starts cold, so each tile waits for the stand-in
+            self.assertGreaterEqual(run["latency_p50"], 0.01)
+            self.assertLessEqual(run["latency_p50"], run["latency_p99"])
+            self.assertGreater(run["output_bytes"], 0)
+            self.assertGreater(run["peak_rss_bytes"], 0)
+            self.assertTrue(run["map_built"])
+            self.assertIn("encode", run["stages"])
+
+    def test_large_configurations_are_skipped(self):
+        report, err = self.bench("--bbox-sizes", "0.2", "--zooms", "14", "--concurrency", "4", "--max-tiles", "10")
+        self.assertEqual(report["runs"], [])
+        self.assertIn("Skipping bbox 0.2 at zoom 14", err)
+
+    def test_stand_in_tiles_are_deterministic(self):
+        from .management.commands.bench_tiles import stub_compute_tile_values
+
+        compute = stub_compute_tile_values(0, 16)
+        args = ("2025-01-01", "2025-03-01", 30, "red", "nir", "(band2-band1)/(band2+band1)")
+        first, meta = async_to_sync(compute)(4785, 3372, 13, *args)
+        second, _ = async_to_sync(compute)(4785, 3372, 13, *args)
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(first.shape, (16, 16))
+        self.assertEqual(meta["scene"], "bench_13_4785_3372")
+
+
+class FairSharesTests(TestCase):
+    def test_shares_follow_weights(self):
+        self.assertEqual(fair_shares({"a": (1, 8), "b": (3, 8)}, 8), {"a": 2, "b": 6})
+
+    def test_capped_leases_leave_slots_to_others(self):
+        self.assertEqual(fair_shares({"a": (1, 1), "b": (1, 8)}, 8), {"a": 1, "b": 7})
+
+    def test_every_lease_gets_a_slot_within_budget(self):
+        shares = fair_shares({"a": (10, 10), "b": (1, 5), "c": (1, 5)}, 4)
+        self.assertEqual(shares, {"a": 2, "b": 1, "c": 1})
+
+    def test_extra_leases_queue_behind_older_ones(self):
+        shares = fair_shares({"a": (1, 4), "b": (5, 4), "c": (1, 4)}, 2)
+        self.assertEqual(shares, {"a": 1, "b": 1, "c": 0})
+        self.assertLessEqual(sum(shares.values()), 2)
+
+
+class CPUBudgetTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.budget = CPUBudget(path=os.path.join(self.tmp.name, "budget.sqlite3"), budget=2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_slots_stay_within_fair_share(self):
+        with self.budget.lease("a", demand=2):
+            self.assertTrue(self.budget.try_acquire("a"))
+            with self.budget.lease("b", demand=2):
+                # a already holds the one slot it may keep now that b is here
+                self.assertFalse(self.budget.may_acquire("a"))
+                self.assertFalse(self.budget.try_acquire("a"))
+                self.assertTrue(self.budget.try_acquire("b"))
+                with self.budget.lease("c"):
+                    # No slot left for a third job until one finishes
+                    self.assertFalse(self.budget.may_acquire("c"))
+                    self.assertFalse(self.budget.try_acquire("c"))
+
+    def test_leases_of_dead_processes_free_their_slots_while_polling(self):
+        dead = subprocess.Popen([sys.executable, "-c", ""])
+        dead.wait()
+        with self.budget.lease("a", demand=2):
+            with self.budget._transaction() as conn:
+                # A worker that died holding both slots, without a later open() to clean up
+                conn.execute(
+                    "INSERT INTO leases (lease_id, host, pid, weight, demand, in_use, acquired_at)"
+                    " VALUES ('dead', ?, ?, 1, 2, 2, 0)",
+                    (socket.gethostname(), dead.pid),
+                )
+            self.assertTrue(self.budget.may_acquire("a"))
+            self.assertTrue(self.budget.try_acquire("a"))
+            self.assertTrue(self.budget.try_acquire("a"))
+            with self.budget._transaction() as conn:
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM leases WHERE lease_id = 'dead'").fetchone()[0], 0)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manifest = override_settings(ARTIFACT_MANIFEST=os.path.join(self.tmp.name, "artifacts.sqlite3"))
+        self.manifest.enable()
+        self.maps = os.path.join(self.tmp.name, "maps")
+        os.makedirs(self.maps)
+
+    def tearDown(self):
+        self.manifest.disable()
+        self.tmp.cleanup()
+
+    def map_file(self, name):
+        path = os.path.join(self.maps, name)
+        with open(path, "w") as f:
+            f.write("<html></html>")
+        return path
+
+    def test_maps_policy_keeps_unrecorded_files(self):
+        committed = self.map_file("satellite_map_30_30_20250411_024733.html")
+        generated = self.map_file("satellite_map_30_30_20260101_000000.html")
+        record_artifact("maps", generated)
+        policy = dict(default_policies()["maps"], path=self.maps)
+        summary = sweep_category("maps", policy, now=time.time() + policy["max_age"] + 1)
+        self.assertEqual(summary["removed"], 1)
+        self.assertTrue(os.path.exists(committed))
+        self.assertFalse(os.path.exists(generated))
+
+    def test_other_policies_adopt_unknown_files(self):
+        path = self.map_file("output")
+        summary = sweep_category("outputs", {"path": self.maps, "max_bytes": None, "max_age": 60}, now=time.time() + 120)
+        self.assertEqual(summary["removed"], 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_files_are_removed_after_the_manifest_commit(self):
+        from . import retention
+
+        path = self.map_file("output")
+        record_artifact("outputs", path)
+        manifest = sqlite3.connect(os.path.join(self.tmp.name, "artifacts.sqlite3"))
+        self.addCleanup(manifest.close)
+        rows_at_removal = []
+
+        def remove(victim):
+            # A separate connection only sees committed rows
+            rows_at_removal.append(manifest.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0])
+            os.remove(victim)
+
+        with mock.patch.object(retention, "_remove", remove):
+            summary = sweep_category("outputs", {"path": self.maps, "max_age": 60}, now=time.time() + 120)
+        self.assertEqual(summary["removed"], 1)
+        self.assertEqual(rows_at_removal, [0])
+        self.assertFalse(os.path.exists(path))
+
+    def test_vanished_files_are_forgotten(self):
+        path = self.map_file("output")
+        record_artifact("outputs", path)
+        os.remove(path)
+        summary = sweep_category("outputs", {"path": self.maps, "max_age": 60})
+        self.assertEqual((summary["removed"], summary["artifacts"]), (0, 0))
+
+
+class JobQueueTests(TestCase):
+    def test_claims_oldest_job_once(self):
+        first = enqueue(Job.KIND_TIME_SERIES, {})
+        second = enqueue(Job.KIND_TILES, {})
+        claimed = claim_next_job("host:1")
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(claimed.status, Job.STATUS_RUNNING)
+        self.assertEqual(claimed.worker, "host:1")
+        self.assertIsNotNone(claimed.started_at)
+        # A running job is never handed to a second worker
+        self.assertEqual(claim_next_job("host:2").pk, second.pk)
+        self.assertIsNone(claim_next_job("host:3"))
+
+    def test_lost_race_moves_on_to_the_next_job(self):
+        first = enqueue(Job.KIND_TIME_SERIES, {})
+        second = enqueue(Job.KIND_TIME_SERIES, {})
+        real_now = timezone.now
+        calls = []
+
+        def now():
+            if not calls:
+                # Another worker claims the oldest job between our SELECT and UPDATE
+                Job.objects.filter(pk=first.pk).update(status=Job.STATUS_RUNNING, worker="host:1")
+            calls.append(None)
+            return real_now()
+
+        with mock.patch("api.jobs.timezone.now", now):
+            self.assertEqual(claim_next_job("host:2").pk, second.pk)
+        self.assertEqual(Job.objects.get(pk=first.pk).worker, "host:1")
+
+    def test_requeues_jobs_of_dead_workers_on_this_host(self):
+        dead = subprocess.Popen([sys.executable, "-c", ""])
+        dead.wait()
+        host = socket.gethostname()
+        orphaned = Job.objects.create(
+            kind=Job.KIND_TIME_SERIES, params={}, status=Job.STATUS_RUNNING, worker=f"{host}:{dead.pid}",
+            progress_done=3, phase="processing_scenes",
+        )
+        alive = Job.objects.create(
+            kind=Job.KIND_TIME_SERIES, params={}, status=Job.STATUS_RUNNING, worker=f"{host}:{os.getpid()}",
+        )
+        remote = Job.objects.create(
+            kind=Job.KIND_TIME_SERIES, params={}, status=Job.STATUS_RUNNING, worker=f"not-{host}:{dead.pid}",
+        )
+        self.assertEqual(requeue_orphaned_jobs(), 1)
+        orphaned.refresh_from_db()
+        self.assertEqual(orphaned.status, Job.STATUS_QUEUED)
+        self.assertIsNone(orphaned.worker)
+        self.assertEqual((orphaned.progress_done, orphaned.phase), (0, None))
+        self.assertEqual(Job.objects.get(pk=alive.pk).status, Job.STATUS_RUNNING)
+        self.assertEqual(Job.objects.get(pk=remote.pk).status, Job.STATUS_RUNNING)
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_gives_up_on_jobs_that_keep_killing_their_worker(self):
+        job = enqueue(Job.KIND_TIME_SERIES, {})
+        host = socket.gethostname()
+        for attempt in (1, 2):
+            dead = subprocess.Popen([sys.executable, "-c", ""])
+            dead.wait()
+            self.assertEqual(claim_next_job(f"{host}:{dead.pid}").attempts, attempt)
+            requeue_orphaned_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn("2 attempts", job.error)
+        self.assertIsNone(claim_next_job(f"{host}:1"))
+
+
+class TimeSeriesCacheTests(TestCase):
+    payload = dict(
+        min_lon=30.3, min_lat=30.1, max_lon=30.4, max_lat=30.2, cloud_cover=30, band1="red", band2="nir",
+        formula="(band2-band1)/(band2+band1)", operation="median", start_date="2025-01-01", end_date="2025-02-01",
+        timeseries=True, workers=2, priority=1,
+    )
+
+    def test_key_ignores_scheduling_options(self):
+        key = time_series.time_series_cache_key(self.payload)
+        self.assertEqual(key, time_series.time_series_cache_key(dict(self.payload, workers=8, priority=5)))
+
+    def test_key_depends_on_window_and_outputs(self):
+        key = time_series.time_series_cache_key(self.payload)
+        self.assertEqual(key, time_series.time_series_cache_key(dict(self.payload, start_date=datetime.date(2025, 1, 1))))
+        self.assertNotEqual(key, time_series.time_series_cache_key(dict(self.payload, end_date="2025-03-01")))
+        self.assertNotEqual(key, time_series.time_series_cache_key(dict(self.payload, timeseries=False)))
+        self.assertNotEqual(key, time_series.time_series_cache_key(dict(self.payload, incremental=True)))
+
+    def job(self, end_date, finished_at):
+        return Job(kind=Job.KIND_TIME_SERIES, params={"end_date": end_date}, finished_at=finished_at)
+
+    def test_results_of_closed_windows_stay_fresh(self):
+        finished_at = timezone.make_aware(datetime.datetime(2025, 2, 3))
+        job = self.job("2025-02-01", finished_at)
+        self.assertTrue(time_series._result_is_fresh(job, now=finished_at + datetime.timedelta(days=365)))
+
+    @override_settings(TIME_SERIES_OPEN_WINDOW_TTL=3600)
+    def test_results_of_open_windows_expire(self):
+        finished_at = timezone.make_aware(datetime.datetime(2025, 1, 20))
+        job = self.job("2025-02-01", finished_at)
+        self.assertTrue(time_series._result_is_fresh(job, now=finished_at + datetime.timedelta(minutes=30)))
+        self.assertFalse(time_series._result_is_fresh(job, now=finished_at + datetime.timedelta(hours=2)))
+
+
+class IncrementalTimeSeriesTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.media = override_settings(
+            MEDIA_ROOT=self.tmp.name, ARTIFACT_MANIFEST=os.path.join(self.tmp.name, "artifacts.sqlite3"),
+            CPU_BUDGET_DB=os.path.join(self.tmp.name, "cpu_budget.sqlite3"),
+            STAC_CACHE_DIR=os.path.join(self.tmp.name, "stac_cache"),
+        )
+        self.media.enable()
+
+    def tearDown(self):
+        self.media.disable()
+        self.tmp.cleanup()
+
+    def frame(self, scene):
+        path = os.path.join(self.tmp.name, "virtughan_series", "series", f"{scene}.png")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"png")
+        return path
+
+    def point(self, date, value, frame=None):
+        return {"date": date, "value": value, "frame": frame}
+
+    def test_new_points_are_merged_with_stored_ones(self):
+        time_series._save_points("series", {
+            "A": self.point("2025-01-05", 0.1, self.frame("A")),
+            "B": self.point("2025-01-15", 0.2, self.frame("B")),
+        })
+        # A later run recomputes B and adds C; A stays as it was
+        time_series._save_points("series", {
+            "B": self.point("2025-01-15", 0.25, self.frame("B")),
+            "C": self.point("2025-01-25", None),
+        })
+        points = {point.scene: point for point in time_series._stored_points("series", need_frames=True)}
+        self.assertEqual(sorted(points), ["A", "B", "C"])
+        self.assertEqual(points["A"].value, 0.1)
+        self.assertEqual(points["B"].value, 0.25)
+        self.assertEqual(points["B"].frame, "virtughan_series/series/B.png")
+        self.assertIsNone(points["C"].value)
+        self.assertEqual(TimeSeriesPoint.objects.filter(series_key="series").count(), 3)
+
+    def test_points_are_kept_per_series(self):
+        time_series._save_points("series", {"A": self.point("2025-01-05", 0.1)})
+        time_series._save_points("other", {"A": self.point("2025-01-05", 0.9)})
+        self.assertEqual([point.value for point in time_series._stored_points("series", need_frames=False)], [0.1])
+
+    def test_points_with_swept_frames_are_computed_again(self):
+        time_series._save_points("series", {
+            "A": self.point("2025-01-05", 0.1, self.frame("A")),
+            "B": self.point("2025-01-15", 0.2, self.frame("B")),
+        })
+        os.remove(os.path.join(self.tmp.name, "virtughan_series", "series", "B.png"))
+        self.assertEqual([point.scene for point in time_series._stored_points("series", need_frames=True)], ["A"])
+        # Without a GIF the frames do not matter
+        self.assertEqual(len(time_series._stored_points("series", need_frames=False)), 2)
+
+    def test_series_key_ignores_the_date_window(self):
+        payload = dict(
+            min_lon=30.3, min_lat=30.1, max_lon=30.4, max_lat=30.2, cloud_cover=30, band1="red", band2="nir",
+            formula="(band2-band1)/(band2+band1)", operation="median", start_date="2025-01-01", end_date="2025-02-01",
+        )
+        key = time_series.time_series_series_key(payload)
+        self.assertEqual(key, time_series.time_series_series_key(dict(payload, end_date="2025-06-01")))
+        self.assertEqual(key, time_series.time_series_series_key(dict(payload, formula="(band2 - band1) / (band2 + band1)")))
+        self.assertNotEqual(key, time_series.time_series_series_key(dict(payload, operation="mean")))
+
+    def scene_catalog(self):
+        import rasterio
+        from rasterio.transform import from_bounds
+
+        bounds = (30.29, 30.09, 30.41, 30.21)
+        rng = np.random.default_rng(0)
+        # (date, cloud cover): smart filtering keeps 01-12 over 01-13 but 01-14 over 01-31
+        scenes = [("20250102", 10), ("20250107", 10), ("20250112", 20), ("20250114", 5), ("20250120", 10)]
+        features = []
+        for date, cloud_cover in scenes:
+            scene = f"S2A_36RUU_{date}_0_L2A"
+            assets = {}
+            for band in ("red", "nir"):
+                path = os.path.join(self.tmp.name, "scenes", scene, f"{band}.tif")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with rasterio.open(
+                    path, "w", driver="GTiff", width=24, height=24, count=1, dtype="uint16",
+                    crs="EPSG:4326", transform=from_bounds(*bounds, 24, 24),
+                ) as dst:
+                    dst.write(rng.integers(1, 10000, (24, 24), dtype=np.uint16), 1)
+                assets[band] = {"href": path}
+            west, south, east, north = bounds
+            features.append({
+                "id": scene,
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+                },
+                "properties": {"datetime": f"{date[:4]}-{date[4:6]}-{date[6:]}T08:00:00Z", "eo:cloud_cover": cloud_cover},
+                "assets": assets,
+            })
+
+        def search_stac_api(bbox, start_date, end_date, cloud_cover):
+            window = [feature for feature in features if start_date <= feature["properties"]["datetime"][:10] <= end_date]
+            return sorted(window, key=lambda feature: feature["properties"]["datetime"], reverse=True)
+
+        return search_stac_api
+
+    def run_series(self, **params):
+        import uuid
+
+        import matplotlib.pyplot as plt
+
+        payload = dict(
+            min_lon=30.3, min_lat=30.1, max_lon=30.4, max_lat=30.2, cloud_cover=30, band1="red", band2="nir",
+            formula="(band2-band1)/(band2+band1)", operation="median", start_date="2025-01-01",
+            end_date="2025-01-31", timeseries=True, workers=2, priority=1, incremental=False,
+        )
+        payload.update(params)
+        # The values chart is where both modes report one value per scene
+        with mock.patch.object(plt, "plot", wraps=plt.plot) as full_chart, \
+                mock.patch.object(time_series, "render_values_chart", wraps=time_series.render_values_chart) as chart:
+            body = time_series.run_time_series(payload, uuid.uuid4())
+        dates, values = (chart if payload["incremental"] else full_chart).call_args_list[0][0][:2]
+        return body, list(dates), list(values)
+
+    @override_settings(CPU_BUDGET=2)
+    def test_incremental_run_matches_a_full_run(self):
+        import vcube.engine
+
+        with mock.patch.object(vcube.engine, "search_stac_api", self.scene_catalog()):
+            first, _, _ = self.run_series(incremental=True, end_date="2025-01-13")
+            extended, dates, values = self.run_series(incremental=True)
+            _, full_dates, full_values = self.run_series()
+        self.assertEqual((first["scenes_computed"], first["scenes_reused"]), (3, 0))
+        # Only the scenes acquired after the first window are computed
+        self.assertEqual((extended["scenes_computed"], extended["scenes_reused"]), (2, 2))
+        self.assertEqual(dates, ["20250102", "20250107", "20250114", "20250120"])
+        self.assertEqual(dates, list(full_dates))
+        np.testing.assert_allclose(values, full_values, rtol=1e-6)
+
+    def test_vcube_hooks_match_installed_virtughan(self):
+        try:
+            time_series._processor_class()
+        except ImportError:
+            self.skipTest("VirtuGhan not installed")
+
+
+class NoRequests(BaseThrottle):
+    def allow_request(self, request, view):
+        return False
+
+
+class AsyncViewAccessTests(TestCase):
+    def setUp(self):
+        self.owner, profile = make_user("owner")
+        self.other, _ = make_user("other")
+        self.farm_area = FarmArea.objects.create(name="farm", user=profile, area_coordinates=FARM_COORDINATES)
+        self.tile_url = f"/api/tiles/13/4786/3372.png?farm_area_id={self.farm_area.pk}&mask_outside=true"
+
+    def test_owned_farm_area(self):
+        self.assertEqual(owned_farm_area(self.owner, self.farm_area.pk), self.farm_area)
+        with self.assertRaises(NotFound):
+            owned_farm_area(self.other, self.farm_area.pk)
+        with self.assertRaises(NotAuthenticated):
+            owned_farm_area(None, self.farm_area.pk)
+
+    def test_farm_area_needs_its_owner(self):
+        self.assertEqual(self.client.get(self.tile_url).status_code, 401)
+        self.assertEqual(self.client.get(self.tile_url, **auth_header(self.other)).status_code, 404)
+        response = self.client.post(
+            "/api/generate-tiles/", {"farm_area_id": self.farm_area.pk}, content_type="application/json",
+            **auth_header(self.other),
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_token_is_rejected(self):
+        response = self.client.get("/api/tiles/13/4786/3372.png", HTTP_AUTHORIZATION="Bearer invalid")
+        self.assertEqual(response.status_code, 401)
+
+    def test_malformed_json_is_a_bad_request(self):
+        response = self.client.post("/api/generate-tiles/", "{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_throttles_apply(self):
+        with mock.patch.object(TileView, "throttle_classes", [NoRequests]):
+            self.assertEqual(self.client.get("/api/tiles/13/4786/3372.png").status_code, 429)
+
+
+class ZonalStatsTests(TestCase):
+    """farm_zonal_stats over local rasters: the west half of the farm has an NDVI of 0.5, the east half 0."""
+    split_lon = 30.36
+
+    def setUp(self):
+        import mercantile
+        import rasterio
+        from rasterio.transform import from_bounds
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.polygon = farm_area_polygon(FARM_COORDINATES)
+        west, south = mercantile.xy(30.34, 30.19)
+        east, north = mercantile.xy(30.38, 30.23)
+        split = round((mercantile.xy(self.split_lon, 30.21)[0] - west) / (east - west) * 400)
+        self.paths = {}
+        for name, west_value, east_value in (("red", 1000, 1000), ("nir", 3000, 1000), ("nir_west", 3000, 0)):
+            data = np.full((400, 400), east_value, dtype=np.uint16)
+            data[:, :split] = west_value
+            self.paths[name] = os.path.join(self.tmp.name, f"{name}.tif")
+            with rasterio.open(
+                self.paths[name], "w", driver="GTiff", width=400, height=400, count=1, dtype="uint16", nodata=0,
+                crs="EPSG:3857", transform=from_bounds(west, south, east, north, 400, 400),
+            ) as dst:
+                dst.write(data, 1)
+
+    def feature(self, scene, datetime_, nir, cloud_cover=5, bbox=(30.34, 30.19, 30.38, 30.23)):
+        from shapely.geometry import box, mapping
+
+        return {
+            "id": scene,
+            "geometry": mapping(box(*bbox)),
+            "properties": {"datetime": datetime_, "eo:cloud_cover": cloud_cover},
+            "assets": {"red": {"href": self.paths["red"]}, "nir": {"href": nir}},
+        }
+
+    def stats(self, features, **kwargs):
+        from . import zonal
+
+        with mock.patch.object(zonal, "cached_search_scenes", return_value=features):
+            return async_to_sync(zonal.farm_zonal_stats)(
+                self.polygon, "2025-01-01", "2025-03-01", 30, "red", "nir", "(band2-band1)/(band2+band1)", **kwargs
+            )
+
+    def test_zonal_statistics(self):
+        values = np.array([[0.0, 0.5, np.nan], [1.0, 0.25, 9.0]], dtype=np.float32)
+        mask = np.array([[True, True, True], [True, True, False]])
+        stats = zonal_statistics(values, mask, percentiles=(50,))
+        self.assertEqual(stats["valid_fraction"], 0.8)
+        self.assertEqual((stats["min"], stats["max"], stats["mean"], stats["median"]), (0.0, 1.0, 0.4375, 0.375))
+        self.assertEqual(stats["p50"], stats["median"])
+        self.assertEqual(zonal_statistics(np.full((2, 2), np.nan), np.ones((2, 2), dtype=bool)), {"valid_fraction": 0.0})
+
+    def test_polygon_is_rasterized_at_the_requested_resolution(self):
+        grid = polygon_grid(self.polygon)
+        # About 1.9 x 2.2 km of 10 m pixels, the farm being a rectangle that fills its grid
+        self.assertAlmostEqual(grid.resolution, 10, places=5)
+        self.assertEqual(grid.mask.shape, (grid.height, grid.width))
+        self.assertGreater(grid.mask.mean(), 0.95)
+        self.assertAlmostEqual(grid.width * grid.resolution / 1000, 1.92, places=1)
+
+    def test_statistics_per_date(self):
+        result = self.stats([
+            self.feature("S2A_20250210", "2025-02-10T08:00:00Z", self.paths["nir"]),
+            self.feature("S2A_20250120", "2025-01-20T08:00:00Z", self.paths["nir_west"]),
+        ])
+        self.assertEqual(result["failures"], [])
+        self.assertEqual(result["pixels"], int(polygon_grid(self.polygon).mask.sum()))
+        first, second = result["scenes"]
+        self.assertEqual((first["date"], first["scene"], first["cloud_cover"]), ("2025-01-20", "S2A_20250120", 5))
+        # Only the west half has data on 2025-01-20
+        self.assertAlmostEqual(first["valid_fraction"], 0.5, delta=0.02)
+        self.assertEqual((first["mean"], first["min"], first["max"]), (0.5, 0.5, 0.5))
+        self.assertEqual(second["valid_fraction"], 1.0)
+        self.assertAlmostEqual(second["mean"], 0.25, delta=0.01)
+        self.assertEqual((second["min"], second["p10"], second["p90"], second["max"]), (0.0, 0.0, 0.5, 0.5))
+
+    def test_one_scene_per_date_and_failures_reported(self):
+        result = self.stats([
+            # Covers only part of the farm
+            self.feature("S2A_partial", "2025-02-10T08:00:00Z", self.paths["nir"], bbox=(30.34, 30.19, 30.36, 30.23)),
+            self.feature("S2B_whole", "2025-02-10T08:10:00Z", self.paths["nir"], cloud_cover=20),
+            self.feature("S2A_missing", "2025-02-20T08:00:00Z", os.path.join(self.tmp.name, "missing.tif")),
+            # Does not touch the farm
+            self.feature("S2A_elsewhere", "2025-02-25T08:00:00Z", self.paths["nir"], bbox=(31, 31, 32, 32)),
+        ])
+        self.assertEqual([scene["scene"] for scene in result["scenes"]], ["S2B_whole"])
+        self.assertEqual([(failure["date"], failure["scene"]) for failure in result["failures"]], [("2025-02-20", "S2A_missing")])
+
+
+class FarmAreaStatsViewTests(TestCase):
+    def setUp(self):
+        self.owner, profile = make_user("owner")
+        self.other, _ = make_user("other")
+        self.farm_area = FarmArea.objects.create(name="farm", user=profile, area_coordinates=FARM_COORDINATES)
+        self.url = f"/api/farm-areas/{self.farm_area.pk}/stats/?start_date=2025-01-01&end_date=2025-02-01"
+
+    def test_stats_of_own_farm(self):
+        async def farm_zonal_stats(polygon, *args, **kwargs):
+            self.assertTrue(polygon.contains(polygon.centroid))
+            return {"pixels": 10, "resolution_m": 10.0, "scenes": [], "failures": []}
+
+        with mock.patch("api.views.farm_zonal_stats", farm_zonal_stats):
+            response = self.client.get(self.url, **auth_header(self.owner))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["farm_area_id"], self.farm_area.pk)
+            self.assertEqual(response.json()["pixels"], 10)
+            self.assertEqual(self.client.get(self.url, **auth_header(self.other)).status_code, 404)
+            self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class JobViewTests(TestCase):
+    def setUp(self):
+        self.owner, _ = make_user("owner")
+        self.other, _ = make_user("other")
+
+    def test_jobs_are_queued_for_their_owner(self):
+        self.assertEqual(self.client.post("/api/tile-jobs/", {}, content_type="application/json").status_code, 401)
+        response = self.client.post("/api/tile-jobs/", {}, content_type="application/json", **auth_header(self.owner))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Job.objects.get(pk=response.json()["job_id"]).user, self.owner)
+
+    def test_only_the_owner_sees_a_job(self):
+        job = enqueue(Job.KIND_TILES, {"zoom_level": 13}, user=self.owner)
+        url = f"/api/jobs/{job.id}/"
+        response = self.client.get(url, **auth_header(self.owner))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], Job.STATUS_QUEUED)
+        self.assertEqual(self.client.get(url, **auth_header(self.other)).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+
+class TimeSeriesViewTests(TestCase):
+    def setUp(self):
+        self.owner, _ = make_user("owner")
+        self.other, _ = make_user("other")
+
+    def post(self, user=None):
+        headers = auth_header(user) if user else {}
+        return self.client.post("/api/time_series/", {"end_date": "2025-02-01"}, content_type="application/json", **headers)
+
+    def test_requests_are_reused_per_user(self):
+        self.assertEqual(self.post().status_code, 401)
+        first = self.post(self.owner)
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(Job.objects.get(pk=first.json()["request_id"]).user, self.owner)
+        self.assertEqual(self.post(self.owner).json()["request_id"], first.json()["request_id"])
+        self.assertNotEqual(self.post(self.other).json()["request_id"], first.json()["request_id"])
+
+    def test_only_the_owner_sees_a_request(self):
+        request_id = self.post(self.owner).json()["request_id"]
+        Job.objects.filter(pk=request_id).update(
+            status=Job.STATUS_SUCCEEDED, result={"gif_file_path": "output.gif", "values_file_path": "values.png"}
+        )
+        for url in (f"/api/time_series/{request_id}/", f"/api/time_series/{request_id}/gif/"):
+            self.assertEqual(self.client.get(url).status_code, 401)
+            self.assertEqual(self.client.get(url, **auth_header(self.other)).status_code, 404)
+        self.assertEqual(self.client.get(f"/api/time_series/{request_id}/", **auth_header(self.owner)).status_code, 200)
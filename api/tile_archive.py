@@ -0,0 +1,117 @@
+import os
+import re
+import sqlite3
+import threading
+import uuid
+
+from django.conf import settings
+
+from .metrics import stage
+
+_ARCHIVE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def archive_dir():
+    return str(getattr(settings, 'TILE_ARCHIVE_DIR', os.path.join(settings.MEDIA_ROOT, 'tiles', 'archives')))
+
+
+def new_archive_id():
+    return uuid.uuid4().hex
+
+
+def archive_path(archive_id):
+    """Return the .mbtiles path for ``archive_id``, rejecting anything that is not an id."""
+    if not _ARCHIVE_ID_RE.match(archive_id):
+        raise ValueError(f"Invalid archive id: {archive_id}")
+    return os.path.join(archive_dir(), f'{archive_id}.mbtiles')
+
+
+class MBTilesArchive:
+    """
+    A tile set packed into one MBTiles 1.3 (SQLite) file.
+
+    Writes are buffered and inserted ``batch_size`` tiles per transaction,
+    which is far cheaper than one file per tile. Rows use the TMS scheme
+    required by the spec, so ``y`` is flipped on the way in and out.
+
+    Writers may call it from several threads (e.g. through asyncio.to_thread
+    so commits stay off the event loop); writes are serialized by a lock.
+    """
+
+    def __init__(self, path, readonly=False, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        if readonly:
+            self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS tiles ('
+            ' zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)'
+        )
+        self.conn.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)'
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _tms_row(z, y):
+        return (2 ** z - 1) - y
+
+    def set_metadata(self, **values):
+        with self._lock, self.conn:
+            self.conn.executemany('DELETE FROM metadata WHERE name = ?', [(name,) for name in values])
+            self.conn.executemany(
+                'INSERT INTO metadata (name, value) VALUES (?, ?)',
+                [(name, str(value)) for name, value in values.items()],
+            )
+
+    def get_metadata(self, name, default=None):
+        row = self.conn.execute('SELECT value FROM metadata WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else default
+
+    def put(self, z, x, y, data):
+        with self._lock:
+            self._pending.append((z, x, self._tms_row(z, y), sqlite3.Binary(data)))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    @stage('write')
+    def _flush(self):
+        if not self._pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)',
+                self._pending,
+            )
+        self._pending = []
+
+    def get(self, z, x, y):
+        row = self.conn.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+            (z, x, self._tms_row(z, y)),
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def close(self):
+        with self._lock:
+            if self.conn is None:
+                return
+            self._flush()
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,280 @@
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from django.conf import settings
+
+from .metrics import stage
+
+# TileGenerationSerializer fields that decide the index values of a tile
+VALUE_PARAM_KEYS = (
+    'start_date',
+    'end_date',
+    'cloud_cover',
+    'band1',
+    'band2',
+    'formula',
+)
+
+# Fields that change the pixels of a rendered tile: the values plus how they
+# are colored. The bbox, zoom and scheduling options only decide *which*
+# tiles are rendered.
+TILE_PARAM_KEYS = VALUE_PARAM_KEYS + (
+    'colormap_str',
+    'vmin',
+    'vmax',
+)
+
+# Seconds tiles of a date window that is still open are served before they
+# are computed again with newer scenes (TILE_OPEN_WINDOW_MAX_AGE overrides)
+DEFAULT_OPEN_WINDOW_MAX_AGE = 3600
+
+# Bumped whenever the stored index values change format (2: float32 instead
+# of float16, 3: nodata read raw like TileProcessor instead of as NaN) so
+# values cached in the old format are recomputed, not reused
+VALUES_CACHE_VERSION = 3
+
+# Output encoding of colored tiles (see rendering.IMAGE_FORMATS) and the
+# settings that apply to each format
+ENCODING_DEFAULTS = {
+    'image_format': 'png',
+    'compress_level': 6,
+    'quality': 80,
+}
+_ENCODING_OPTIONS = {
+    'png': ('compress_level',),
+    'palette': ('compress_level',),
+    'webp': (),
+    'webp_lossy': ('quality',),
+}
+
+
+def encoding_options(params):
+    """Return the encoding options in ``params`` that affect the tile bytes, with defaults filled in."""
+    image_format = params.get('image_format') or ENCODING_DEFAULTS['image_format']
+    options = {'image_format': image_format}
+    for name in _ENCODING_OPTIONS[image_format]:
+        value = params.get(name)
+        options[name] = ENCODING_DEFAULTS[name] if value is None else value
+    return options
+
+
+def window_max_age(params):
+    """
+    Return how many seconds cached tiles and values for ``params`` stay
+    valid: None once the date window has closed (its scenes are final),
+    TILE_OPEN_WINDOW_MAX_AGE while scenes can still land in it.
+    """
+    try:
+        end_date = datetime.date.fromisoformat(str(params.get('end_date')))
+    except ValueError:
+        end_date = None
+    if end_date is not None and end_date < datetime.date.today():
+        return None
+    return getattr(settings, 'TILE_OPEN_WINDOW_MAX_AGE', DEFAULT_OPEN_WINDOW_MAX_AGE)
+
+
+def _hash_payload(x, y, z, params, keys):
+    payload = {key: params.get(key) for key in keys}
+    payload.update(x=int(x), y=int(y), z=int(z))
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def tile_cache_key(x, y, z, **params):
+    """Return the content address of tile x/y/z rendered with ``params``."""
+    key = _hash_payload(x, y, z, params, TILE_PARAM_KEYS)
+    options = encoding_options(params)
+    if options != encoding_options({}):
+        # Default PNGs keep their plain key, other encodings are variants of it
+        key = variant_cache_key(key, **options)
+    return key
+
+
+def values_cache_key(x, y, z, **params):
+    """Return the address of tile x/y/z's float index values, shared by every colormap."""
+    payload = dict(params, values_version=VALUES_CACHE_VERSION)
+    return _hash_payload(x, y, z, payload, VALUE_PARAM_KEYS + ('values_version',))
+
+
+def variant_cache_key(key, **variant):
+    """Return the key of a post-processed variant (e.g. a clipped copy) of tile ``key``."""
+    encoded = json.dumps(variant, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f'{key}:{encoded}'.encode('utf-8')).hexdigest()
+
+
+class TileCache:
+    """
+    Persistent on-disk tile cache.
+
+    Tiles are stored as ``<root>/<key[:2]>/<key>.<ext>`` and indexed in a
+    SQLite manifest that records size, ETag, tile metadata and last access.
+    The manifest keeps a running total of the tile sizes; when a put takes
+    it over ``max_bytes`` the least recently used tiles are evicted down to
+    90% of the quota. Lookups with a ``max_age`` (see window_max_age) miss
+    entries stored longer ago, which the next put then replaces.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = str(root or getattr(settings, 'TILE_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'tiles')))
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(settings, 'TILE_CACHE_MAX_BYTES', 2 * 1024 ** 3)
+        os.makedirs(self.root, exist_ok=True)
+        self.manifest_path = os.path.join(self.root, 'manifest.sqlite3')
+        with self._transaction() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tiles ('
+                ' key TEXT PRIMARY KEY,'
+                ' path TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' etag TEXT NOT NULL,'
+                ' meta TEXT,'
+                ' created_at REAL NOT NULL,'
+                ' last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access)')
+            conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            # Manifests from before the running total get it computed once
+            conn.execute(
+                "INSERT OR IGNORE INTO stats (name, value) SELECT 'total_size', COALESCE(SUM(size), 0) FROM tiles"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.manifest_path, timeout=30)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # sqlite3's own context manager commits but never closes
+        with contextlib.closing(self._connect()) as conn:
+            with conn:
+                yield conn
+
+    @staticmethod
+    def _add_size(conn, delta):
+        conn.execute("UPDATE stats SET value = value + ? WHERE name = 'total_size'", (delta,))
+
+    def _forget(self, conn, key, size):
+        conn.execute('DELETE FROM tiles WHERE key = ?', (key,))
+        self._add_size(conn, -size)
+
+    def path_for(self, key, ext='png'):
+        return os.path.join(self.root, key[:2], f'{key}.{ext}')
+
+    def lock_path(self, key):
+        # Sharded so lock files stay bounded (4096) however many tiles exist
+        return os.path.join(self.root, 'locks', f'{key[:3]}.lock')
+
+    def get(self, key, max_age=None):
+        """Return the manifest entry for ``key`` and mark it as used, or None if missing or older than ``max_age``."""
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT path, size, etag, meta, created_at FROM tiles WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            path, size, etag, meta, created_at = row
+            if max_age is not None and time.time() - created_at > max_age:
+                return None
+            if not os.path.exists(path):
+                # The file was removed behind our back, forget about it
+                self._forget(conn, key, size)
+                return None
+            conn.execute('UPDATE tiles SET last_access = ? WHERE key = ?', (time.time(), key))
+        return {
+            'key': key,
+            'path': path,
+            'size': size,
+            'etag': etag,
+            'meta': json.loads(meta) if meta else {},
+        }
+
+    def read(self, key, max_age=None):
+        """Return ``(data, entry)`` for a cached tile, or None on a miss."""
+        entry = self.get(key, max_age)
+        if entry is None:
+            return None
+        try:
+            with open(entry['path'], 'rb') as f:
+                return f.read(), entry
+        except FileNotFoundError:
+            return None
+
+    @stage('write')
+    def put(self, key, data, meta=None, ext='png'):
+        """Store ``data`` under ``key`` and return its manifest entry."""
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a private temp file first so readers never see partial tiles
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        now = time.time()
+        with self._transaction() as conn:
+            previous = conn.execute('SELECT size FROM tiles WHERE key = ?', (key,)).fetchone()
+            conn.execute(
+                'INSERT OR REPLACE INTO tiles (key, path, size, etag, meta, created_at, last_access)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, path, len(data), etag, json.dumps(meta or {}), now, now),
+            )
+            self._add_size(conn, len(data) - (previous[0] if previous else 0))
+            total = self._total_size(conn)
+        if self.max_bytes and total > self.max_bytes:
+            # Evicting down to 90% means this only runs once per 10% of quota written
+            self.evict()
+        return {'key': key, 'path': path, 'size': len(data), 'etag': etag, 'meta': meta or {}}
+
+    @staticmethod
+    def _total_size(conn):
+        return conn.execute("SELECT value FROM stats WHERE name = 'total_size'").fetchone()[0]
+
+    def total_size(self):
+        with self._transaction() as conn:
+            return self._total_size(conn)
+
+    def expire(self, max_idle):
+        """Drop tiles that have not been used for ``max_idle`` seconds."""
+        cutoff = time.time() - max_idle
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT key, path, size FROM tiles WHERE last_access < ?', (cutoff,)).fetchall()
+            for key, path, size in rows:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._forget(conn, key, size)
+        if rows:
+            print(f"Tile cache expired {len(rows)} idle tiles")
+        return len(rows)
+
+    def evict(self, max_bytes=None):
+        """Drop least recently used tiles until the cache fits its quota."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if not max_bytes:
+            return 0
+        target = int(max_bytes * 0.9)
+        removed = 0
+        with self._transaction() as conn:
+            total = self._total_size(conn)
+            if total <= max_bytes:
+                return 0
+            rows = conn.execute('SELECT key, path, size FROM tiles ORDER BY last_access ASC').fetchall()
+            for key, path, size in rows:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._forget(conn, key, size)
+                total -= size
+                removed += 1
+        print(f"Tile cache evicted {removed} tiles, {total} bytes remaining")
+        return removed
@@ -0,0 +1,469 @@
+import datetime
+import hashlib
+import inspect
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from django.conf import settings
+from django.utils import timezone
+from matplotlib.figure import Figure
+
+from .cpu_budget import CPUBudget, max_workers
+from .models import Job, TimeSeriesPoint
+from .raster_env import raster_env
+from .retention import record_artifact
+
+# Phases a time-series computation goes through, in order
+PHASE_SEARCHING = 'searching'
+PHASE_PROCESSING = 'processing_scenes'
+PHASE_AGGREGATING = 'aggregating'
+PHASE_RENDERING = 'rendering'
+PHASE_COLLECTING = 'collecting_outputs'
+
+# Output file kinds and the name prefix / extension identifying them
+OUTPUT_FILES = {
+    'gif': ('output', '.gif'),
+    'values': ('values_over_time', '.png'),
+}
+
+# Default seconds a result is reused while its date window is still open
+DEFAULT_OPEN_WINDOW_TTL = 6 * 3600
+
+# VCubeProcessor's operations, applied to the pixels of one scene
+OPERATIONS = {
+    "mean": np.ma.mean,
+    "median": np.ma.median,
+    "max": np.ma.max,
+    "min": np.ma.min,
+    "std": np.ma.std,
+    "sum": np.ma.sum,
+    "var": np.ma.var,
+}
+
+# VCubeProcessor methods ProgressVCubeProcessor overrides or calls, with
+# their parameters. Some are private, so VirtuGhan is pinned in
+# requirements.txt and _processor_class refuses a version where any of them
+# changed rather than silently losing progress, CPU budget or incremental mode.
+VCUBE_HOOKS = {
+    '_get_band_urls': ('self', 'features'),
+    'fetch_process_custom_band': ('self', 'band1_url', 'band2_url'),
+    'add_text_to_image': ('self', 'image_path', 'text'),
+    '_aggregate_results': ('self',),
+    'save_aggregated_result_with_colormap': ('self', 'result_aggregate', 'output_file'),
+}
+
+# Written for pixels without a value in frame GeoTIFFs, as VCubeProcessor does
+FRAME_NODATA = -9999
+
+
+def time_series_root():
+    return os.path.join(str(settings.MEDIA_ROOT), 'virtughan_output')
+
+
+def output_dir_for(request_id):
+    return os.path.join(time_series_root(), str(request_id))
+
+
+def series_dir(series_key):
+    """Where the GIF frames of an incremental series are kept between runs."""
+    return os.path.join(str(settings.MEDIA_ROOT), 'virtughan_series', series_key)
+
+
+def scene_value(result, operation):
+    """Apply ``operation`` to the valid pixels of one scene; None if it has none."""
+    data = np.ma.masked_invalid(result)
+    if not data.count():
+        return None
+    return float(OPERATIONS[operation](data))
+
+
+def _media_path(path):
+    return os.path.relpath(path, os.path.dirname(str(settings.MEDIA_ROOT))).replace(os.sep, '/')
+
+
+def _processor_class():
+    from vcube.engine import VCubeProcessor
+
+    changed = [
+        name for name, parameters in VCUBE_HOOKS.items()
+        if not callable(getattr(VCubeProcessor, name, None))
+        or tuple(inspect.signature(getattr(VCubeProcessor, name)).parameters) != parameters
+    ]
+    if changed:
+        raise RuntimeError(
+            f"Unsupported VirtuGhan version: VCubeProcessor.{', VCubeProcessor.'.join(changed)} changed "
+            f"(see VCUBE_HOOKS in api/time_series.py)"
+        )
+
+    class ProgressVCubeProcessor(VCubeProcessor):
+        """VCubeProcessor reporting ``on_progress(phase, done, total)`` as it goes."""
+
+        def __init__(self, *args, on_progress=None, lease=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.on_progress = on_progress
+            self.lease = lease
+            self._scenes_done = 0
+            self._scenes_total = 0
+            self._progress_lock = threading.Lock()
+
+        def _report(self, phase, done=0, total=0):
+            if self.on_progress is not None:
+                self.on_progress(phase, done, total)
+
+        def start_scenes(self, total):
+            self._scenes_total = total
+            self._report(PHASE_PROCESSING, 0, total)
+
+        def _get_band_urls(self, features):
+            band1_urls, band2_urls = super()._get_band_urls(features)
+            self.start_scenes(len(band1_urls))
+            return band1_urls, band2_urls
+
+        def fetch_process_custom_band(self, band1_url, band2_url):
+            # Runs on the processor's own worker threads
+            if self.lease is None:
+                result = super().fetch_process_custom_band(band1_url, band2_url)
+            else:
+                with self.lease.slot():
+                    result = super().fetch_process_custom_band(band1_url, band2_url)
+            with self._progress_lock:
+                self._scenes_done += 1
+                done = self._scenes_done
+            self._report(PHASE_PROCESSING, done, self._scenes_total)
+            return result
+
+        def _aggregate_results(self):
+            self._report(PHASE_AGGREGATING, self._scenes_done, self._scenes_total)
+            return super()._aggregate_results()
+
+        def save_aggregated_result_with_colormap(self, result_aggregate, output_file):
+            self._report(PHASE_RENDERING, self._scenes_done, self._scenes_total)
+            return super().save_aggregated_result_with_colormap(result_aggregate, output_file)
+
+    return ProgressVCubeProcessor
+
+
+def _build_processor(processor_class, payload, output_dir, workers, on_progress, lease):
+    return processor_class(
+        bbox=[payload["min_lon"], payload["min_lat"], payload["max_lon"], payload["max_lat"]],
+        start_date=payload["start_date"],
+        end_date=payload["end_date"],
+        cloud_cover=payload["cloud_cover"],
+        formula=payload["formula"],
+        band1=payload["band1"],
+        band2=payload["band2"],
+        operation=payload["operation"],
+        timeseries=payload["timeseries"],
+        output_dir=output_dir,
+        workers=workers,
+        on_progress=on_progress,
+        lease=lease,
+    )
+
+
+def select_scenes(payload):
+    """
+    Return the STAC features a full VCubeProcessor run over ``payload``
+    processes, chosen by the same vcube.engine functions its search uses:
+    scenes covering the bbox, one per date in the main UTM zone, thinned by
+    smart_filter_images according to the length of the date window.
+    """
+    from vcube import engine
+
+    bbox = [payload["min_lon"], payload["min_lat"], payload["max_lon"], payload["max_lat"]]
+    features = engine.search_stac_api(bbox, payload["start_date"], payload["end_date"], payload["cloud_cover"])
+    features = engine.filter_intersected_features(features, bbox)
+    features = engine.remove_overlapping_sentinel2_tiles(features)
+    if not features:
+        return []
+    return engine.smart_filter_images(features, payload["start_date"], payload["end_date"])
+
+
+def _save_frame(processor, result, crs, transform, scene, date, frames_dir):
+    """Write the captioned GIF frame of one scene, named so frame paths sort by date."""
+    os.makedirs(frames_dir, exist_ok=True)
+    base = os.path.join(frames_dir, f"{date}_{scene}")
+    data = np.where(np.isnan(result), FRAME_NODATA, result)
+    with rasterio.open(
+        f"{base}.tif", "w", driver="GTiff", height=data.shape[1], width=data.shape[2], count=data.shape[0],
+        dtype=data.dtype, crs=crs, transform=transform, nodata=FRAME_NODATA,
+    ) as dst:
+        dst.write(data)
+    try:
+        os.replace(processor.add_text_to_image(f"{base}.tif", scene), f"{base}.png")
+    finally:
+        os.remove(f"{base}.tif")
+    return f"{base}.png"
+
+
+def _compute_scenes(processor, features, frames_dir):
+    """
+    Compute the value (and, for a GIF, the frame) of each feature, reading
+    on the processor's workers; returns ``{scene: point}`` for the scenes
+    that could be read.
+    """
+    processor.start_scenes(len(features))
+
+    def read(feature):
+        band2_url = feature["assets"][processor.band2]["href"] if processor.band2 else None
+        return processor.fetch_process_custom_band(feature["assets"][processor.band1]["href"], band2_url)
+
+    points = {}
+    with ThreadPoolExecutor(max_workers=max(1, processor.workers)) as executor:
+        for feature, (result, *georef) in zip(features, executor.map(read, features)):
+            if result is None:
+                continue
+            scene, date = feature["id"], feature["properties"]["datetime"][:10]
+            frame = None
+            if processor.timeseries:
+                # Frames are drawn with pyplot, so on this thread only, as VCubeProcessor does
+                frame = _save_frame(processor, result, georef[0], georef[1], scene, date, frames_dir)
+            points[scene] = {"date": date, "value": scene_value(result, processor.operation), "frame": frame}
+    return points
+
+
+def _stored_points(series_key, need_frames):
+    points = list(TimeSeriesPoint.objects.filter(series_key=series_key))
+    if need_frames:
+        # A frame swept from disk means that scene has to be computed again
+        points = [
+            point for point in points
+            if point.value is None or (point.frame and os.path.exists(os.path.join(str(settings.MEDIA_ROOT), point.frame)))
+        ]
+    return points
+
+
+def _save_points(series_key, points):
+    media_root = str(settings.MEDIA_ROOT)
+    TimeSeriesPoint.objects.filter(series_key=series_key, scene__in=list(points)).delete()
+    TimeSeriesPoint.objects.bulk_create([
+        TimeSeriesPoint(
+            series_key=series_key,
+            scene=scene,
+            date=datetime.date.fromisoformat(point["date"]),
+            value=point["value"],
+            frame=os.path.relpath(point["frame"], media_root) if point["frame"] else None,
+        )
+        for scene, point in points.items()
+    ], ignore_conflicts=True)
+
+
+def render_values_chart(dates, values, operation, output_file):
+    """Plot ``values`` over ``dates`` with a trend line, like VCubeProcessor's values_over_time.png."""
+    label = operation.capitalize()
+    figure = Figure(figsize=(10, 5))
+    axes = figure.subplots()
+    axes.plot(dates, values, marker="o", linestyle="-", label=f"{label} Value")
+    if len(values) > 1:
+        positions = np.arange(len(values))
+        slope, intercept = np.polyfit(positions, values, 1)
+        axes.plot(dates, slope * positions + intercept, color="red", linestyle="--", label="Trend Line")
+    axes.set_xlabel("Date")
+    axes.set_ylabel(f"{label} Value")
+    axes.set_title(f"{label} Value Over Time")
+    axes.grid(True)
+    axes.tick_params(axis="x", labelrotation=45)
+    axes.legend()
+    figure.tight_layout()
+    figure.savefig(output_file)
+
+
+def _render_series(processor_class, series_key, scenes, payload, output_dir):
+    """Write the values chart and GIF of the stored points of ``scenes``."""
+    points = [
+        point for point in TimeSeriesPoint.objects.filter(series_key=series_key, scene__in=scenes).order_by('date', 'scene')
+        if point.value is not None
+    ]
+    if not points:
+        return
+    render_values_chart(
+        [point.date.strftime("%Y%m%d") for point in points],
+        [point.value for point in points],
+        payload["operation"],
+        os.path.join(output_dir, "values_over_time.png"),
+    )
+    media_root = str(settings.MEDIA_ROOT)
+    frames = [os.path.join(media_root, point.frame) for point in points if point.frame]
+    if payload["timeseries"] and frames:
+        processor_class.create_gif(frames, os.path.join(output_dir, "output.gif"))
+
+
+def run_time_series(payload, request_id, on_progress=None):
+    """
+    Run VCubeProcessor for a validated TimeSeriesSerializer ``payload`` into
+    the output directory of ``request_id`` and return the result body with
+    the media paths of its GIF and values chart.
+
+    ``on_progress`` is an optional callable taking ``(phase, done, total)``;
+    during PHASE_PROCESSING ``done``/``total`` count scenes. It may be called
+    from VCubeProcessor's worker threads.
+
+    ``workers`` is capped by TIME_SERIES_MAX_WORKERS, and scenes are only
+    processed while the job is within its share of the host's CPU budget
+    (see api/cpu_budget.py), weighted by ``priority``.
+
+    With ``incremental`` the value (and GIF frame) of every scene is stored
+    per series (see time_series_series_key). The scenes are selected exactly
+    as a full run selects them (see select_scenes), only those not stored
+    yet are processed (for a series extended in time: the new acquisition
+    dates), and the chart and GIF are drawn from the stored points of the
+    selected scenes. No aggregate over the whole window is computed in that
+    mode.
+    """
+    try:
+        processor_class = _processor_class()
+    except ImportError:
+        raise RuntimeError("VirtuGhan package not installed. Install with: pip install VirtuGhan")
+    output_dir = output_dir_for(request_id)
+    os.makedirs(output_dir, exist_ok=True)
+    if on_progress is not None:
+        on_progress(PHASE_SEARCHING, 0, 0)
+    incremental = payload.get("incremental")
+    if incremental:
+        if payload["operation"] not in OPERATIONS:
+            raise ValueError(f"Unknown operation {payload['operation']}")
+        series_key = time_series_series_key(payload)
+        frames_dir = series_dir(series_key)
+    workers = min(payload["workers"], max_workers())
+    with CPUBudget().lease(request_id, weight=payload.get("priority", 1), demand=workers) as lease:
+        processor = _build_processor(processor_class, payload, output_dir, workers, on_progress, lease)
+        with raster_env():
+            if incremental:
+                scenes = select_scenes(payload)
+                stored = {point.scene for point in _stored_points(series_key, payload["timeseries"])}
+                # Per-scene band math of the new scenes only; the outputs come from the stored points
+                points = _compute_scenes(
+                    processor, [feature for feature in scenes if feature["id"] not in stored], frames_dir
+                )
+            else:
+                processor.compute()
+    if incremental:
+        _save_points(series_key, points)
+        if on_progress is not None:
+            on_progress(PHASE_RENDERING, processor._scenes_done, processor._scenes_total)
+        _render_series(processor_class, series_key, [feature["id"] for feature in scenes], payload, output_dir)
+        record_artifact('time_series_frames', frames_dir)
+    if on_progress is not None:
+        on_progress(PHASE_COLLECTING, processor._scenes_done, processor._scenes_total)
+
+    # Keep the GIF and values chart, delete the intermediate TIFFs and zip
+    outputs = {}
+    for f in os.listdir(output_dir):
+        full_path = os.path.join(output_dir, f)
+        kind = next(
+            (kind for kind, (prefix, ext) in OUTPUT_FILES.items() if f.startswith(prefix) and f.endswith(ext)),
+            None,
+        )
+        if kind is not None and kind not in outputs:
+            outputs[kind] = full_path
+        else:
+            os.remove(full_path)
+    if len(outputs) < len(OUTPUT_FILES):
+        raise FileNotFoundError("Required output files not found.")
+    record_artifact('time_series', output_dir)
+    body = {
+        "message": "Time series computation completed successfully!",
+        "gif_file_path": _media_path(outputs['gif']),
+        "values_file_path": _media_path(outputs['values']),
+        "output_dir": _media_path(output_dir),
+        "request_id": str(request_id),
+    }
+    if incremental:
+        body["scenes_computed"] = len(points)
+        body["scenes_reused"] = sum(1 for feature in scenes if feature["id"] in stored)
+    return body
+
+
+def _normalize_date(value):
+    try:
+        return datetime.date.fromisoformat(str(value)).isoformat()
+    except ValueError:
+        return str(value)
+
+
+def _hash(normalized):
+    encoded = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def time_series_series_key(payload):
+    """
+    Return the key of the series a payload extends: everything that decides
+    the value of a single scene, i.e. the payload without its date window.
+    The bbox is rounded like scene search keys and the formula ignores
+    whitespace.
+    """
+    return _hash({
+        "bbox": [round(float(payload[name]), 6) for name in ("min_lon", "min_lat", "max_lon", "max_lat")],
+        "cloud_cover": float(payload["cloud_cover"]),
+        "band1": payload["band1"],
+        "band2": payload["band2"] or None,
+        "formula": "".join(payload["formula"].split()),
+        "operation": payload["operation"].lower(),
+    })
+
+
+def time_series_cache_key(payload):
+    """
+    Return the cache key of a TimeSeriesSerializer ``payload``: its series
+    and date window. ``workers`` and ``priority`` only change how fast the
+    result comes, so they are left out.
+    """
+    normalized = {
+        "series": time_series_series_key(payload),
+        "start_date": _normalize_date(payload["start_date"]),
+        "end_date": _normalize_date(payload["end_date"]),
+        "timeseries": bool(payload["timeseries"]),
+    }
+    if payload.get("incremental"):
+        # Charts drawn from stored points differ slightly from a full run's
+        normalized["incremental"] = True
+    return _hash(normalized)
+
+
+def _outputs_exist(job):
+    output_dir = output_dir_for(job.id)
+    return all(
+        os.path.exists(os.path.join(output_dir, os.path.basename(job.result[f"{name}_file_path"])))
+        for name in OUTPUT_FILES
+    )
+
+
+def _result_is_fresh(job, now=None):
+    # Scenes keep landing until the window closes; a result computed after that is final
+    now = now or timezone.now()
+    try:
+        end_date = datetime.date.fromisoformat(str(job.params["end_date"]))
+    except ValueError:
+        end_date = None
+    if end_date is not None and timezone.localdate(job.finished_at) > end_date:
+        return True
+    ttl = getattr(settings, 'TIME_SERIES_OPEN_WINDOW_TTL', DEFAULT_OPEN_WINDOW_TTL)
+    return (now - job.finished_at).total_seconds() < ttl
+
+
+def find_time_series_job(cache_key, user):
+    """
+    Return the job of ``user`` whose result a request with ``cache_key`` can
+    use: an identical request still queued or running, or the newest
+    successful one that is fresh and whose files haven't been swept. None if
+    there is none. Jobs are only visible to their owner, so other users'
+    jobs are never reused; their stored points still are (incremental mode).
+    """
+    jobs = Job.objects.filter(kind=Job.KIND_TIME_SERIES, cache_key=cache_key, user=user)
+    pending = (
+        jobs.filter(status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING])
+        .order_by('created_at')
+        .first()
+    )
+    if pending is not None:
+        return pending
+    finished = jobs.filter(status=Job.STATUS_SUCCEEDED).order_by('-finished_at')
+    for job in finished[:5]:
+        if _result_is_fresh(job) and _outputs_exist(job):
+            return job
+    return None
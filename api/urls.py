@@ -19,8 +19,21 @@ urlpatterns = [
     path('register/', views.RegisterView.as_view(), name='register'),
     path('verify-email/<uuid:token>/', views.EmailVerificationView.as_view(), name='verify-email'),
     path('generate-tiles/', views.TileGenerationView.as_view(), name='generate-tiles'),
+    path('tile-jobs/', views.TileJobView.as_view(), name='tile-jobs'),
+    path('jobs/<uuid:job_id>/', views.JobStatusView.as_view(), name='job-status'),
+    path('tiles/archives/<str:archive_id>/<int:z>/<int:x>/<int:y>.png', views.TileArchiveView.as_view(extension='png'), name='tile-archive'),
+    path('tiles/archives/<str:archive_id>/<int:z>/<int:x>/<int:y>.webp', views.TileArchiveView.as_view(extension='webp'), name='tile-archive-webp'),
+    path('tiles/<int:z>/<int:x>/<int:y>.png', views.TileView.as_view(extension='png'), name='tile'),
+    path('tiles/<int:z>/<int:x>/<int:y>.webp', views.TileView.as_view(extension='webp'), name='tile-webp'),
+    path('tiles/<int:z>/<int:x>/<int:y>.u16', views.TileDataView.as_view(tile_format='u16'), name='tile-data-u16'),
+    path('tiles/<int:z>/<int:x>/<int:y>.f32', views.TileDataView.as_view(tile_format='f32'), name='tile-data-f32'),
     path('tile-map/', views.TileMapView.as_view(), name='tile-map'),
     path('farm-areas/', views.FarmAreaView.as_view(), name='farm-area-list'),
     path('farm-areas/<int:pk>/', views.FarmAreaDetailView.as_view(), name='farm-area-detail'),
+    path('farm-areas/<int:pk>/stats/', views.FarmAreaStatsView.as_view(), name='farm-area-stats'),
     path('time_series/', views.TimeSeriesView.as_view(), name='time_series'),
+    path('time_series/<uuid:request_id>/', views.TimeSeriesStatusView.as_view(), name='time-series-status'),
+    path('time_series/<uuid:request_id>/gif/', views.TimeSeriesFileView.as_view(), {'name': 'gif'}, name='time-series-gif'),
+    path('time_series/<uuid:request_id>/values/', views.TimeSeriesFileView.as_view(), {'name': 'values'}, name='time-series-values'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
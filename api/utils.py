@@ -1,95 +1,368 @@
+import asyncio
+import contextlib
 import mercantile
-from PIL import Image
-from io import BytesIO
-from vcube.tile import TileProcessor
+import numpy as np
+from django.conf import settings
+from . import metrics
+from .retention import record_artifact
+from .singleflight import SingleFlight, file_lock
+from .tile_archive import MBTilesArchive, archive_path, new_archive_id
+from .tile_cache import (
+    VALUE_PARAM_KEYS, TileCache, encoding_options, tile_cache_key, values_cache_key, variant_cache_key,
+    window_max_age
+)
+from .stac import cached_search_scenes
+from .rendering import (
+    IMAGE_FORMATS, compute_tile_values, decode_values, downsample_values, encode_data_tile, encode_tile_image,
+    encode_values
+)
+from .geometry import farm_area_clip_token, farm_area_polygon, polygon_mask, tiles_in_polygon
+from .models import FarmArea
 import os
 import folium
-import tempfile
 import datetime
+import json
+from urllib.parse import urlencode
 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAPS_DIR = os.path.join(BASE_DIR, "static", "maps")
 
-async def generate_tiles_and_map(
-    min_lon=30.304434642130218, 
-    min_lat=30.174682637534644, 
-    max_lon=30.42143846734797, 
-    max_lat=30.283438554006977,
-    zoom_level=12,
-    start_date="2025-01-01",
-    end_date="2025-03-01",
-    cloud_cover=30,
-    band1="red",
-    band2="nir",
-    formula="(band2-band1)/(band2+band1)",
-    colormap_str="RdYlGn"
-):
-    media_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "media")
-    os.makedirs(media_dir, exist_ok=True)
-    tiles_dir = os.path.join(media_dir, "tiles")
-    os.makedirs(tiles_dir, exist_ok=True)
-
-    tiles = list(mercantile.tiles(min_lon, min_lat, max_lon, max_lat, zooms=zoom_level))
-    print(f"Number of tiles to process: {len(tiles)}")
-    tile_processor = TileProcessor()
-    results = []
-    for tile in tiles:
-        x, y, z = tile.x, tile.y, tile.z
-        print(f"Processing tile: {x}_{y}_{z}")
-        try:
-            image_bytes, feature = await tile_processor.cached_generate_tile(
-                x=x,
-                y=y,
-                z=z,
-                start_date=start_date,
-                end_date=end_date,
-                cloud_cover=cloud_cover,
-                band1=band1,
-                band2=band2,
-                formula=formula,
-                colormap_str=colormap_str,
-            )
-            print(f"Image bytes size: {len(image_bytes)} bytes")
-            if not image_bytes or len(image_bytes) == 0:
-                print(f"Warning: Empty image bytes for tile {x}_{y}_{z}")
-                continue
-            image = Image.open(BytesIO(image_bytes))
-            print(f"Tile: {x}_{y}_{z}")
-            print(f"Date: {feature['properties']['datetime']}")
-            print(f"Cloud Cover: {feature['properties']['eo:cloud_cover']}%")
-            
-            # Save the image to the media/tiles directory
-            filename = f'tile_{x}_{y}_{z}.png'
-            file_path = os.path.join(tiles_dir, filename)
-            image.save(file_path)
-            
-            # Create relative path from media directory
-            relative_path = os.path.join("media/tiles", filename)
-            
-            print(f"Saved image to: {file_path}")
-            results.append({
-                'tile': f"{x}_{y}_{z}",
-                'date': feature['properties']['datetime'],
-                'cloud_cover': feature['properties']['eo:cloud_cover'],
-                'file_path': relative_path,
-                'x': x,
-                'y': y,
-                'z': z
-            })
-        except Exception as e:
-            print(f"Error processing tile {x}_{y}_{z}: {str(e)}")
-            continue
-    map_path = None
-    map_html = None
-    if results:
-        center_lat = (min_lat + max_lat) / 2
-        center_lon = (min_lon + max_lon) / 2
-        m = folium.Map(location=[center_lat, center_lon], zoom_start=zoom_level-1, tiles="OpenStreetMap")
+# Map output modes: inline every tile as a base64 ImageOverlay, or reference
+# the /api/tiles/{z}/{x}/{y}.png endpoint through a single TileLayer
+MAP_MODE_EMBEDDED = "embedded"
+MAP_MODE_TILE_LAYER = "tile_layer"
+MAP_MODES = (MAP_MODE_EMBEDDED, MAP_MODE_TILE_LAYER)
+
+# Tile payloads: colored PNGs, or raw index values for client-side
+# rendering as quantized uint16 or float32 data tiles (see api/rendering.py)
+TILE_FORMAT_PNG = "png"
+DATA_TILE_FORMATS = ("u16", "f32")
+TILE_FORMATS = (TILE_FORMAT_PNG,) + DATA_TILE_FORMATS
+
+# In-process request coalescing shared by every caller of render_tile
+tile_flight = SingleFlight()
+
+# Upper bound on tiles fetched from the COG backend at the same time
+DEFAULT_TILE_CONCURRENCY = 8
+# Seconds allowed for a single tile before it is reported as failed
+DEFAULT_TILE_TIMEOUT = 60
+
+
+def _tile_result(x, y, z, entry, cached):
+    meta = entry['meta']
+    return {
+        'tile': f"{x}_{y}_{z}",
+        'date': meta.get('date'),
+        'cloud_cover': meta.get('cloud_cover'),
+        # Relative to the project root, e.g. media/tiles/ab/ab12....png
+        'file_path': os.path.relpath(entry['path'], BASE_DIR),
+        'cached': cached,
+        'x': x,
+        'y': y,
+        'z': z
+    }
+
+
+def _cross_process_lock(tile_cache, key):
+    if getattr(settings, 'TILE_SINGLE_FLIGHT_FILE_LOCK', False):
+        return file_lock(tile_cache.lock_path(key))
+    return contextlib.nullcontext()
+
+
+def _derived_meta(metas):
+    # A derived tile mixes scenes; report the newest date and the worst cloud cover
+    dates = [meta.get('date') for meta in metas if meta.get('date')]
+    clouds = [meta.get('cloud_cover') for meta in metas if meta.get('cloud_cover') is not None]
+    return {
+        'date': max(dates) if dates else None,
+        'cloud_cover': max(clouds) if clouds else None,
+        'derived': True,
+    }
+
+
+async def _read_values(tile_cache, key, max_age=None):
+    hit = await asyncio.to_thread(tile_cache.read, key, max_age)
+    if hit is None:
+        return None
+    data, entry = hit
+    return await asyncio.to_thread(decode_values, data), entry['meta']
+
+
+async def derive_values_from_children(tile_cache, x, y, z, **params):
+    """
+    Return ``(values, meta)`` for tile x/y/z averaged from its four cached
+    zoom z+1 children, or None if any child is missing from the cache.
+    """
+    children = {}
+    metas = []
+    for child in mercantile.children(mercantile.Tile(x, y, z)):
+        hit = await _read_values(
+            tile_cache, values_cache_key(child.x, child.y, child.z, **params), window_max_age(params)
+        )
+        if hit is None:
+            return None
+        children[child], meta = hit
+        metas.append(meta)
+    print(f"Deriving tile {x}_{y}_{z} from cached children")
+    values = await asyncio.to_thread(downsample_values, children)
+    return values, _derived_meta(metas)
+
+
+async def tile_values(tile_cache, x, y, z, derive_overviews=False, **params):
+    """
+    Return ``(values, meta)``: the float index values of tile x/y/z before
+    any colormap is applied. They are cached as compact .npy tiles keyed
+    without colormap or stretch, so recoloring never goes upstream.
+
+    With ``derive_overviews`` a missing tile is first averaged from its four
+    cached children, so lower zooms only go upstream for uncovered tiles.
+    ``find_scenes`` in ``params`` is handed to compute_tile_values.
+
+    Values of a date window that is still open are recomputed once older
+    than window_max_age, so scenes acquired since are picked up.
+    """
+    key = values_cache_key(x, y, z, **params)
+    max_age = window_max_age(params)
+    hit = await _read_values(tile_cache, key, max_age)
+    if hit is not None:
+        metrics.count('values_cache_hit')
+        return hit
+    metrics.count('values_cache_miss')
+
+    async def fill():
+        async with _cross_process_lock(tile_cache, key):
+            # Another process may have computed it while we waited for the lock
+            hit = await _read_values(tile_cache, key, max_age)
+            if hit is not None:
+                return hit
+            derived = None
+            if derive_overviews:
+                derived = await derive_values_from_children(tile_cache, x, y, z, **params)
+            if derived is not None:
+                metrics.count('overview_derived')
+                values, meta = derived
+            else:
+                print(f"Processing tile: {x}_{y}_{z}")
+                values, meta = await compute_tile_values(
+                    x, y, z, **{name: params[name] for name in VALUE_PARAM_KEYS},
+                    find_scenes=params.get('find_scenes'),
+                )
+            data = await asyncio.to_thread(encode_values, values)
+            await asyncio.to_thread(tile_cache.put, key, data, meta, 'npy')
+            return values, meta
+
+    # Concurrent requests for the same tile share one upstream read
+    return await tile_flight.do(('values', tile_cache.root, key), fill)
+
+
+def _mask_values(values, x, y, z, polygon):
+    height, width = values.shape
+    inside = np.asarray(polygon_mask(polygon, x, y, z, (width, height))) > 0
+    return np.where(inside, values, np.nan)
+
+
+def _encode_tile(values, x, y, z, params, clip_polygon=None):
+    if clip_polygon is not None:
+        # NaN pixels come out transparent, so clipping never decodes an image
+        values = _mask_values(values, x, y, z, clip_polygon)
+    return encode_tile_image(
+        values, params['colormap_str'], params.get('vmin'), params.get('vmax'), **encoding_options(params)
+    )
+
+
+def tile_extension(params):
+    """Return the file extension of tiles encoded with ``params``."""
+    return IMAGE_FORMATS[encoding_options(params)['image_format']][1]
+
+
+async def fetch_tile_bytes(tile_cache, x, y, z, derive_overviews=False, clip_polygon=None, **params):
+    """
+    Return ``(image_bytes, meta)`` for tile x/y/z colored from its index
+    values and encoded as requested by the ``image_format`` options.
+    """
+    values, meta = await tile_values(tile_cache, x, y, z, derive_overviews=derive_overviews, **params)
+    image_bytes = await asyncio.to_thread(_encode_tile, values, x, y, z, params, clip_polygon)
+    return image_bytes, meta
+
+
+async def render_tile(tile_cache, x, y, z, derive_overviews=False, **params):
+    """
+    Return ``(entry, cached)`` for tile x/y/z, coloring it from its index
+    values and storing the PNG in ``tile_cache`` on a cache miss.
+    """
+    key = tile_cache_key(x, y, z, **params)
+    entry = await asyncio.to_thread(tile_cache.get, key, window_max_age(params))
+    if entry is not None:
+        print(f"Cache hit for tile: {x}_{y}_{z}")
+        metrics.count('tile_cache_hit')
+        return entry, True
+    metrics.count('tile_cache_miss')
+
+    async def fill():
+        image_bytes, meta = await fetch_tile_bytes(
+            tile_cache, x, y, z, derive_overviews=derive_overviews, **params
+        )
+        entry = await asyncio.to_thread(tile_cache.put, key, image_bytes, meta, tile_extension(params))
+        print(f"Saved image to: {entry['path']}")
+        return entry, False
+
+    return await tile_flight.do(('render', tile_cache.root, key), fill)
+
+
+async def clip_tile(tile_cache, entry, x, y, z, polygon, **params):
+    """
+    Return the cache entry of tile ``entry`` made transparent outside
+    ``polygon``. The clipped copy is re-encoded from the cached index values
+    rather than by decoding and re-saving the image.
+    """
+    key = variant_cache_key(entry['key'], clip=polygon.wkb_hex)
+    clipped = await asyncio.to_thread(tile_cache.get, key, window_max_age(params))
+    if clipped is None:
+        image_bytes, _ = await fetch_tile_bytes(tile_cache, x, y, z, clip_polygon=polygon, **params)
+        clipped = await asyncio.to_thread(
+            tile_cache.put, key, image_bytes, entry['meta'], tile_extension(params)
+        )
+    return clipped
+
+
+def data_tile_cache_key(x, y, z, tile_format, clip_polygon=None, **params):
+    """Return the cache key of tile x/y/z as a ``tile_format`` data tile."""
+    variant = {'format': tile_format}
+    if tile_format == 'u16':
+        # Only the quantization range depends on the stretch, never the colormap
+        variant.update(vmin=params.get('vmin'), vmax=params.get('vmax'))
+    if clip_polygon is not None:
+        variant['clip'] = clip_polygon.wkb_hex
+    return variant_cache_key(values_cache_key(x, y, z, **params), **variant)
+
+
+def _encode_data_tile(values, x, y, z, tile_format, clip_polygon=None, vmin=None, vmax=None):
+    if clip_polygon is not None:
+        values = _mask_values(values, x, y, z, clip_polygon)
+    return encode_data_tile(values, tile_format, vmin, vmax)
+
+
+async def render_data_tile(tile_cache, x, y, z, tile_format, derive_overviews=False, clip_polygon=None, **params):
+    """
+    Return ``(entry, cached)`` for tile x/y/z as a raw ``u16``/``f32`` data
+    tile, encoded from the cached index values and stored as a .bin file.
+    Pixels outside ``clip_polygon`` are written as nodata.
+    """
+    key = data_tile_cache_key(x, y, z, tile_format, clip_polygon, **params)
+    entry = await asyncio.to_thread(tile_cache.get, key, window_max_age(params))
+    if entry is not None:
+        print(f"Cache hit for data tile: {x}_{y}_{z}")
+        metrics.count('tile_cache_hit')
+        return entry, True
+    metrics.count('tile_cache_miss')
+
+    async def fill():
+        values, meta = await tile_values(tile_cache, x, y, z, derive_overviews=derive_overviews, **params)
+        data = await asyncio.to_thread(
+            _encode_data_tile, values, x, y, z, tile_format, clip_polygon, params.get('vmin'), params.get('vmax')
+        )
+        entry = await asyncio.to_thread(tile_cache.put, key, data, meta, 'bin')
+        return entry, False
+
+    return await tile_flight.do(('data', tile_cache.root, key), fill)
+
+
+async def _process_tile(tile_cache, tile, derive_overviews=False, clip_polygon=None, tile_format=TILE_FORMAT_PNG, **params):
+    x, y, z = tile.x, tile.y, tile.z
+    if tile_format != TILE_FORMAT_PNG:
+        entry, cached = await render_data_tile(
+            tile_cache, x, y, z, tile_format,
+            derive_overviews=derive_overviews, clip_polygon=clip_polygon, **params
+        )
+        return _tile_result(x, y, z, entry, cached=cached)
+    entry, cached = await render_tile(
+        tile_cache, x, y, z, derive_overviews=derive_overviews, **params
+    )
+    if clip_polygon is not None:
+        # The unclipped tile stays cached under its own key for overviews and other farms
+        entry = await clip_tile(tile_cache, entry, x, y, z, clip_polygon, **params)
+    return _tile_result(x, y, z, entry, cached=cached)
+
+
+async def _archive_tile(tile_cache, archive, archive_id, tile, derive_overviews=False, clip_polygon=None, **params):
+    # Reuse loose cached tiles when we have them, but never add new loose images
+    x, y, z = tile.x, tile.y, tile.z
+    key = tile_cache_key(x, y, z, **params)
+    if clip_polygon is not None:
+        key = variant_cache_key(key, clip=clip_polygon.wkb_hex)
+    hit = await asyncio.to_thread(tile_cache.read, key, window_max_age(params))
+    if hit is not None:
+        # Cached bytes are already in the archive's encoding: pass them through
+        image_bytes, entry = hit
+        meta, cached = entry['meta'], True
+        metrics.count('tile_cache_hit')
+    else:
+        metrics.count('tile_cache_miss')
+        image_bytes, meta = await fetch_tile_bytes(
+            tile_cache, x, y, z, derive_overviews=derive_overviews, clip_polygon=clip_polygon, **params
+        )
+        cached = False
+    await asyncio.to_thread(archive.put, z, x, y, image_bytes)
+    return {
+        'tile': f"{x}_{y}_{z}",
+        'date': meta.get('date'),
+        'cloud_cover': meta.get('cloud_cover'),
+        'archive_id': archive_id,
+        'url': f"/api/tiles/archives/{archive_id}/{z}/{x}/{y}.{tile_extension(params)}",
+        'cached': cached,
+        'x': x,
+        'y': y,
+        'z': z
+    }
+
+
+def tile_generation_kwargs(validated_data, user_id=None):
+    """
+    Turn validated TileGenerationSerializer data into generate_tiles_and_map
+    keyword arguments, allocating an archive id when one was requested.
+    ``user_id`` scopes the ``farm_area_id`` lookup to that user's farms.
+    """
+    kwargs = dict(validated_data)
+    if user_id is not None:
+        kwargs['user_id'] = user_id
+    # How the response is delivered, and what it reports, is the view's business
+    kwargs.pop('stream', None)
+    kwargs.pop('timings', None)
+    if kwargs.pop('archive', False):
+        kwargs['archive_id'] = new_archive_id()
+    return kwargs
+
+
+@metrics.stage('map')
+def build_map(results, min_lon, min_lat, max_lon, max_lat, zoom_level, map_mode=MAP_MODE_EMBEDDED, tile_url=None, min_zoom=None):
+    """Save a folium map of ``results`` under static/maps and return its path."""
+    center_lat = (min_lat + max_lat) / 2
+    center_lon = (min_lon + max_lon) / 2
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=zoom_level-1, tiles="OpenStreetMap")
+    if map_mode == MAP_MODE_TILE_LAYER:
+        # One layer whose tiles the browser fetches (and caches) by URL
+        folium.TileLayer(
+            tiles=tile_url,
+            attr="Sentinel-2 L2A / AgriSens",
+            name="Satellite index",
+            overlay=True,
+            control=True,
+            opacity=0.8,
+            min_native_zoom=zoom_level if min_zoom is None else min_zoom,
+            max_native_zoom=zoom_level,
+            bounds=[[min_lat, min_lon], [max_lat, max_lon]],
+        ).add_to(m)
+    else:
         for result in results:
             x, y, z = result['x'], result['y'], result['z']
+            if z != zoom_level:
+                # Overview tiles would be stacked under the full-resolution ones
+                continue
             tile = mercantile.Tile(x=x, y=y, z=z)
             bounds = mercantile.bounds(tile)
             folium_bounds = [[bounds.south, bounds.west], [bounds.north, bounds.east]]
             # Use full path for folium but relative path in results
-            image_path = os.path.join(media_dir, result['file_path'])
+            image_path = os.path.join(BASE_DIR, result['file_path'])
             if os.path.exists(image_path):
                 folium.raster_layers.ImageOverlay(
                     image=image_path,
@@ -104,23 +377,291 @@ async def generate_tiles_and_map(
                 print(f"Added tile {x}_{y}_{z} to map")
             else:
                 print(f"Image not found: {image_path}")
-        folium.LayerControl().add_to(m)
-        m.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
-        
-        # Create a directory for maps if it doesn't exist
-        maps_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "maps")
-        os.makedirs(maps_dir, exist_ok=True)
-        
-        # Save map to a specific location with a more descriptive filename
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        map_filename = f"satellite_map_{int(center_lat)}_{int(center_lon)}_{timestamp}.html"
-        map_file = os.path.join(maps_dir, map_filename)
-        m.save(map_file)
-        map_path = map_file
-        
+    folium.LayerControl().add_to(m)
+    m.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
+
+    # Create a directory for maps if it doesn't exist
+    os.makedirs(MAPS_DIR, exist_ok=True)
+
+    # Save map to a specific location with a more descriptive filename
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    map_filename = f"satellite_map_{int(center_lat)}_{int(center_lon)}_{timestamp}.html"
+    map_file = os.path.join(MAPS_DIR, map_filename)
+    m.save(map_file)
+    record_artifact('maps', map_file)
+    return map_file
+
+
+async def iter_tiles_and_map(
+    min_lon=30.304434642130218, 
+    min_lat=30.174682637534644, 
+    max_lon=30.42143846734797, 
+    max_lat=30.283438554006977,
+    zoom_level=12,
+    start_date="2025-01-01",
+    end_date="2025-03-01",
+    cloud_cover=30,
+    band1="red",
+    band2="nir",
+    formula="(band2-band1)/(band2+band1)",
+    colormap_str="RdYlGn",
+    vmin=None,
+    vmax=None,
+    concurrency=DEFAULT_TILE_CONCURRENCY,
+    tile_timeout=DEFAULT_TILE_TIMEOUT,
+    map_mode=MAP_MODE_EMBEDDED,
+    tile_url_base="/",
+    archive_id=None,
+    min_zoom=None,
+    farm_area_id=None,
+    mask_outside=False,
+    user_id=None,
+    tile_format=TILE_FORMAT_PNG,
+    image_format="png",
+    compress_level=None,
+    quality=None,
+    make_map=True,
+    on_progress=None
+):
+    """
+    Render every tile of the bbox and build a folium map of the results,
+    yielding an event dict as soon as each step is done:
+
+    - ``{"event": "start", "total": n}``
+    - ``{"event": "tile", ...}`` per rendered tile, in completion order
+    - ``{"event": "failure", ...}`` per failed tile
+    - ``{"event": "done", "tiles_generated", "tiles_failed", "archive_id", "map_path"}``
+
+    Only the embedded map needs every tile record, so in the other modes
+    nothing but counters is kept in memory.
+
+    With ``map_mode="tile_layer"`` the map loads tiles from the XYZ endpoint
+    under ``tile_url_base`` instead of inlining every PNG.
+
+    When ``archive_id`` is given the tiles are packed into a single MBTiles
+    archive (see api/tile_archive.py) instead of loose cached PNGs, and the
+    map always references the archive's tile URLs.
+
+    With ``min_zoom`` the zooms below ``zoom_level`` are filled in down to
+    ``min_zoom``, each parent tile being mosaicked from its four children
+    when they are available and only rendered upstream when they are not.
+
+    With ``farm_area_id`` the bbox is replaced by the bounds of that
+    FarmArea's boundary and only tiles intersecting the polygon are
+    rendered; ``mask_outside`` also makes pixels outside it transparent.
+    Requests made for a user pass ``user_id`` so only that user's farm
+    areas are found; without it any farm area is (management commands).
+
+    With ``tile_format="u16"`` or ``"f32"`` every tile is written as a raw
+    data tile of index values for client-side rendering instead of a PNG;
+    no map is built for those since folium can only display images.
+
+    ``image_format`` picks the encoding of colored tiles: ``png`` (with
+    ``compress_level``), an 8-bit ``palette`` PNG, lossless ``webp`` or
+    ``webp_lossy`` (with ``quality``).
+
+    ``make_map=False`` only fills the tile cache, e.g. when prewarming.
+
+    ``on_progress`` is an optional coroutine function called as
+    ``await on_progress(done, total)`` once up front and after every tile.
+    """
+    tile_cache = await asyncio.to_thread(TileCache)
+
+    polygon = None
+    if farm_area_id is not None:
+        farm_areas = FarmArea.objects.all() if user_id is None else FarmArea.objects.filter(user__user_id=user_id)
+        try:
+            farm_area = await farm_areas.aget(pk=farm_area_id)
+        except FarmArea.DoesNotExist:
+            raise ValueError(f"Farm area {farm_area_id} not found")
+        polygon = farm_area_polygon(farm_area.area_coordinates)
+        min_lon, min_lat, max_lon, max_lat = polygon.bounds
+    clip_polygon = polygon if mask_outside else None
+
+    # Highest zoom first: every lower level is built from the one before it
+    min_zoom = zoom_level if min_zoom is None else min(min_zoom, zoom_level)
+    levels = [
+        tiles_in_polygon(polygon, level) if polygon is not None
+        else list(mercantile.tiles(min_lon, min_lat, max_lon, max_lat, zooms=level))
+        for level in range(zoom_level, min_zoom - 1, -1)
+    ]
+    tiles = [tile for level_tiles in levels for tile in level_tiles]
+    print(f"Number of tiles to process: {len(tiles)} (concurrency={concurrency})")
+    params = dict(
+        start_date=start_date,
+        end_date=end_date,
+        cloud_cover=cloud_cover,
+        band1=band1,
+        band2=band2,
+        formula=formula,
+        colormap_str=colormap_str,
+        vmin=vmin,
+        vmax=vmax,
+        image_format=image_format,
+        compress_level=compress_level,
+        quality=quality,
+    )
+    extension = tile_extension(params)
+    if archive_id is not None and tile_format != TILE_FORMAT_PNG:
+        raise ValueError("Only PNG tiles can be packed into an archive")
+    archive = None
+    if archive_id is not None:
+        archive = await asyncio.to_thread(MBTilesArchive, archive_path(archive_id))
+        await asyncio.to_thread(
+            archive.set_metadata,
+            name=f"satellite_{archive_id}",
+            format=extension,
+            type="overlay",
+            version="1.0",
+            bounds=f"{min_lon},{min_lat},{max_lon},{max_lat}",
+            minzoom=min_zoom,
+            maxzoom=zoom_level,
+            description=json.dumps(params),
+        )
+
+    bbox = (min_lon, min_lat, max_lon, max_lat)
+    search = None
+
+    async def find_scenes():
+        # One scene search for the whole request, started by the first tile
+        # that has to go upstream; each tile then picks its scene from it
+        nonlocal search
+        if search is None:
+            search = asyncio.ensure_future(
+                asyncio.to_thread(cached_search_scenes, bbox, start_date, end_date, cloud_cover)
+            )
+        return await asyncio.shield(search)
+
+    async def work(tile):
+        derive = tile.z < zoom_level
+        if archive is not None:
+            return await _archive_tile(
+                tile_cache, archive, archive_id, tile,
+                derive_overviews=derive, clip_polygon=clip_polygon, find_scenes=find_scenes, **params
+            )
+        return await _process_tile(
+            tile_cache, tile, derive_overviews=derive, clip_polygon=clip_polygon,
+            tile_format=tile_format, find_scenes=find_scenes, **params
+        )
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    done = 0
+    yield {'event': 'start', 'total': len(tiles)}
+    if on_progress is not None:
+        await on_progress(done, len(tiles))
+
+    async def run(tile):
+        nonlocal done
+        try:
+            # The timeout only covers the tile's own work, not time spent queued
+            async with semaphore:
+                return tile, await asyncio.wait_for(work(tile), timeout=tile_timeout)
+        except Exception as e:
+            return tile, e
+        finally:
+            done += 1
+            if on_progress is not None:
+                await on_progress(done, len(tiles))
+
+    # The embedded map inlines every tile, the other modes only need a count
+    keep_results = (
+        make_map and tile_format == TILE_FORMAT_PNG and archive_id is None and map_mode == MAP_MODE_EMBEDDED
+    )
+    results = []
+    tiles_generated = 0
+    tiles_failed = 0
+    pending = set()
+    try:
+        for level_tiles in levels:
+            pending = {asyncio.ensure_future(run(tile)) for tile in level_tiles}
+            for next_done in asyncio.as_completed(pending):
+                tile, outcome = await next_done
+                if isinstance(outcome, Exception):
+                    if isinstance(outcome, asyncio.TimeoutError):
+                        error = f"Timed out after {tile_timeout} seconds"
+                    else:
+                        error = str(outcome) or outcome.__class__.__name__
+                    print(f"Error processing tile {tile.x}_{tile.y}_{tile.z}: {error}")
+                    tiles_failed += 1
+                    metrics.count('tile_failure')
+                    yield {
+                        'event': 'failure',
+                        'tile': f"{tile.x}_{tile.y}_{tile.z}",
+                        'x': tile.x,
+                        'y': tile.y,
+                        'z': tile.z,
+                        'error': error
+                    }
+                else:
+                    tiles_generated += 1
+                    if keep_results:
+                        results.append(outcome)
+                    yield {'event': 'tile', **outcome}
+            if archive is not None:
+                await asyncio.to_thread(archive.flush)
+    finally:
+        # The consumer may stop early (e.g. a client disconnecting mid-stream)
+        for task in pending:
+            task.cancel()
+        if archive is not None:
+            # Writes the last partial batch in one transaction
+            await asyncio.to_thread(archive.close)
+            await asyncio.to_thread(record_artifact, 'tile_archives', archive.path)
+
+    map_path = None
+    if make_map and tiles_generated and tile_format == TILE_FORMAT_PNG:
+        tile_url = None
+        if archive_id is not None:
+            map_mode = MAP_MODE_TILE_LAYER
+            tile_url = f"{tile_url_base.rstrip('/')}/api/tiles/archives/{archive_id}/{{z}}/{{x}}/{{y}}.{extension}"
+        elif map_mode == MAP_MODE_TILE_LAYER:
+            query = {name: value for name, value in params.items() if value is not None}
+            if clip_polygon is not None:
+                # The page is viewed without the user's token, so it carries a signed reference
+                query.update(clip_token=farm_area_clip_token(farm_area_id), mask_outside="true")
+            tile_url = f"{tile_url_base.rstrip('/')}/api/tiles/{{z}}/{{x}}/{{y}}.{extension}?{urlencode(query)}"
+        map_path = await asyncio.to_thread(
+            build_map, results, min_lon, min_lat, max_lon, max_lat, zoom_level, map_mode, tile_url, min_zoom
+        )
+    yield {
+        'event': 'done',
+        'tiles_generated': tiles_generated,
+        'tiles_failed': tiles_failed,
+        'archive_id': archive_id,
+        'map_path': map_path,
+    }
+
+
+def _tile_order(record):
+    # mercantile order: highest zoom first, then column-major within a zoom
+    return -record['z'], record['x'], record['y']
+
+
+async def generate_tiles_and_map(include_map_html=True, **kwargs):
+    """
+    Run iter_tiles_and_map to completion and return
+    ``(results, failures, map_path, map_html)``, with results and failures
+    in tile order. ``include_map_html=False`` skips reading the saved page
+    back into memory.
+    """
+    results = []
+    failures = []
+    map_path = None
+    async for event in iter_tiles_and_map(**kwargs):
+        kind = event.pop('event')
+        if kind == 'tile':
+            results.append(event)
+        elif kind == 'failure':
+            failures.append(event)
+        elif kind == 'done':
+            map_path = event['map_path']
+    results.sort(key=_tile_order)
+    failures.sort(key=_tile_order)
+    map_html = None
+    if map_path and include_map_html:
         # Read the HTML content from the saved file
-        with open(map_file, 'r', encoding='utf-8') as f:
+        with open(map_path, 'r', encoding='utf-8') as f:
             map_html = f.read()
-            
-    # Return results, map_path, and the HTML content
-    return results, map_path, map_html
+
+    # Return results, per-tile failures, map_path, and the HTML content
+    return results, failures, map_path, map_html
@@ -1,26 +1,40 @@
 import os
 import asyncio
-import tempfile
 import json
-from django.http import FileResponse, Http404
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from drf_spectacular.utils import extend_schema, OpenApiExample
+from rest_framework.exceptions import NotAuthenticated, NotFound, ValidationError
+from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiResponse
 from account.models import Profile,Account
 from account.serializers import ProfileSerializer,RegisterSerializer,LandSerializer
-from .utils import generate_tiles_and_map
-from .schemas import register_schema,land_schema, tile_generation_schema, TileGenerationSerializer, time_series_schema, TimeSeriesSerializer
-from .models import Land, FarmArea
-from .serializers import FarmAreaSerializer
+from . import metrics
+from .rendering import IMAGE_FORMATS
+from .retention import touch_artifact
+from .time_series import find_time_series_job, output_dir_for, time_series_cache_key
+from .zonal import farm_zonal_stats
+from .utils import (
+    MAPS_DIR, clip_tile, generate_tiles_and_map, iter_tiles_and_map, render_data_tile, render_tile,
+    tile_generation_kwargs
+)
+from .geometry import farm_area_id_from_clip_token, farm_area_polygon
+from .tile_archive import MBTilesArchive, archive_path
+from .tile_cache import TileCache, tile_cache_key, variant_cache_key, window_max_age
+from .schemas import register_schema,land_schema, tile_job_schema, tile_generation_schema, tile_schema, data_tile_schema, time_series_schema, TileClipSerializer, TileGenerationSerializer, TileParamsSerializer, TimeSeriesSerializer, ZonalStatsSerializer
+from .models import Land, FarmArea, Job
+from .serializers import FarmAreaSerializer, JobSerializer
+from .jobs import enqueue
 from django.shortcuts import get_object_or_404 # For fetching objects or 404
 from rest_framework import viewsets # Add viewsets import
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 import glob
-import uuid
 
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
@@ -152,9 +166,184 @@ class LandView(APIView):
 
 
 
-class TileGenerationView(APIView):
-    # permission_classes = [IsAuthenticated]
+def owned_farm_area(user, farm_area_id):
+    """
+    Return farm area ``farm_area_id`` if it belongs to ``user`` (the
+    request's user). Raises NotAuthenticated for anonymous requests and
+    NotFound for other users' farms, so no endpoint reveals that they exist.
+    """
+    if not user or not user.is_authenticated:
+        raise NotAuthenticated("Authentication required to use farm_area_id")
+    try:
+        return FarmArea.objects.get(pk=farm_area_id, user__user=user)
+    except FarmArea.DoesNotExist:
+        raise NotFound("Farm area not found")
+
+
+def _farm_area_clip(farm_area):
+    try:
+        return farm_area_polygon(farm_area.area_coordinates)
+    except ValueError as e:
+        raise ValidationError({"error": str(e)})
+
+
+class AsyncJSONView(APIView):
+    """
+    Base class for natively async endpoints.
+
+    APIView.dispatch calls its handlers synchronously; this dispatch awaits
+    ``async def`` handlers on the server's event loop under ASGI instead.
+    Authentication, permissions, throttling and exception handling are
+    APIView's own. The checks may query the database, so they run in a
+    thread.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    @staticmethod
+    def error(message, status_code=status.HTTP_400_BAD_REQUEST, **extra):
+        return JsonResponse({"error": message, **extra}, status=status_code)
+
+    async def clip_polygon(self, request):
+        """
+        Resolve the clip parameters of a tile request to a polygon, or None
+        without clipping. ``farm_area_id`` needs the owner's token (see
+        owned_farm_area); ``clip_token`` is the signed reference generated
+        maps use instead.
+        """
+        serializer = TileClipSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        clip = serializer.validated_data
+        if not clip["mask_outside"]:
+            return None
+        if clip.get("farm_area_id") is not None:
+            farm_area = await sync_to_async(owned_farm_area)(request.user, clip["farm_area_id"])
+            return _farm_area_clip(farm_area)
+        if clip.get("clip_token"):
+            try:
+                farm_area_id = farm_area_id_from_clip_token(clip["clip_token"])
+                farm_area = await FarmArea.objects.aget(pk=farm_area_id)
+            except ValueError as e:
+                raise ValidationError({"error": str(e)})
+            except FarmArea.DoesNotExist:
+                raise NotFound("Farm area not found")
+            return _farm_area_clip(farm_area)
+        return None
+
+
+def _map_url(map_path):
+    return f"/api/tile-map/?path={os.path.basename(map_path)}" if map_path else None
+
+
+def _encode_stream_event(event, stream):
+    if stream == "sse":
+        name = event.pop("event")
+        return f"event: {name}\ndata: {json.dumps(event)}\n\n"
+    return json.dumps(event) + "\n"
+
+
+class TileGenerationView(AsyncJSONView):
+
+    async def stream(self, kwargs, stream, tile_url_base, timings=False):
+        """Yield every iter_tiles_and_map event encoded as an NDJSON line or an SSE message."""
+        try:
+            with metrics.collect() as collected:
+                async for event in iter_tiles_and_map(**kwargs, tile_url_base=tile_url_base):
+                    if event["event"] == "done":
+                        event["map_url"] = _map_url(event.pop("map_path"))
+                        if timings:
+                            event["timings"] = collected.as_dict()
+                    yield _encode_stream_event(event, stream)
+        except Exception as e:
+            # The status line is long gone, so report the failure in-band
+            yield _encode_stream_event(
+                {"event": "error", "error": f"Failed to generate tiles and map: {str(e)}"}, stream
+            )
+
     @tile_generation_schema
+    async def post(self, request):
+        serializer = TileGenerationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        stream = serializer.validated_data.get("stream")
+        timings = serializer.validated_data["timings"]
+        user_id = None
+        if serializer.validated_data.get("farm_area_id") is not None:
+            # Check ownership up front: a stream can no longer answer 404
+            farm_area = await sync_to_async(owned_farm_area)(request.user, serializer.validated_data["farm_area_id"])
+            _farm_area_clip(farm_area)
+            user_id = request.user.pk
+        if stream:
+            kwargs = tile_generation_kwargs(serializer.validated_data, user_id=user_id)
+            kwargs.pop("include_map_html")
+            response = StreamingHttpResponse(
+                self.stream(kwargs, stream, request.build_absolute_uri("/"), timings),
+                content_type="text/event-stream" if stream == "sse" else "application/x-ndjson",
+            )
+            response["Cache-Control"] = "no-cache"
+            # Stop nginx from buffering the stream
+            response["X-Accel-Buffering"] = "no"
+            return response
+        try:
+            kwargs = tile_generation_kwargs(serializer.validated_data, user_id=user_id)
+            with metrics.collect() as collected:
+                results, failures, map_path, map_html = await generate_tiles_and_map(
+                    **kwargs, tile_url_base=request.build_absolute_uri("/")
+                )
+            body = {
+                "message": "Tile generation and map creation completed successfully",
+                "tiles_generated": len(results) if results else 0,
+                "tiles_failed": len(failures),
+                "archive_id": kwargs.get("archive_id"),
+                "results": results,
+                "failures": failures,
+                "map_url": _map_url(map_path),
+                "map_html": map_html
+            }
+            if timings:
+                body["timings"] = collected.as_dict()
+            return JsonResponse(body, status=status.HTTP_200_OK)
+        except Exception as e:
+            return self.error(f"Failed to generate tiles and map: {str(e)}")
+
+
+class MetricsView(View):
+    """
+    Tile pipeline stage histograms and cache counters of this process in the
+    Prometheus text format. Every server process keeps its own, so scrape
+    each worker (or run a single one) for complete numbers.
+    """
+    def get(self, request):
+        return HttpResponse(
+            metrics.registry.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+class TileJobView(APIView):
+    """
+    Queue tile generation as a background job drained by ``manage.py run_jobs``.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @tile_job_schema
     def post(self, request):
         serializer = TileGenerationSerializer(data=request.data)
         if not serializer.is_valid():
@@ -162,26 +351,169 @@ class TileGenerationView(APIView):
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
+        params = dict(serializer.validated_data)
+        if params.get("farm_area_id") is not None:
+            owned_farm_area(request.user, params["farm_area_id"])
+            # The worker runs without a request; it scopes the lookup by this user
+            params["user_id"] = request.user.pk
+        job = enqueue(Job.KIND_TILES, params, user=request.user)
+        return Response(
+            {
+                "message": "Tile generation job queued",
+                "job_id": str(job.id),
+                "status_url": f"/api/jobs/{job.id}/",
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class JobStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        responses={200: JobSerializer},
+        description="Get the status, progress, ETA and result of a background job"
+    )
+    def get(self, request, job_id):
+        # Other users' jobs are not found
+        job = get_object_or_404(Job, pk=job_id, user=request.user)
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+def _tile_cache_control(params):
+    # Tiles for a date window that is still open are recomputed with new scenes
+    # after the same max age on the server, so a revalidation then sees a new ETag
+    max_age = window_max_age(params)
+    if max_age is not None:
+        return f"public, max-age={max_age}"
+    return f"public, max-age={getattr(settings, 'TILE_CACHE_MAX_AGE', 604800)}, immutable"
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class TileView(AsyncJSONView):
+    """
+    Render a single slippy-map tile on demand, served from the tile cache when possible.
+    The URL ``extension`` (png or webp) picks the default ``image_format``.
+    """
+    extension = "png"
+
+    @tile_schema
+    async def get(self, request, z, x, y):
+        if z > 24 or x >= 2 ** z or y >= 2 ** z:
+            return self.error("Tile coordinates out of range")
+        query = request.query_params.copy()
+        query.setdefault("image_format", self.extension)
+        serializer = TileParamsSerializer(data=query)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+        if IMAGE_FORMATS[params["image_format"]][1] != self.extension:
+            return self.error(f"image_format {params['image_format']} does not match the .{self.extension} extension")
+        clip_polygon = await self.clip_polygon(request)
+        tile_cache = await asyncio.to_thread(TileCache)
+        # Answer revalidations straight from the manifest without touching the tile
+        key = tile_cache_key(x, y, z, **params)
+        if clip_polygon is not None:
+            key = variant_cache_key(key, clip=clip_polygon.wkb_hex)
+        entry = await asyncio.to_thread(tile_cache.get, key, window_max_age(params))
+        if entry is None:
+            try:
+                entry, _ = await render_tile(tile_cache, x, y, z, **params)
+                if clip_polygon is not None:
+                    entry = await clip_tile(tile_cache, entry, x, y, z, clip_polygon, **params)
+            except Exception as e:
+                return self.error(f"Failed to generate tile: {str(e)}")
+        etag = f'"{entry["etag"]}"'
+        if _etag_matches(request, etag):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(
+                await asyncio.to_thread(_read_file, entry["path"]),
+                content_type=IMAGE_FORMATS[params["image_format"]][0],
+            )
+        response["ETag"] = etag
+        response["Cache-Control"] = _tile_cache_control(params)
+        return response
+
+
+class TileDataView(AsyncJSONView):
+    """
+    Serve tile x/y/z as raw index values (``tile_format`` is ``u16`` or
+    ``f32``, see api/rendering.py) so clients can threshold and color it locally.
+    """
+    tile_format = "u16"
+
+    @data_tile_schema
+    async def get(self, request, z, x, y):
+        if z > 24 or x >= 2 ** z or y >= 2 ** z:
+            return self.error("Tile coordinates out of range")
+        serializer = TileParamsSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+        clip_polygon = await self.clip_polygon(request)
+        tile_cache = await asyncio.to_thread(TileCache)
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            results, map_path, map_html = loop.run_until_complete(generate_tiles_and_map(**serializer.validated_data))
-            loop.close()
-            return Response(
-                {
-                    "message": "Tile generation and map creation completed successfully",
-                    "tiles_generated": len(results) if results else 0,
-                    "results": results,
-                    "map_url": f"/api/tile-map/?path={os.path.basename(map_path)}" if map_path else None,
-                    "map_html": map_html
-                },
-                status=status.HTTP_200_OK
+            entry, _ = await render_data_tile(
+                tile_cache, x, y, z, self.tile_format, clip_polygon=clip_polygon, **params
             )
         except Exception as e:
-            return Response(
-                {"error": f"Failed to generate tiles and map: {str(e)}"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            return self.error(f"Failed to generate tile: {str(e)}")
+        etag = f'"{entry["etag"]}"'
+        if _etag_matches(request, etag):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(await asyncio.to_thread(_read_file, entry["path"]), content_type="application/octet-stream")
+        response["ETag"] = etag
+        response["Cache-Control"] = _tile_cache_control(params)
+        return response
+
+
+class TileArchiveView(APIView):
+    """
+    Serve a tile straight out of an MBTiles archive written by generate_tiles_and_map.
+    The URL ``extension`` must match the archive's tile format.
+    """
+    extension = "png"
+
+    @extend_schema(
+        responses={200: OpenApiResponse(description="PNG or WebP tile"), 404: OpenApiResponse(description="Archive or tile not found")},
+        description="Get one tile from a packaged MBTiles tile set"
+    )
+    def get(self, request, archive_id, z, x, y):
+        try:
+            path = archive_path(archive_id)
+        except ValueError:
+            raise Http404
+        if not os.path.exists(path):
+            raise Http404
+        with MBTilesArchive(path, readonly=True) as archive:
+            tile_format = archive.get_metadata("format", "png")
+            data = archive.get(z, x, y) if tile_format == self.extension else None
+        if data is None:
+            raise Http404
+        touch_artifact(path)
+        # Archives are written once, so the tile address is a stable validator
+        etag = f'"{archive_id}-{z}-{x}-{y}"'
+        if _etag_matches(request, etag):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(data, content_type=f"image/{tile_format}")
+        response["ETag"] = etag
+        response["Cache-Control"] = f"public, max-age={getattr(settings, 'TILE_CACHE_MAX_AGE', 604800)}, immutable"
+        return response
 
 
 class TileMapView(APIView):
@@ -192,12 +524,14 @@ class TileMapView(APIView):
                 {"error": "No map file specified"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        map_path = os.path.join(tempfile.gettempdir(), map_filename)
+        # Maps are saved by build_map under static/maps; never follow a client path
+        map_path = os.path.join(MAPS_DIR, os.path.basename(map_filename))
         if not os.path.exists(map_path):
             return Response(
                 {"error": "Map file not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        touch_artifact(map_path)
         return FileResponse(
             open(map_path, 'rb'),
             content_type='text/html'
@@ -439,87 +773,140 @@ class FarmAreaDetailView(APIView):
         farm_area.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class TimeSeriesView(APIView):
+class TimeSeriesView(AsyncJSONView):
     """
-    Compute time series using VirtuGhan Python package directly and return GIF and values file.
+    Queue a VirtuGhan time-series computation as a background job drained by
+    ``manage.py run_jobs`` and return its request id right away.
+
+    A request matching an earlier one (see time_series_cache_key) gets that
+    request's id instead: its result straight away when it is still fresh,
+    or the id of the identical job that is still queued or running. Jobs
+    belong to the requesting user.
     """
+    permission_classes = [IsAuthenticated]
+
     @time_series_schema
-    def post(self, request):
+    async def post(self, request):
         serializer = TimeSeriesSerializer(data=request.data)
         if not serializer.is_valid():
-            return Response(
-                serializer.errors,
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        try:
-            from vcube.engine import VCubeProcessor
-            import mercantile
-            payload = serializer.validated_data
-            # Create a unique output directory for this request
-            unique_id = str(uuid.uuid4())
-            base_output_dir = os.path.abspath("media/virtughan_output")
-            output_dir = os.path.join(base_output_dir, unique_id)
-            os.makedirs(output_dir, exist_ok=True)
-            processor = VCubeProcessor(
-                bbox=[payload["min_lon"], payload["min_lat"], payload["max_lon"], payload["max_lat"]],
-                start_date=payload["start_date"],
-                end_date=payload["end_date"],
-                cloud_cover=payload["cloud_cover"],
-                formula=payload["formula"],
-                band1=payload["band1"],
-                band2=payload["band2"],
-                operation=payload["operation"],
-                timeseries=payload["timeseries"],
-                output_dir=output_dir,
-                workers=payload["workers"]
-            )
-            result = processor.compute()
-            # Find GIF and values file
-            gif_file = None
-            values_file = None
-            gif_filename = None
-            values_filename = None
-            for f in os.listdir(output_dir):
-                if f.endswith('.gif'):
-                    gif_file = os.path.abspath(os.path.join(output_dir, f))
-                    gif_filename = f
-                elif f.startswith('values_over_time'):
-                    values_file = os.path.abspath(os.path.join(output_dir, f))
-                    values_filename = f
-            # Delete all other files in output_dir
-            for f in os.listdir(output_dir):
-                full_path = os.path.abspath(os.path.join(output_dir, f))
-                if full_path != gif_file and full_path != values_file:
-                    os.remove(full_path)
-            if not gif_file or not values_file:
-                return Response({"error": "Required output files not found."}, status=status.HTTP_400_BAD_REQUEST)
-            # Return media paths instead of full paths
-            gif_media_path = f"media/virtughan_output/{unique_id}/{gif_filename}"
-            values_media_path = f"media/virtughan_output/{unique_id}/{values_filename}"
-            return Response(
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        cache_key = time_series_cache_key(serializer.validated_data)
+        job = await sync_to_async(find_time_series_job)(cache_key, request.user)
+        if job is not None and job.status == Job.STATUS_SUCCEEDED:
+            await sync_to_async(touch_artifact)(output_dir_for(job.id))
+            return JsonResponse(
                 {
-                    "message": "Time series computation completed successfully!",
-                    "gif_file_path": gif_media_path,
-                    "values_file_path": values_media_path,
-                    "output_dir": f"media/virtughan_output/{unique_id}",
-                    "request_id": unique_id
+                    **job.result,
+                    "status_url": f"/api/time_series/{job.id}/",
+                    "gif_url": f"/api/time_series/{job.id}/gif/",
+                    "values_url": f"/api/time_series/{job.id}/values/",
+                    "cached": True,
                 },
                 status=status.HTTP_200_OK
             )
-        except ImportError:
-            return Response(
-                {
-                    "error": "VirtuGhan package not installed. Install with: pip install VirtuGhan",
-                    "detail": "The VirtuGhan package is required for this endpoint to work."
-                },
-                status=status.HTTP_400_BAD_REQUEST
+        if job is None:
+            job = await sync_to_async(enqueue)(
+                Job.KIND_TIME_SERIES, serializer.validated_data, cache_key=cache_key, user=request.user
             )
+        return JsonResponse(
+            {
+                "message": "Time series computation queued",
+                "request_id": str(job.id),
+                "status_url": f"/api/time_series/{job.id}/",
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class FarmAreaStatsView(AsyncJSONView):
+    """
+    Per-date statistics of a band index inside a farm area's boundary.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[ZonalStatsSerializer],
+        responses={200: OpenApiResponse(description="Statistics per acquisition date"), 404: OpenApiResponse(description="Farm area not found")},
+        description="Get mean, median, percentiles and valid-pixel fraction of an index inside a farm area for every scene in a date range"
+    )
+    async def get(self, request, pk):
+        farm_area = await sync_to_async(owned_farm_area)(request.user, pk)
+        serializer = ZonalStatsSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+        try:
+            polygon = farm_area_polygon(farm_area.area_coordinates)
+            stats = await farm_zonal_stats(
+                polygon, params["start_date"], params["end_date"], params["cloud_cover"],
+                params["band1"], params["band2"], params["formula"],
+                percentiles=params["percentiles"], concurrency=params["concurrency"],
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(
-                {
-                    "error": f"VirtuGhan computation failed: {str(e)}",
-                    "detail": "An error occurred during the time series computation."
-                },
+                {"error": f"Failed to compute statistics: {str(e)}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return Response(
+            {
+                "farm_area_id": farm_area.pk,
+                "start_date": params["start_date"],
+                "end_date": params["end_date"],
+                "formula": params["formula"],
+                **stats,
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+def _time_series_job(request, request_id):
+    # Other users' requests are not found
+    return get_object_or_404(Job, pk=request_id, kind=Job.KIND_TIME_SERIES, user=request.user)
+
 
+class TimeSeriesStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        responses={200: JobSerializer},
+        description="Get the status, phase, progress and, once done, the output files of a time-series request"
+    )
+    def get(self, request, request_id):
+        job = _time_series_job(request, request_id)
+        body = {"request_id": str(job.id), **JobSerializer(job).data}
+        if job.status == Job.STATUS_SUCCEEDED:
+            body["gif_url"] = f"/api/time_series/{job.id}/gif/"
+            body["values_url"] = f"/api/time_series/{job.id}/values/"
+        return Response(body, status=status.HTTP_200_OK)
+
+
+class TimeSeriesFileView(APIView):
+    """
+    Serve the GIF or the values-over-time chart of a finished time-series request.
+    """
+    permission_classes = [IsAuthenticated]
+    content_types = {"gif": "image/gif", "values": "image/png"}
+
+    @extend_schema(
+        responses={200: OpenApiResponse(description="GIF or PNG file"), 404: OpenApiResponse(description="Unknown request or not finished")},
+        description="Download an output file of a finished time-series request"
+    )
+    def get(self, request, request_id, name):
+        job = _time_series_job(request, request_id)
+        if job.status != Job.STATUS_SUCCEEDED:
+            return Response(
+                {"error": f"Time series request is {job.status}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        output_dir = output_dir_for(job.id)
+        path = os.path.join(output_dir, os.path.basename(job.result[f"{name}_file_path"]))
+        if not os.path.exists(path):
+            # Swept by the retention policy
+            return Response(
+                {"error": "Output file no longer available"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        touch_artifact(output_dir)
+        return FileResponse(open(path, 'rb'), content_type=self.content_types[name])
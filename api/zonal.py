@@ -0,0 +1,147 @@
+import asyncio
+import math
+from collections import namedtuple
+
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.transform import from_bounds
+from rasterio.warp import transform_geom
+from shapely.geometry import mapping, shape
+
+from .rendering import evaluate_formula, read_band_part
+from .stac import cached_search_scenes
+
+WEB_MERCATOR = CRS.from_epsg(3857)
+# Ground resolution of the statistics grid in metres: Sentinel-2's finest bands
+DEFAULT_RESOLUTION = 10
+# Coarser pixels are used for farms that would need a bigger grid
+MAX_GRID_SIZE = 2048
+DEFAULT_PERCENTILES = (10, 25, 75, 90)
+# Scenes read at the same time
+DEFAULT_SCENE_CONCURRENCY = 8
+
+ZonalGrid = namedtuple('ZonalGrid', ['bounds', 'width', 'height', 'resolution', 'mask'])
+
+
+def polygon_grid(polygon, resolution=DEFAULT_RESOLUTION):
+    """
+    Lay a Web Mercator grid of roughly ``resolution`` metre pixels over
+    ``polygon`` (longitude/latitude) and rasterize the polygon into it once.
+    Returns a ZonalGrid whose ``mask`` is True inside the polygon.
+    """
+    geometry = transform_geom('EPSG:4326', WEB_MERCATOR, mapping(polygon))
+    min_x, min_y, max_x, max_y = shape(geometry).bounds
+    # Mercator metres stretch by 1/cos(latitude)
+    pixel = resolution / math.cos(math.radians(polygon.centroid.y))
+    width = max(1, math.ceil((max_x - min_x) / pixel))
+    height = max(1, math.ceil((max_y - min_y) / pixel))
+    if max(width, height) > MAX_GRID_SIZE:
+        pixel *= max(width, height) / MAX_GRID_SIZE
+        width = max(1, math.ceil((max_x - min_x) / pixel))
+        height = max(1, math.ceil((max_y - min_y) / pixel))
+    bounds = (min_x, max_y - height * pixel, min_x + width * pixel, max_y)
+    transform = from_bounds(*bounds, width, height)
+    mask = ~geometry_mask([geometry], out_shape=(height, width), transform=transform)
+    if not mask.any():
+        # Slivers narrower than a pixel: count every pixel they touch
+        mask = ~geometry_mask([geometry], out_shape=(height, width), transform=transform, all_touched=True)
+    resolution = pixel * math.cos(math.radians(polygon.centroid.y))
+    return ZonalGrid(bounds, width, height, resolution, mask)
+
+
+def scenes_by_date(features, polygon):
+    """
+    Pick one scene per acquisition date among ``features``: one containing
+    the whole polygon if there is one, otherwise the one covering most of
+    it, the least cloudy winning ties. Returned in date order.
+    """
+    best = {}
+    for feature in features:
+        geometry = shape(feature["geometry"])
+        if not geometry.intersects(polygon):
+            continue
+        date = feature["properties"]["datetime"][:10]
+        rank = (
+            geometry.contains(polygon),
+            geometry.intersection(polygon).area,
+            -feature["properties"].get("eo:cloud_cover", 100),
+        )
+        if date not in best or rank > best[date][0]:
+            best[date] = (rank, feature)
+    return [best[date][1] for date in sorted(best)]
+
+
+def zonal_statistics(values, mask, percentiles=DEFAULT_PERCENTILES):
+    """
+    Summarize the ``values`` inside ``mask``. ``valid_fraction`` is the
+    share of the polygon's pixels with data (not clouds masked as nodata,
+    not outside the scene); the other statistics are over those pixels.
+    """
+    inside = values[mask]
+    valid = inside[~np.isnan(inside)]
+    stats = {"valid_fraction": round(valid.size / inside.size, 4) if inside.size else 0.0}
+    if not valid.size:
+        return stats
+    quantiles = np.percentile(valid, [50, *percentiles])
+    stats.update(
+        mean=round(float(valid.mean()), 4),
+        median=round(float(quantiles[0]), 4),
+        std=round(float(valid.std()), 4),
+        min=round(float(valid.min()), 4),
+        max=round(float(valid.max()), 4),
+    )
+    for percentile, quantile in zip(percentiles, quantiles[1:]):
+        stats[f"p{percentile:g}"] = round(float(quantile), 4)
+    return stats
+
+
+async def farm_zonal_stats(polygon, start_date, end_date, cloud_cover, band1, band2, formula,
+                           percentiles=DEFAULT_PERCENTILES, concurrency=DEFAULT_SCENE_CONCURRENCY):
+    """
+    Return per-date statistics of ``formula`` inside ``polygon``: every
+    scene is read straight onto one grid, so the polygon is rasterized a
+    single time, and nothing is written to disk.
+    """
+    grid = await asyncio.to_thread(polygon_grid, polygon)
+    features = await asyncio.to_thread(cached_search_scenes, polygon.bounds, start_date, end_date, cloud_cover)
+    scenes = scenes_by_date(features, polygon)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def scene_stats(feature):
+        async with semaphore:
+            reads = [asyncio.to_thread(
+                read_band_part, feature["assets"][band1]["href"], grid.bounds, WEB_MERCATOR, grid.width, grid.height
+            )]
+            if band2:
+                reads.append(asyncio.to_thread(
+                    read_band_part, feature["assets"][band2]["href"], grid.bounds, WEB_MERCATOR, grid.width, grid.height
+                ))
+            bands = await asyncio.gather(*reads)
+            values = await asyncio.to_thread(evaluate_formula, formula, *bands)
+        return {
+            "date": feature["properties"]["datetime"][:10],
+            "scene": feature.get("id"),
+            "cloud_cover": feature["properties"].get("eo:cloud_cover"),
+            **zonal_statistics(values, grid.mask, percentiles),
+        }
+
+    outcomes = await asyncio.gather(*(scene_stats(feature) for feature in scenes), return_exceptions=True)
+    results = []
+    failures = []
+    for feature, outcome in zip(scenes, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"Error computing statistics for scene {feature.get('id')}: {outcome}")
+            failures.append({
+                "date": feature["properties"]["datetime"][:10],
+                "scene": feature.get("id"),
+                "error": str(outcome) or outcome.__class__.__name__,
+            })
+        else:
+            results.append(outcome)
+    return {
+        "pixels": int(grid.mask.sum()),
+        "resolution_m": round(grid.resolution, 2),
+        "scenes": results,
+        "failures": failures,
+    }